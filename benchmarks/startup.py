@@ -0,0 +1,72 @@
+"""Measure how long `github-activity` takes to make its first request.
+
+Each run starts the CLI in a fresh Python process, like a release script
+would, and stops it just before its first request to the GitHub API. No
+request is made, so no token or network is needed.
+
+    python benchmarks/startup.py [--runs N] [-- CLI ARGUMENTS]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+DEFAULT_CLI_ARGS = ["executablebooks/github-activity", "-s", "2021-01-01"]
+
+# Runs the CLI, printing the time of the first request and exiting before it
+CHILD = """\
+import os, sys, threading, time
+import requests.adapters
+
+first = threading.Lock()
+
+def send(*args, **kwargs):
+    # Requests may be sent from several threads at once
+    first.acquire()
+    print(time.time(), flush=True)
+    os._exit(0)
+
+requests.adapters.HTTPAdapter.send = send
+sys.argv = ["github-activity", *sys.argv[1:]]
+from github_activity.cli import main
+main()
+"""
+
+
+def time_to_first_request(cli_args):
+    """Return the seconds from starting the CLI to its first request."""
+    env = {"GITHUB_ACCESS_TOKEN": "not-a-token", **os.environ}
+    start = time.time()
+    out = subprocess.run(
+        [sys.executable, "-c", CHILD, *cli_args],
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        text=True,
+    )
+    if not out.stdout.strip():
+        raise RuntimeError(f"github-activity {' '.join(cli_args)} made no request")
+    return float(out.stdout.split()[-1]) - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("cli_args", nargs="*", default=DEFAULT_CLI_ARGS)
+    args = parser.parse_args()
+
+    # The first run warms up the filesystem cache, like any run after it would
+    time_to_first_request(args.cli_args)
+    times = [time_to_first_request(args.cli_args) for _ in range(args.runs)]
+    print(
+        f"Time to first request: {statistics.median(times) * 1000:.0f} ms "
+        f"(min {min(times) * 1000:.0f} ms, max {max(times) * 1000:.0f} ms, "
+        f"{args.runs} runs)"
+    )
+
+
+if __name__ == "__main__":
+    main()
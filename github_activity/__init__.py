@@ -1,4 +1,12 @@
 __version__ = "1.1.7"
 __all__ = ["get_activity", "generate_activity_md"]
 
-from .github_activity import get_activity, generate_activity_md
+
+def __getattr__(name):
+    # Import the API on first use, so that importing the package (e.g. to run
+    # the command line interface) doesn't import all of it
+    if name in __all__:
+        from . import github_activity
+
+        return getattr(github_activity, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
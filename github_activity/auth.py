@@ -1,3 +1,5 @@
+import itertools
+
 from requests.auth import AuthBase
 
 
@@ -15,3 +17,55 @@ class TokenAuth(AuthBase):
         # add token to auth
         r.headers["Authorization"] = f"Bearer {self.token}"
         return r
+
+
+class TokenPool(AuthBase):
+    """Spread requests over several tokens, e.g. GitHub App installation tokens.
+
+    `GitHubClient` picks the token with the most rate limit budget left for
+    each request, and sets a token aside once its budget is used up until it
+    resets. Used directly with `requests`, the tokens take turns.
+    """
+
+    def __init__(self, tokens):
+        # Drop duplicates, which would otherwise share a budget
+        tokens = list(dict.fromkeys(tokens))
+        if not tokens:
+            raise ValueError("A token pool needs at least one token.")
+        self.auths = [TokenAuth(token) for token in tokens]
+        self._turn = itertools.count()
+
+    @property
+    def tokens(self):
+        return [auth.token for auth in self.auths]
+
+    def _rotated(self):
+        start = next(self._turn) % len(self.auths)
+        return self.auths[start:] + self.auths[:start]
+
+    def select(self, rate_limit, resource):
+        """Return the `TokenAuth` to make the next request to `resource` with.
+
+        Tokens with the same budget left take turns.
+        """
+        return max(
+            self._rotated(),
+            key=lambda auth: rate_limit.headroom(rate_limit.key(auth, resource)),
+        )
+
+    def __call__(self, r):
+        return self._rotated()[0](r)
+
+
+def as_auth(auth):
+    """Return the `requests` auth for a token, a list of tokens or an auth.
+
+    A string of comma-separated tokens is treated as a list of tokens.
+    """
+    if isinstance(auth, AuthBase):
+        return auth
+    if isinstance(auth, str):
+        if "," not in auth:
+            return TokenAuth(auth)
+        auth = [token.strip() for token in auth.split(",") if token.strip()]
+    return TokenPool(auth)
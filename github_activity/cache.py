@@ -1,12 +1,17 @@
+import json
 import sys
 from pathlib import Path
 
-import pandas as pd
-
 DEFAULT_PATH_CACHE = Path("~/data_github_activity").expanduser()
 
 
 def _cache_data(query_data, path_cache):
+    """Add issues/PRs and their comments to the cache.
+
+    Items that are already in the cache are replaced by their new version.
+    """
+    import pandas as pd
+
     if path_cache is True:
         path_cache = DEFAULT_PATH_CACHE
     path_cache = Path(path_cache)
@@ -26,38 +31,24 @@ def _cache_data(query_data, path_cache):
                 out = "pr"
             return out
 
-        query_data["kind"] = query_data["url"].map(_categorize_item)
+        idata = idata.assign(kind=idata["url"].map(_categorize_item))
 
         # PRs cache
-        data_prs = query_data.query("kind == 'pr'")
-        path_pr_cache = path_repo_cache.joinpath("prs.csv")
-        if path_pr_cache.exists():
-            prs_cache = pd.read_csv(path_pr_cache)
-            prs_cache = prs_cache.append(data_prs, sort=False).drop_duplicates(
-                subset=["url"]
-            )
-        else:
-            prs_cache = data_prs
-        prs_cache.to_csv(path_pr_cache, index=False)
+        _upsert_csv(path_repo_cache.joinpath("prs.csv"), idata.query("kind == 'pr'"))
 
         # Issues cache
-        data_issues = query_data.query("kind == 'issue'")
-        path_issues_cache = path_repo_cache.joinpath("issues.csv")
-        if path_issues_cache.exists():
-            issues_cache = pd.read_csv(path_pr_cache)
-            issues_cache = issues_cache.append(data_issues, sort=False).drop_duplicates(
-                subset=["url"]
-            )
-        else:
-            issues_cache = data_issues
-        issues_cache.to_csv(path_issues_cache, index=False)
+        _upsert_csv(
+            path_repo_cache.joinpath("issues.csv"), idata.query("kind == 'issue'")
+        )
 
         # Comments collect
         data_comments = []
         for _, iitems in idata.iterrows():
+            if not isinstance(iitems["comments"], dict):
+                continue
             for icomment in iitems["comments"]["edges"]:
                 this_comment = {}
-                this_comment["author"] = icomment["node"]["author"]["login"]
+                this_comment["author"] = (icomment["node"]["author"] or {}).get("login")
                 if not this_comment["author"]:
                     # This happens if the GitHub user has been deleted
                     # ref: https://github.com/jupyterhub/oauthenticator/pull/224#issuecomment-453211986
@@ -70,21 +61,52 @@ def _cache_data(query_data, path_cache):
         )
 
         # Comments cache
-        path_comments_cache = path_repo_cache.joinpath("comments.csv")
-        if path_comments_cache.exists():
-            comments_cache = pd.read_csv(path_comments_cache)
-            comments_cache = comments_cache.append(
-                data_comments, sort=False
-            ).drop_duplicates(subset=["url"])
-        else:
-            comments_cache = data_comments
-        comments_cache.to_csv(path_comments_cache, index=False)
+        if not data_comments.empty:
+            _upsert_csv(path_repo_cache.joinpath("comments.csv"), data_comments)
+
+
+def _upsert_csv(path, data):
+    """Add rows to a CSV file, replacing the rows with the same URL."""
+    import pandas as pd
+
+    if path.exists():
+        data = pd.concat([pd.read_csv(path), data], sort=False)
+        data = data.drop_duplicates(subset=["url"], keep="last")
+    data.to_csv(path, index=False)
+
+
+def _load_watermark(path_cache, org, repo=None):
+    """Return the `updatedAt` of the latest item synced for a target, or None."""
+    path = _watermark_path(path_cache, org, repo)
+    try:
+        with path.open() as f:
+            return json.load(f)["updatedAt"]
+    except FileNotFoundError:
+        return None
+
+
+def _save_watermark(path_cache, org, repo, updated_at):
+    path = _watermark_path(path_cache, org, repo)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w") as f:
+        json.dump({"updatedAt": updated_at}, f)
+
+
+def _watermark_path(path_cache, org, repo=None):
+    if path_cache is True or path_cache is None:
+        path_cache = DEFAULT_PATH_CACHE
+    path = Path(path_cache).joinpath(org)
+    if repo:
+        path = path.joinpath(repo)
+    return path.joinpath("sync.json")
 
 
 ALLOWED_KINDS = ["issues", "comments", "prs"]
 
 
 def load_from_cache(target, kind, path_cache=None):
+    import pandas as pd
+
     # Checks for correctness and existence of cache
     if path_cache is None:
         path_cache = DEFAULT_PATH_CACHE
@@ -127,13 +149,15 @@ def load_from_cache(target, kind, path_cache=None):
 
 
 def get_cache_stats(path_cache=None):
+    import pandas as pd
+
     if path_cache is None:
         path_cache = DEFAULT_PATH_CACHE
 
     out_data = []
     for org in path_cache.glob("*"):
         for repo in org.glob("*"):
-            for ipath in repo.glob("*"):
+            for ipath in repo.glob("*.csv"):
                 kind = ipath.with_suffix("").name
                 idata = pd.read_csv(ipath)
                 mindate = idata["createdAt"].min()
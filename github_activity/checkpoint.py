@@ -0,0 +1,127 @@
+"""Checkpoints of paginated searches, so that an interrupted crawl can resume."""
+
+import hashlib
+import json
+import os
+import time
+
+from .httpcache import DEFAULT_PATH_HTTP_CACHE
+from .httpcache import _auth_fingerprint
+
+
+class CrawlJournal:
+    def __init__(self, path=None, max_age=24 * 60 * 60):
+        """A journal of the pages fetched so far for each search.
+
+        Each page of a search is appended to the journal along with its
+        `endCursor`. If the crawl is interrupted, running the same search
+        again picks up from the last cursor rather than starting over.
+
+        Parameters
+        ----------
+        path : str | Path | None
+          The folder to store journals in. If None, a `checkpoints` folder
+          in `~/.cache/github_activity` is used.
+        max_age : float
+          The number of seconds after which a journal is considered too stale
+          to resume from, and the search starts over. Stale journals, e.g.
+          of crawls that were never resumed, are removed.
+        """
+        if path is None:
+            path = DEFAULT_PATH_HTTP_CACHE.joinpath("checkpoints")
+        self.path = os.path.expanduser(path)
+        self.max_age = max_age
+        self._swept = False
+
+    @staticmethod
+    def key(query, fields, auth):
+        """Return the key of a search with the given query string and fields."""
+        key = f"{query}\n{fields}\n{_auth_fingerprint(auth)}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.path, f"{key}.jsonl")
+
+    def _sweep(self):
+        """Remove the journals of crawls that are too stale to resume."""
+        if self._swept:
+            return
+        self._swept = True
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return
+        for name in names:
+            path = os.path.join(self.path, name)
+            try:
+                if time.time() - os.path.getmtime(path) > self.max_age:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def freeze(self, key, value):
+        """Return the value recorded for `key`, recording `value` if there is none.
+
+        This pins down something that a crawl resolved when it started, such
+        as the "now" that ends its window, so that resuming the crawl repeats
+        the same searches. Remove it with `remove` once the crawl is complete.
+        """
+        self._sweep()
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            pass
+        os.makedirs(self.path, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(value, f)
+        return value
+
+    def load(self, key):
+        """Return the progress of a search from its journal, or None.
+
+        The progress is a dictionary with the `cursor` to continue from,
+        whether the search `hasNextPage`, the number of `pages` fetched and
+        the `nodes` of those pages.
+        """
+        self._sweep()
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return None
+
+        progress = None
+        for ii, line in enumerate(lines):
+            try:
+                page = json.loads(line)
+            except ValueError:
+                # The crawl stopped while this page was being written, so drop
+                # it before more pages are appended
+                with open(path, "w") as f:
+                    f.writelines(lines[:ii])
+                break
+            if progress is None:
+                progress = {"nodes": [], "pages": 0}
+            progress["nodes"].extend(page["nodes"])
+            progress["pages"] += 1
+            progress["cursor"] = page["cursor"]
+            progress["hasNextPage"] = page["hasNextPage"]
+        return progress
+
+    def append(self, key, nodes, cursor, has_next_page):
+        """Record a page of a search."""
+        self._sweep()
+        os.makedirs(self.path, exist_ok=True)
+        page = {"nodes": nodes, "cursor": cursor, "hasNextPage": has_next_page}
+        with open(self._path(key), "a") as f:
+            f.write(json.dumps(page) + "\n")
+
+    def remove(self, key):
+        """Forget the progress of a search, e.g. once it is complete."""
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
@@ -2,14 +2,24 @@ import argparse
 import json
 import os
 import sys
-from subprocess import PIPE
-from subprocess import run
 
+from .client import GitHubClient
 from .git import _git_installed_check
+from .git import _git_remotes
 from .git import _git_toplevel_path
+from .github_activity import BACKENDS
+from .github_activity import _get_default_since
 from .github_activity import _parse_target
+from .github_activity import _resolve_auth
+from .github_activity import estimate_activity
 from .github_activity import generate_activity_md
 from .github_activity import generate_all_activity_md
+from .github_activity import sync_activity
+from .graphql import QueryProfile
+from .httpcache import NodeStore
+from .httpcache import ResponseCache
+from .httpcache import ValidatorStore
+from .repositories import RepositoryFilter
 
 DESCRIPTION = "Generate a markdown changelog of GitHub activity within a date window."
 
@@ -21,7 +31,15 @@ ARG_DEFAULTS = {
     "include-opened": False,
     "strip-brackets": False,
     "all": False,
+    "estimate": False,
+    "checkpoints": False,
     "ignore-contributor": [],
+    "http-cache-ttl": 3600,
+    "http-cache-per-token": False,
+    "per-repo": False,
+    "include-archived": False,
+    "max-workers": 8,
+    "backend": "search",
 }
 
 parser = argparse.ArgumentParser(description=DESCRIPTION)
@@ -66,7 +84,8 @@ parser.add_argument(
     "--auth",
     default=None,
     help=(
-        "An authentication token for GitHub. If None, then the environment "
+        "An authentication token for GitHub, or several comma-separated "
+        "tokens to spread requests over. If None, then the environment "
         "variable `GITHUB_ACCESS_TOKEN` will be tried. If it does not exist "
         "then attempt to infer the token from `gh auth status -t`."
     ),
@@ -133,11 +152,124 @@ parser.add_argument(
     action="store_true",
     help=("""Whether to include all the GitHub tags"""),
 )
+parser.add_argument(
+    "--estimate",
+    default=None,
+    action="store_true",
+    help=(
+        "Print how many searches, pages and GraphQL rate limit points "
+        "generating the changelog would use, along with the remaining rate "
+        "limit of the token, rather than generating it."
+    ),
+)
+parser.add_argument(
+    "--exclude-author",
+    action="append",
+    help=(
+        "Leave out the issues/PRs opened by this GitHub user. Apps are given "
+        "as `app/<name>`, e.g. `--exclude-author app/dependabot`. Can be "
+        "given more than once."
+    ),
+)
 parser.add_argument(
     "--ignore-contributor",
     action="append",
     help="Do not include this GitHub username as a contributor in the changelog",
 )
+parser.add_argument(
+    "--http-cache",
+    nargs="?",
+    default=None,
+    const=True,
+    help=(
+        "Cache responses from the GitHub API on disk, so that re-running a "
+        "report doesn't fetch them again. Optionally takes the folder to "
+        "store them in (by default `~/.cache/github_activity/responses`). "
+        "The details of issues/PRs are also kept, and re-used for as long as "
+        "they aren't updated."
+    ),
+)
+parser.add_argument(
+    "--http-cache-ttl",
+    default=None,
+    type=float,
+    help="The number of seconds cached responses are used for. Defaults to 3600.",
+)
+parser.add_argument(
+    "--http-cache-per-token",
+    default=None,
+    action="store_true",
+    help=(
+        "Only serve cached responses to the token that fetched them. By "
+        "default, cached responses are shared between tokens, and can be "
+        "replayed without one."
+    ),
+)
+parser.add_argument(
+    "--offline",
+    default=None,
+    action="store_true",
+    help=(
+        "Only use responses in the HTTP cache, whatever their age, and fail "
+        "rather than make a request that isn't in it. Implies --http-cache. "
+        "No token is needed."
+    ),
+)
+parser.add_argument(
+    "--checkpoints",
+    default=None,
+    action="store_true",
+    help=(
+        "Record each page of results as it is fetched, in "
+        "`~/.cache/github_activity/checkpoints`, so that running the same "
+        "command again after a failure resumes where it stopped."
+    ),
+)
+parser.add_argument(
+    "--per-repo",
+    default=None,
+    action="store_true",
+    help=(
+        "If the target is an organization, fetch the activity of each of its "
+        "repositories separately and merge it. This is not limited to the "
+        "first 1000 results of a search, as a search of the whole "
+        "organization is. Implied by the --repo-* and --include-archived options."
+    ),
+)
+parser.add_argument(
+    "--repo-pattern",
+    default=None,
+    help="Only include the repositories of an organization whose name matches this glob pattern.",
+)
+parser.add_argument(
+    "--repo-pushed-since",
+    default=None,
+    help="Only include the repositories of an organization pushed to since this date.",
+)
+parser.add_argument(
+    "--include-archived",
+    default=None,
+    action="store_true",
+    help="Include the archived repositories of an organization.",
+)
+parser.add_argument(
+    "--max-workers",
+    default=None,
+    type=int,
+    help="The number of repositories of an organization to fetch at once. Defaults to 8.",
+)
+parser.add_argument(
+    "--backend",
+    default=None,
+    choices=BACKENDS,
+    help=(
+        "How to find issues/PRs. `search` (the default) uses the GitHub search "
+        "API. `repository` pages through the issues and PRs of each repository "
+        "from the most recently updated, which isn't limited to 1000 results "
+        "and sees changes immediately, but costs more for windows far in the "
+        "past. `auto` counts the results of both first and picks the cheaper one."
+    ),
+)
 
 # Hidden argument so that target can be optionally passed as a positional argument
 parser.add_argument(
@@ -147,6 +279,43 @@ parser.add_argument(
     help=argparse.SUPPRESS,
 )
 
+SYNC_DESCRIPTION = (
+    "Keep a local dataset of GitHub issues/PRs up to date, fetching only the "
+    "ones updated since the last sync."
+)
+
+sync_parser = argparse.ArgumentParser(
+    prog="github-activity sync", description=SYNC_DESCRIPTION
+)
+sync_parser.add_argument(
+    "targets",
+    nargs="+",
+    help="""The GitHub organizations or organization/repos to sync, e.g.
+    `jupyter` or `jupyter/notebook`.""",
+)
+sync_parser.add_argument(
+    "-s",
+    "--since",
+    default=None,
+    help="""The date or git reference to start from for targets that have never
+    been synced. If None, their whole history is fetched.""",
+)
+sync_parser.add_argument(
+    "--cache",
+    default=True,
+    help="""The folder of the dataset. Defaults to `~/data_github_activity`.""",
+)
+sync_parser.add_argument(
+    "--auth",
+    default=None,
+    help=(
+        "An authentication token for GitHub, or several comma-separated "
+        "tokens to spread requests over. If None, then the environment "
+        "variable `GITHUB_ACCESS_TOKEN` will be tried. If it does not exist "
+        "then attempt to infer the token from `gh auth status -t`."
+    ),
+)
+
 
 def load_config_and_defaults(args):
     """
@@ -171,7 +340,52 @@ def load_config_and_defaults(args):
             setattr(args, argname, config.get(configname, ARG_DEFAULTS.get(configname)))
 
 
+def sync(argv):
+    """Run the `github-activity sync` subcommand."""
+    args = sync_parser.parse_args(argv)
+    try:
+        updated = sync_activity(
+            args.targets, since=args.since, auth=args.auth, cache=args.cache
+        )
+    except ValueError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        sys.exit(1)
+    for target, n_updated in updated.items():
+        print(f"{target}: {n_updated} issues/PRs added or updated", file=sys.stderr)
+
+
+def estimate(args, client, repositories):
+    """Print what generating the changelog of `args` would use."""
+    if args.all:
+        raise ValueError("--estimate can't be combined with --all")
+    auth = _resolve_auth(args.auth, client)
+    since = args.since
+    if since is None:
+        org, repo = _parse_target(args.target)
+        since = _get_default_since(org, repo, auth, args.until, client)
+    print(
+        estimate_activity(
+            args.target,
+            since=since,
+            until=args.until,
+            kind=args.kind,
+            auth=auth,
+            client=client,
+            profile=QueryProfile.for_changelog(),
+            repositories=repositories,
+            max_workers=args.max_workers,
+            branch=args.branch,
+            exclude_authors=args.exclude_author,
+            backend=args.backend,
+        )
+    )
+
+
 def main():
+    # `sync` is a subcommand, while everything else generates a changelog
+    if sys.argv[1:2] == ["sync"]:
+        return sync(sys.argv[2:])
+
     if not _git_installed_check():
         print("git is required to run github-activity", file=sys.stderr)
         sys.exit(1)
@@ -185,18 +399,24 @@ def main():
         args.target = args._target
 
     load_config_and_defaults(args)
+    if args.all:
+        # The changelog of every release is of a single repository
+        per_repo_flags = {
+            "--per-repo": args.per_repo,
+            "--repo-pattern": args.repo_pattern,
+            "--repo-pushed-since": args.repo_pushed_since,
+            "--include-archived": args.include_archived,
+        }
+        for flag, value in per_repo_flags.items():
+            if value:
+                parser.error(f"{flag} can't be combined with --all")
 
     tags = args.tags.split(",") if args.tags is not None else args.tags
     # Automatically detect the target from remotes if we haven't had one passed.
     if not args.target:
         err = "Could not automatically detect remote, and none was given."
         try:
-            out = run("git remote -v".split(), stdout=PIPE)
-            remotes = out.stdout.decode().split("\n")
-            remotes = [ii for ii in remotes if ii]
-            remotes = {
-                ii.split("\t")[0]: ii.split("\t")[1].split()[0] for ii in remotes
-            }
+            remotes = _git_remotes()
             if "upstream" in remotes:
                 ref = remotes["upstream"]
             elif "origin" in remotes:
@@ -214,6 +434,21 @@ def main():
         except Exception:
             raise ValueError(err)
 
+    client = None
+    if args.http_cache or args.offline:
+        path = args.http_cache if isinstance(args.http_cache, str) else None
+        response_cache = ResponseCache(
+            path,
+            ttl=args.http_cache_ttl,
+            replay=bool(args.offline),
+            per_token=bool(args.http_cache_per_token),
+        )
+        client = GitHubClient(
+            validator_store=ValidatorStore(),
+            response_cache=response_cache,
+            node_store=NodeStore(),
+        )
+
     common_kwargs = dict(
         kind=args.kind,
         auth=args.auth,
@@ -223,12 +458,35 @@ def main():
         strip_brackets=bool(args.strip_brackets),
         branch=args.branch,
         ignored_contributors=args.ignore_contributor,
+        client=client,
+        exclude_authors=args.exclude_author,
     )
 
+    repositories = None
+    if (
+        args.per_repo
+        or args.repo_pattern
+        or args.repo_pushed_since
+        or args.include_archived
+    ):
+        repositories = RepositoryFilter(
+            pattern=args.repo_pattern,
+            include_archived=bool(args.include_archived),
+            pushed_since=args.repo_pushed_since,
+        )
+
     # Wrap in a try/except so we don't have an ugly stack trace if there's an error
     try:
+        if args.estimate:
+            return estimate(args, client, repositories)
+
         if args.all:
-            md = generate_all_activity_md(args.target, **common_kwargs)
+            md = generate_all_activity_md(
+                args.target,
+                backend=args.backend,
+                checkpoints=bool(args.checkpoints),
+                **common_kwargs,
+            )
 
         else:
             md = generate_activity_md(
@@ -236,6 +494,10 @@ def main():
                 since=args.since,
                 until=args.until,
                 heading_level=args.heading_level,
+                repositories=repositories,
+                max_workers=args.max_workers,
+                backend=args.backend,
+                checkpoints=bool(args.checkpoints),
                 **common_kwargs,
             )
 
@@ -0,0 +1,249 @@
+"""A pooled HTTP client that is shared by every call to the GitHub API."""
+
+import asyncio
+import functools
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .auth import TokenPool
+from .httpcache import ResponseCache
+from .httpcache import ValidatorStore
+from .ratelimit import RateLimitScheduler
+from .ratelimit import _sleep
+
+GITHUB_API_URL = "https://api.github.com"
+GITHUB_GRAPHQL_URL = f"{GITHUB_API_URL}/graphql"
+
+# (connect, read) timeouts in seconds, as accepted by `requests`
+DEFAULT_TIMEOUT = (10, 60)
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_CONCURRENCY = 8
+
+
+def run_sync(coro):
+    """Run a coroutine to completion from synchronous code.
+
+    If an event loop is already running in this thread (e.g. in a Jupyter
+    notebook), the coroutine is run on a fresh loop in a worker thread.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+
+class GitHubClient:
+    def __init__(
+        self,
+        pool_size=DEFAULT_POOL_SIZE,
+        timeout=DEFAULT_TIMEOUT,
+        max_concurrency=DEFAULT_MAX_CONCURRENCY,
+        rate_limit=None,
+        validator_store=None,
+        response_cache=None,
+        node_store=None,
+    ):
+        """A keep-alive HTTP session for talking to the GitHub API.
+
+        Re-using one client across queries means each page of a search and
+        each REST call re-uses an open connection rather than paying for a
+        new TCP and TLS handshake.
+
+        Parameters
+        ----------
+        pool_size : int
+          The maximum number of connections to keep open to each host.
+        timeout : float | tuple(float, float) | None
+          The default timeout, in seconds, for each request. A tuple is
+          interpreted as (connect timeout, read timeout).
+        max_concurrency : int
+          The maximum number of requests that the asynchronous methods of
+          this client (`arequest`, `agraphql`, ...) will have in flight at
+          once. The limit is shared by every coroutine and event loop that
+          uses this client.
+        rate_limit : RateLimitScheduler | None
+          Paces requests according to the rate limit budgets reported by
+          GitHub and decides when rate-limited requests are retried. If None,
+          a new scheduler is created for this client.
+        validator_store : ValidatorStore | None
+          If given, GET and HEAD requests are made conditional on the
+          `ETag` / `Last-Modified` of the responses stored in it.
+        response_cache : ResponseCache | None
+          If given, responses are served from this cache when it has them,
+          and stored in it otherwise.
+        node_store : NodeStore | None
+          If given, the details of issues/PRs are stored in it, and searches
+          that fetch them in two phases re-use the stored details of the
+          ones that haven't changed.
+        """
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.rate_limit = rate_limit or RateLimitScheduler()
+        self.validator_store = validator_store
+        self.response_cache = response_cache
+        self.node_store = node_store
+        self._executor = None
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def request(self, method, url, immutable=False, **kwargs):
+        """Make a request with this client's session and default timeout.
+
+        Requests are paced to stay within the rate limit of their token, and
+        a request that was rate limited is retried once the limit allows
+        rather than failing. With a `TokenPool`, each request is made with
+        the token that has the most budget left. If the client has a response
+        cache, responses are served from it when possible. If it has a
+        validator store, GET and HEAD requests are revalidated against it.
+        Responses to requests with `immutable=True` are only ever fetched
+        once.
+
+        While a request is in flight, an identical request (the same method,
+        URL, body and token) waits for it and gets the same response.
+        """
+        # Identical requests that are made at the same time, e.g. by several
+        # changelogs generated at once, share a single request
+        key = ResponseCache.key(method, url, kwargs.get("auth"), kwargs.get("json"))
+        with self._lock:
+            flight = self._in_flight.get(key)
+            in_flight = flight is not None
+            if not in_flight:
+                flight = self._in_flight[key] = Future()
+        if in_flight:
+            return flight.result()
+
+        try:
+            if self.response_cache is not None:
+                response = self.response_cache.request(
+                    self._revalidate, method, url, immutable=immutable, **kwargs
+                )
+            else:
+                response = self._revalidate(method, url, immutable=immutable, **kwargs)
+        except BaseException as e:
+            flight.set_exception(e)
+            raise
+        else:
+            flight.set_result(response)
+            return response
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    def _revalidate(self, method, url, immutable=False, **kwargs):
+        if self.validator_store is not None and method in ("GET", "HEAD"):
+            return self.validator_store.request(
+                self._send, method, url, immutable=immutable, **kwargs
+            )
+        return self._send(method, url, **kwargs)
+
+    def _send(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        resource = "graphql" if url == GITHUB_GRAPHQL_URL else "core"
+        pool = kwargs.get("auth") if isinstance(kwargs.get("auth"), TokenPool) else None
+        attempt = 0
+        while True:
+            if pool is not None:
+                kwargs["auth"] = pool.select(self.rate_limit, resource)
+            key = self.rate_limit.key(kwargs.get("auth"), resource)
+            self.rate_limit.wait(key)
+            response = self.session.request(method, url, **kwargs)
+            self.rate_limit.update_from_response(key, response)
+            delay = self.rate_limit.retry_delay(key, response, attempt)
+            if delay is None:
+                return response
+            attempt += 1
+            if pool is not None:
+                # Set the token aside until it may be used again, and retry
+                # with another one. `wait` sleeps if every token is set aside.
+                self.rate_limit.update(key, remaining=0, reset=time.time() + delay)
+                continue
+            _sleep(delay, "GitHub API rate limit exceeded")
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request("HEAD", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def record_graphql_rate_limit(self, auth, rate_limit):
+        """Record the `rateLimit` object returned by a GraphQL query."""
+        if isinstance(auth, TokenPool):
+            # The token that was used isn't known here, but the budget from
+            # the response headers was already recorded for it
+            return
+        key = self.rate_limit.key(auth, "graphql")
+        self.rate_limit.update_from_graphql(key, rate_limit)
+
+    def graphql(self, query, auth=None, **kwargs):
+        """POST a GraphQL query and return the raw response."""
+        return self.post(GITHUB_GRAPHQL_URL, json={"query": query}, auth=auth, **kwargs)
+
+    async def arequest(self, method, url, **kwargs):
+        """Asynchronous version of `request`.
+
+        The blocking request runs on this client's worker pool, whose size
+        bounds the number of concurrent requests.
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_concurrency,
+                thread_name_prefix="github-activity",
+            )
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self.request, method, url, **kwargs)
+        )
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest("GET", url, **kwargs)
+
+    async def ahead(self, url, **kwargs):
+        return await self.arequest("HEAD", url, **kwargs)
+
+    async def apost(self, url, **kwargs):
+        return await self.arequest("POST", url, **kwargs)
+
+    async def agraphql(self, query, auth=None, **kwargs):
+        """Asynchronous version of `graphql`."""
+        return await self.apost(
+            GITHUB_GRAPHQL_URL, json={"query": query}, auth=auth, **kwargs
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+_DEFAULT_CLIENT = None
+
+
+def get_default_client():
+    """Return a process-wide client, creating it on first use."""
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None:
+        _DEFAULT_CLIENT = GitHubClient(validator_store=ValidatorStore())
+    return _DEFAULT_CLIENT
@@ -1,20 +1,141 @@
+import os
+import re
+import shutil
 import subprocess
+from pathlib import Path
+
+# Git configuration that changes what `git remote -v` reports, so that the
+# remotes can't be read from `.git/config` alone
+_INDIRECT_CONFIG = re.compile(
+    r"^\s*\[\s*include|insteadof", re.IGNORECASE | re.MULTILINE
+)
+
+# Where git installations usually keep their system-wide configuration
+_SYSTEM_CONFIGS = [
+    "/etc/gitconfig",
+    "/usr/local/etc/gitconfig",
+    "/opt/homebrew/etc/gitconfig",
+]
 
 
 def _git_installed_check():
-    cmd = ["git", "--help"]
-    try:
-        subprocess.check_call(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+    return shutil.which("git") is not None
+
+
+def _find_git_dir(path=None):
+    """Return the top-level and `.git` folder of the repository of `path`.
+
+    They are found without running git, by looking for a `.git` folder in
+    `path` and its parents. A `.git` file, as in worktrees and submodules,
+    points to the folder. Returns (None, None) outside of a repository.
+    """
+    path = Path(path or os.getcwd()).resolve()
+    for folder in (path, *path.parents):
+        dot_git = folder.joinpath(".git")
+        if dot_git.is_dir():
+            return folder, dot_git
+        if dot_git.is_file():
+            match = re.match(r"gitdir:\s*(.+)", dot_git.read_text().strip())
+            if match:
+                return folder, folder.joinpath(match.group(1)).resolve()
+    return None, None
 
 
 def _git_toplevel_path():
     """Fetch the top-level of the local Git repository"""
+    # Only git knows where the repository is if it's set in the environment
+    if "GIT_DIR" not in os.environ and "GIT_WORK_TREE" not in os.environ:
+        toplevel, _ = _find_git_dir()
+        return str(toplevel) if toplevel else None
+
     cmd = ["git", "rev-parse", "--show-toplevel"]
     try:
         top = subprocess.check_output(cmd, stderr=subprocess.DEVNULL)
         return top.strip().decode()
     except subprocess.CalledProcessError:
         return None
+
+
+def _outer_git_configs():
+    """Return the paths of the global and system configuration files of git.
+
+    They apply to every repository, e.g. with `insteadOf` rules that rewrite
+    the URLs of its remotes.
+    """
+    if "GIT_CONFIG_GLOBAL" in os.environ:
+        paths = [os.environ["GIT_CONFIG_GLOBAL"]]
+    else:
+        xdg_config = os.environ.get("XDG_CONFIG_HOME") or Path.home() / ".config"
+        paths = [Path(xdg_config, "git", "config"), Path.home() / ".gitconfig"]
+    if not os.environ.get("GIT_CONFIG_NOSYSTEM"):
+        if "GIT_CONFIG_SYSTEM" in os.environ:
+            paths.append(os.environ["GIT_CONFIG_SYSTEM"])
+        else:
+            paths.extend(_SYSTEM_CONFIGS)
+            if "PROGRAMFILES" in os.environ:
+                # Git for Windows
+                paths.append(
+                    Path(os.environ["PROGRAMFILES"], "Git", "etc", "gitconfig")
+                )
+    return [Path(path) for path in paths]
+
+
+def _outer_config_is_indirect():
+    """Return True if configuration outside of the repository may rewrite remotes."""
+    # Configuration given on the command line, or in the environment
+    if "GIT_CONFIG_PARAMETERS" in os.environ or "GIT_CONFIG_COUNT" in os.environ:
+        return True
+    for path in _outer_git_configs():
+        try:
+            if _INDIRECT_CONFIG.search(path.read_text()):
+                return True
+        except FileNotFoundError:
+            pass
+        except (OSError, UnicodeDecodeError):
+            # Let git read whatever we can't
+            return True
+    return False
+
+
+def _git_remotes():
+    """Return the fetch URLs of the remotes of the local Git repository, by name.
+
+    The URLs are read from `.git/config` where possible, and from
+    `git remote -v` otherwise, e.g. if the global configuration of git
+    rewrites URLs with `insteadOf`.
+    """
+    git_dir = None
+    if "GIT_DIR" not in os.environ and not _outer_config_is_indirect():
+        git_dir = _find_git_dir()[1]
+    config = None
+    if git_dir is not None:
+        # The worktrees of a repository share its configuration
+        common_dir = git_dir.joinpath("commondir")
+        if common_dir.is_file():
+            git_dir = git_dir.joinpath(common_dir.read_text().strip()).resolve()
+        try:
+            config = git_dir.joinpath("config").read_text()
+        except OSError:
+            pass
+
+    if config is None or _INDIRECT_CONFIG.search(config):
+        out = subprocess.run(["git", "remote", "-v"], stdout=subprocess.PIPE)
+        remotes = {}
+        for line in out.stdout.decode().splitlines():
+            if line:
+                name, url = line.split("\t")
+                remotes.setdefault(name, url.split()[0])
+        return remotes
+
+    remotes = {}
+    section = None
+    for line in config.splitlines():
+        header = re.match(r'\s*\[\s*(\w+)(?:\s+"(.*)")?\s*\]', line)
+        if header:
+            section = header.groups()
+            continue
+        value = re.match(r"\s*url\s*=\s*(.*?)\s*$", line, re.IGNORECASE)
+        if value and section and section[0].lower() == "remote" and section[1]:
+            # The first URL of a remote is the one it fetches from
+            remotes.setdefault(section[1], value.group(1).strip('"'))
+    return remotes
@@ -1,5 +1,6 @@
 """Use the GraphQL api to grab issues/PRs that match a query."""
 
+import asyncio
 import dataclasses
 import datetime
 import fnmatch
@@ -8,7 +9,9 @@ import re
 import shlex
 import subprocess
 import sys
+import typing
 from collections import OrderedDict
+from json import dumps
 from json import loads
 from subprocess import CalledProcessError
 from subprocess import PIPE
@@ -16,14 +19,35 @@ from subprocess import run
 from tempfile import TemporaryDirectory
 
 import dateutil.parser
-import numpy as np
-import pandas as pd
-import pytz
 import requests
 
-from .auth import TokenAuth
+from .auth import as_auth
 from .cache import _cache_data
+from .cache import _load_watermark
+from .cache import _save_watermark
+from .checkpoint import CrawlJournal
+from .client import GITHUB_API_URL
+from .client import get_default_client
+from .client import run_sync
 from .graphql import GitHubGraphQlQuery
+from .graphql import GitHubRepositoryQuery
+from .graphql import QueryProfile
+from .graphql import SEARCH_RESULT_CAP
+from .graphql import count_search_results
+from .httpcache import _auth_fingerprint
+from .normalize import DTYPE_BACKENDS
+from .normalize import apply_dtype_backend
+from .repositories import RepositoryFilter
+from .repositories import list_repositories
+
+if typing.TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# The ways issues/PRs can be fetched, see `get_activity`
+BACKENDS = ["search", "repository", "auto"]
+# Before the first activity on GitHub, to sync whole histories from
+GITHUB_EPOCH = "2008-01-01T00:00:00Z"
 
 
 # The tags and description to use in creating subsets of PRs
@@ -98,7 +122,25 @@ TAGS_METADATA_BASE = OrderedDict(
 
 
 def get_activity(
-    target, since, until=None, repo=None, kind=None, auth=None, cache=None
+    target,
+    since,
+    until=None,
+    repo=None,
+    kind=None,
+    auth=None,
+    cache=None,
+    client=None,
+    combine_searches=True,
+    profile=None,
+    checkpoints=False,
+    repositories=None,
+    max_workers=8,
+    backend="search",
+    two_phase=None,
+    branch=None,
+    exclude_authors=None,
+    retain_raw=True,
+    dtype_backend=None,
 ):
     """Return issues/PRs within a date window.
 
@@ -119,16 +161,75 @@ def get_activity(
         date will be used.
     kind : ["issue", "pr"] | None
         Return only issues or PRs. If None, both will be returned.
-    auth : string | None
-        An authentication token for GitHub. If None, then the environment
-        variable `GITHUB_ACCESS_TOKEN` will be tried. If it does not exist,
-        then attempt to infer a token from `gh auth status -t`.
+    auth : string | list of strings | None
+        An authentication token for GitHub, or several tokens (a list or a
+        comma-separated string) to spread requests over. If None, then the
+        environment variable `GITHUB_ACCESS_TOKEN` will be tried. If it does
+        not exist, then attempt to infer a token from `gh auth status -t`.
     cache : bool | str | None
         Whether to cache the returned results. If None, no caching is
         performed. If True, the cache is located at
         ~/github_activity_data. It is organized as orgname/reponame folders
         with CSV files inside that contain the latest data. If a string it
         is treated as the path to a cache folder.
+    client : GitHubClient | None
+        The HTTP client used for every request to GitHub. If None, a
+        process-wide client with a shared connection pool is used.
+    combine_searches : bool
+        If True, the searches for issues/PRs created and closed within the
+        window are sent together in one GraphQL request per page. If False,
+        each search is paginated on its own.
+    profile : QueryProfile | None
+        The fields to fetch for each issue/PR. If None, every field is
+        fetched. Caching requires the full comment details.
+    checkpoints : bool | str
+        Whether to record the pages fetched by each search as they arrive, so
+        that a run that fails part-way resumes where it stopped when it's
+        repeated with the same target and window. A run without `until`
+        resumes with the window it started with. If True, the records are
+        kept in ~/.cache/github_activity/checkpoints. If a string, it is
+        treated as the path to a folder for them.
+    repositories : RepositoryFilter | bool | None
+        If given and the target is an organization, its repositories are
+        listed and the activity of each one that passes this filter is fetched
+        with its own searches, which are then merged. Unlike a single search
+        of the whole organization, this isn't limited to 1000 results. If
+        True, every repository that isn't archived is included.
+    max_workers : int
+        The maximum number of repositories whose activity is fetched at once
+        when `repositories` is given.
+    backend : ["search", "repository", "auto"]
+        How to find the issues/PRs of a repository. "search" uses the search
+        API. "repository" pages through the pull requests and issues of each
+        repository from the most recently updated, which isn't limited to
+        1000 results and has no search index lag, but fetches every item
+        updated since `since`. "auto" counts the results of both first, and
+        picks the cheaper one.
+    two_phase : bool | None
+        If True, searches only return the ID of each issue/PR, and the details
+        of each distinct one are then fetched once. Items that were both
+        opened and closed within the window aren't fetched twice, and if
+        `client` has a `node_store`, items that haven't been updated since
+        they were stored aren't fetched at all. This takes one more request,
+        so if None, it is only done if `client` has a `node_store`.
+    branch : string | None
+        Only return the PRs that target this branch (issues aren't filtered).
+    exclude_authors : list of strings | None
+        Leave out the issues/PRs opened by these users. Apps, such as
+        Dependabot, are given as `app/<name>`, e.g. `app/dependabot`.
+    retain_raw : bool
+        Whether to keep the raw `comments`, `reviews` and `commits` of each
+        issue/PR as columns. Without them, the memory taken by the data is a
+        fraction of it, and the columns derived from them (`commenters`,
+        `reviewers` and `committers`) remain. They are needed to cache the
+        comments, so `cache` can only be used with `retain_raw=True`.
+    dtype_backend : "numpy_nullable" | "pyarrow" | None
+        If given, columns are typed rather than holding Python objects:
+        low-cardinality columns (`org`, `repo`, `kind`, `state`, ...) are
+        categoricals, timestamps are datetimes, and strings and integers
+        use the nullable pandas dtypes or, with "pyarrow", Arrow arrays (as
+        do the lists of labels and logins). The "pyarrow" backend needs
+        `pyarrow` to be installed. If None, columns hold Python objects.
 
     Returns
     -------
@@ -137,7 +238,254 @@ def get_activity(
         will be a combination of issues and PRs. The DataFrame has a
         `bot_users` attribute containing the set of detected bot usernames.
     """
+    return run_sync(
+        get_activity_async(
+            target,
+            since,
+            until=until,
+            repo=repo,
+            kind=kind,
+            auth=auth,
+            cache=cache,
+            client=client,
+            combine_searches=combine_searches,
+            profile=profile,
+            checkpoints=checkpoints,
+            repositories=repositories,
+            max_workers=max_workers,
+            backend=backend,
+            two_phase=two_phase,
+            branch=branch,
+            exclude_authors=exclude_authors,
+            retain_raw=retain_raw,
+            dtype_backend=dtype_backend,
+        )
+    )
+
+
+async def get_activity_async(
+    target,
+    since,
+    until=None,
+    repo=None,
+    kind=None,
+    auth=None,
+    cache=None,
+    client=None,
+    combine_searches=True,
+    profile=None,
+    checkpoints=False,
+    repositories=None,
+    max_workers=8,
+    backend="search",
+    two_phase=None,
+    branch=None,
+    exclude_authors=None,
+    retain_raw=True,
+    dtype_backend=None,
+):
+    """Asynchronous version of `get_activity`, which takes the same parameters.
+
+    The repository check, the resolution of `since` and `until` and the
+    searches that are independent of each other all run concurrently. Several
+    calls can be awaited together, e.g. with `asyncio.gather`, and they will
+    share the concurrency limit of `client`.
+    """
+    if cache and not retain_raw:
+        raise ValueError("Caching needs the raw comments, so it needs retain_raw=True")
+    if dtype_backend and dtype_backend not in DTYPE_BACKENDS:
+        raise ValueError(
+            f"dtype_backend must be one of {DTYPE_BACKENDS}, got {dtype_backend}"
+        )
+    client = client or get_default_client()
+    auth = _resolve_auth(auth, client)
+    if two_phase is None:
+        two_phase = client.node_store is not None
+    journal = None
+    window_key = None
+    if checkpoints:
+        journal = CrawlJournal(None if checkpoints is True else checkpoints)
+    if until is None and (journal is not None or client.response_cache is not None):
+        # Like the pages of the searches, a window that ends "now" is keyed on
+        # everything that shapes the searches
+        plan_description = _plan_description(
+            target,
+            since,
+            kind=kind,
+            repositories=repositories,
+            backend=backend,
+            branch=branch,
+            exclude_authors=exclude_authors,
+            combine_searches=combine_searches,
+            profile=profile,
+        )
+        now = datetime.datetime.now(datetime.timezone.utc)
+        until = now.isoformat(timespec="seconds")
+        if client.response_cache is not None:
+            # Searches that end at a new "now" on every run would never be
+            # found in the cache, so "now" is kept as long as responses are
+            until = client.response_cache.pin(plan_description, until)
+        if journal is not None:
+            # A run is resumed with the "now" it started with, so that it
+            # repeats the same searches
+            window_key = journal.key(plan_description, "until", as_auth(auth))
+            frozen = journal.freeze(window_key, until)
+            if frozen != until:
+                print(
+                    f"Resuming an interrupted run of {target}, until {frozen} "
+                    "as when it started",
+                    file=sys.stderr,
+                )
+            until = frozen
+        until = datetime.datetime.fromisoformat(until)
+    plan = await _plan_searches(
+        target,
+        since,
+        until,
+        kind,
+        auth,
+        client,
+        repositories=repositories,
+        branch=branch,
+        exclude_authors=exclude_authors,
+        combine_searches=combine_searches,
+    )
+    org, repo_names = plan.org, plan.repo_names
+    since_dt_str, until_dt_str = plan.since_dt_str, plan.until_dt_str
+
+    backend = await _resolve_backend(backend, plan, kind, auth, client)
+    search_queries = plan.search_queries
+
+    if backend == "repository":
+        queries = [
+            GitHubRepositoryQuery(
+                org,
+                name,
+                since_dt_str,
+                until_dt_str,
+                kind=kind,
+                branch=branch,
+                auth=auth,
+                client=client,
+                profile=profile,
+                journal=journal,
+                retain_raw=retain_raw,
+            )
+            for name in repo_names
+        ]
+    else:
+        queries = [
+            GitHubGraphQlQuery(
+                ii_search_query,
+                auth=auth,
+                client=client,
+                profile=profile,
+                journal=journal,
+                two_phase=two_phase,
+                retain_raw=retain_raw,
+            )
+            for ii_search_query in search_queries
+        ]
+    workers = asyncio.Semaphore(max_workers)
+
+    async def run_query(qu):
+        async with workers:
+            await qu.arequest()
+
+    await asyncio.gather(*(run_query(qu) for qu in queries))
+    if window_key is not None:
+        journal.remove(window_key)
+
+    import pandas as pd
 
+    query_data = []
+    all_bot_users = set()
+    for qu in queries:
+        if not qu.data.empty:
+            query_data.append(qu.data)
+        # Collect bot users from each query
+        all_bot_users.update(qu.data.attrs.get("bot_users", set()))
+
+    if query_data:
+        query_data = (
+            pd.concat(query_data).drop_duplicates(subset=["id"]).reset_index(drop=True)
+        )
+    else:
+        query_data = pd.DataFrame()
+
+    # The searches should have left these out already, but make sure
+    if not query_data.empty and branch:
+        other_branch = (query_data["kind"] == "pr") & (
+            query_data["baseRefName"].notna() & (query_data["baseRefName"] != branch)
+        )
+        query_data = query_data.loc[~other_branch].reset_index(drop=True)
+    if not query_data.empty and exclude_authors:
+        excluded = {_author_login(author) for author in exclude_authors}
+        excluded_author = query_data["author"].map(
+            lambda author: isinstance(author, str) and _author_login(author) in excluded
+        )
+        query_data = query_data.loc[~excluded_author].reset_index(drop=True)
+    if cache and not query_data.empty:
+        _cache_data(query_data, cache)
+    # The cache is written with the untyped columns, as they come from GitHub
+    if dtype_backend and not query_data.empty:
+        query_data = apply_dtype_backend(query_data, dtype_backend)
+
+    query_data.since_dt = plan.since_dt
+    query_data.until_dt = plan.until_dt
+    query_data.since_dt_str = since_dt_str
+    query_data.until_dt_str = until_dt_str
+    query_data.since_is_git_ref = plan.since_is_git_ref
+    query_data.until_is_git_ref = plan.until_is_git_ref
+    # Restore bot_users in attrs (lost during concat)
+    query_data.attrs["bot_users"] = all_bot_users
+
+    return query_data
+
+
+def _plan_description(target, since, **options):
+    """Return a string that identifies the searches planned for a window.
+
+    It covers everything that shapes the searches but the end of the window,
+    so that it can key what is resolved when a run starts, such as "now".
+    """
+    return dumps([target, since, options], sort_keys=True, default=repr)
+
+
+@dataclasses.dataclass
+class _SearchPlan:
+    """The searches that fetch the activity of a target, see `_plan_searches`."""
+
+    org: str
+    repo: str
+    # The repositories to fetch one by one, or None to search a whole org
+    repo_names: list
+    since_dt: datetime.datetime
+    until_dt: datetime.datetime
+    since_is_git_ref: bool
+    until_is_git_ref: bool
+    since_dt_str: str
+    until_dt_str: str
+    # The `repo:`/`user:` qualifier of each search, and the `-author:` ones
+    search_prefixes: list
+    exclusions: str
+    # The queries to create, each a search string or a list of them
+    search_queries: list
+
+
+async def _plan_searches(
+    target,
+    since,
+    until,
+    kind,
+    auth,
+    client,
+    repositories=None,
+    branch=None,
+    exclude_authors=None,
+    combine_searches=True,
+):
+    """Resolve the window of `get_activity` and return the searches to run."""
     org, repo = _parse_target(target)
 
     if repo:
@@ -147,98 +495,361 @@ def get_activity(
         # We have just org
         search_query = f"user:{org}"
 
-    # First try environment variables (GITHUB_TOKEN will exist in GitHub Actions)
-    if auth is None:
-        for authkey in ["GITHUB_ACCESS_TOKEN", "GITHUB_TOKEN"]:
-            if authkey in os.environ:
-                # Access token is stored in a local environment variable so just use this
-                print(
-                    f"Using GH access token stored in `{authkey}`.",
-                    file=sys.stderr,
-                )
-                auth = os.environ.get(authkey)
-                if auth == "":
-                    raise ValueError(f"{authkey} exists, but it is empty...")
-                break
-
-    # Then try the gh cli
-    if auth is None:
-        # Attempt to use the gh cli if installed
+    # Validate that the repository exists (if a specific repo was provided)
+    # and resolve git references in one GraphQL query, falling back to the
+    # REST API if that fails
+    prelude = None
+    if repo:
         try:
-            p = run(["gh", "auth", "token"], text=True, capture_output=True)
-            auth = p.stdout.strip()
-        except CalledProcessError:
-            print(
-                ("gh cli has no token. Login with `gh auth login`"),
-                file=sys.stderr,
+            prelude = await _get_repository_prelude(
+                org, repo, [since, until], auth, client=client
             )
-        except FileNotFoundError:
+        except RepositoryNotFoundError:
+            raise
+        except Exception as e:
             print(
-                (
-                    "gh cli not found, so will not use it for auth. To download, "
-                    "see https://cli.github.com/"
-                ),
+                f"Could not look up {org}/{repo} with GraphQL, using the REST API instead: {e}",
                 file=sys.stderr,
             )
 
-    # If neither work, throw an error because we will hit rate limits immediately
-    if auth is None:
-        raise ValueError(
-            "Either the environment variable GITHUB_ACCESS_TOKEN (or GITHUB_TOKEN) or the "
-            "--auth flag must be used to pass a Personal Access Token "
-            "needed by the GitHub API. You can generate a token at "
-            "https://github.com/settings/tokens/new. Note that while "
-            "working with a public repository, you don't need to set any "
-            "scopes on the token you create. Alternatively, you may log-in "
-            "via the GitHub CLI (`gh auth login`)."
+    # Figure out the dates for our query. A missing repository is reported
+    # before any failure to resolve the dates.
+    lookups = [
+        _get_datetime_and_type(org, repo, since, auth, client=client, prelude=prelude),
+        _get_datetime_and_type(org, repo, until, auth, client=client, prelude=prelude),
+    ]
+    if repo and prelude is None:
+        lookups.append(_validate_repository_exists(org, repo, auth, client=client))
+    if not repo and repositories:
+        if repositories is True:
+            repositories = RepositoryFilter()
+        lookups.append(
+            list_repositories(org, auth, client=client, repository_filter=repositories)
         )
-
-    # Validate repository exists early if a specific repo was provided
-    if repo:
-        _validate_repository_exists(org, repo, auth)
-
-    # Figure out dates for our query
-    since_dt, since_is_git_ref = _get_datetime_and_type(org, repo, since, auth)
-    until_dt, until_is_git_ref = _get_datetime_and_type(org, repo, until, auth)
+    results = await asyncio.gather(*lookups, return_exceptions=True)
+    for result in results[::-1]:
+        if isinstance(result, BaseException):
+            raise result
+    (since_dt, since_is_git_ref), (until_dt, until_is_git_ref) = results[:2]
     since_dt_str = f"{since_dt:%Y-%m-%dT%H:%M:%SZ}"
     until_dt_str = f"{until_dt:%Y-%m-%dT%H:%M:%SZ}"
 
+    if repo:
+        repo_names = [repo]
+    elif repositories:
+        # Fetch each repository of the org on its own
+        repo_names = results[2]
+        print(
+            f"Fetching the activity of {len(repo_names)} repositories of {org}",
+            file=sys.stderr,
+        )
+    else:
+        repo_names = None
+    if repo_names is None:
+        search_prefixes = [search_query]
+    else:
+        search_prefixes = [f"repo:{org}/{name}" for name in repo_names]
+
     if kind:
         allowed_kinds = ["issue", "pr"]
         if kind not in allowed_kinds:
             raise ValueError(f"Kind must be one of {allowed_kinds}, got {kind}")
-        search_query += f" type:{kind}"
+
+    # Filter in the searches themselves rather than after downloading. A
+    # base branch only applies to PRs, so issues are searched for separately.
+    if branch:
+        qualifiers = [
+            f" type:pr base:{branch}" if ii_kind == "pr" else " type:issue"
+            for ii_kind in ([kind] if kind else ["pr", "issue"])
+        ]
+    else:
+        qualifiers = [f" type:{kind}" if kind else ""]
+    exclusions = "".join(f" -author:{author}" for author in exclude_authors or [])
 
     # Query for both opened and closed issues/PRs in this window
-    print(f"Running search query:\n{search_query}\n\n", file=sys.stderr)
-    query_data = []
-    all_bot_users = set()
-    for activity_type in ["created", "closed"]:
-        ii_search_query = (
-            search_query + f" {activity_type}:{since_dt_str}..{until_dt_str}"
+    search_queries = []
+    for prefix in search_prefixes:
+        if len(search_prefixes) == 1:
+            print(f"Running search query:\n{prefix}\n\n", file=sys.stderr)
+        prefix_queries = [
+            prefix
+            + qualifier
+            + exclusions
+            + f" {activity_type}:{since_dt_str}..{until_dt_str}"
+            for qualifier in qualifiers
+            for activity_type in ["created", "closed"]
+        ]
+        if combine_searches:
+            search_queries.append(prefix_queries)
+        else:
+            search_queries.extend(prefix_queries)
+
+    return _SearchPlan(
+        org=org,
+        repo=repo,
+        repo_names=repo_names,
+        since_dt=since_dt,
+        until_dt=until_dt,
+        since_is_git_ref=since_is_git_ref,
+        until_is_git_ref=until_is_git_ref,
+        since_dt_str=since_dt_str,
+        until_dt_str=until_dt_str,
+        search_prefixes=search_prefixes,
+        exclusions=exclusions,
+        search_queries=search_queries,
+    )
+
+
+def _author_login(author):
+    """Return the login of an author in a search qualifier or an item.
+
+    Apps are `app/<name>` in search qualifiers, and `<name>` or `<name>[bot]`
+    elsewhere.
+    """
+    return author.removeprefix("app/").removesuffix("[bot]")
+
+
+async def _resolve_backend(backend, plan, kind, auth, client):
+    """Return the backend to fetch the activity planned in `plan` with."""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend must be one of {BACKENDS}, got {backend}")
+    if backend == "auto":
+        backend = "search"
+        if plan.repo:
+            search_query = plan.search_prefixes[0] + plan.exclusions
+            if kind:
+                search_query += f" type:{kind}"
+            backend = await _choose_backend(
+                search_query, plan.since_dt_str, plan.until_dt_str, auth, client
+            )
+    if backend == "repository" and plan.repo_names is None:
+        raise ValueError(
+            "The repository backend needs a repository, or `repositories` to "
+            "fetch the repositories of an organization one by one."
         )
-        qu = GitHubGraphQlQuery(ii_search_query, auth=auth)
-        qu.request()
-        query_data.append(qu.data)
-        # Collect bot users from each query
-        all_bot_users.update(qu.data.attrs.get("bot_users", set()))
+    return backend
+
+
+async def _choose_backend(search_query, since, until, auth, client):
+    """Return the backend that will fetch the activity of a window most cheaply.
 
-    query_data = (
-        pd.concat(query_data).drop_duplicates(subset=["id"]).reset_index(drop=True)
+    The searches for items created and closed within the window are
+    compared with the number of items updated since its start, which is what
+    the repository backend fetches.
+    """
+    try:
+        created, closed, updated = await count_search_results(
+            [
+                f"{search_query} created:{since}..{until}",
+                f"{search_query} closed:{since}..{until}",
+                f"{search_query} updated:>={since}",
+            ],
+            auth,
+            client=client,
+        )
+    except Exception as e:
+        print(
+            f"Could not count search results, using the search API: {e}",
+            file=sys.stderr,
+        )
+        return "search"
+    # Searches with more results than GitHub returns need to be split up
+    if max(created, closed) > SEARCH_RESULT_CAP or updated <= created + closed:
+        backend = "repository"
+    else:
+        backend = "search"
+    print(
+        f"Found {created} created, {closed} closed and {updated} updated items, "
+        f"using the {backend} backend",
+        file=sys.stderr,
     )
-    query_data.since_dt = since_dt
-    query_data.until_dt = until_dt
-    query_data.since_dt_str = since_dt_str
-    query_data.until_dt_str = until_dt_str
-    query_data.since_is_git_ref = since_is_git_ref
-    query_data.until_is_git_ref = until_is_git_ref
-    # Restore bot_users in attrs (lost during concat)
-    query_data.attrs["bot_users"] = all_bot_users
+    return backend
 
-    if cache:
-        _cache_data(query_data, cache)
 
-    return query_data
+def estimate_activity(
+    target,
+    since,
+    until=None,
+    kind=None,
+    auth=None,
+    client=None,
+    combine_searches=True,
+    profile=None,
+    repositories=None,
+    max_workers=8,
+    two_phase=None,
+    branch=None,
+    exclude_authors=None,
+    backend="search",
+):
+    """Estimate the requests and rate limit points that `get_activity` would use.
+
+    The same searches are planned as for `get_activity`, but only their
+    number of results is fetched. With the repository backend, the items
+    updated since `since` are counted instead, as they are all listed. The
+    point cost of each kind of page comes from a dry run of its query, which
+    GitHub doesn't charge for. The parameters are those of `get_activity`.
+
+    Returns
+    -------
+    estimate : CostEstimate
+        The estimate, along with the remaining rate limit of the token.
+    """
+    client = client or get_default_client()
+    auth = _resolve_auth(auth, client)
+    if two_phase is None:
+        two_phase = client.node_store is not None
+
+    async def estimate():
+        plan = await _plan_searches(
+            target,
+            since,
+            until,
+            kind,
+            auth,
+            client,
+            repositories=repositories,
+            branch=branch,
+            exclude_authors=exclude_authors,
+            combine_searches=combine_searches,
+        )
+        if await _resolve_backend(backend, plan, kind, auth, client) == "repository":
+            queries = [
+                GitHubRepositoryQuery(
+                    plan.org,
+                    name,
+                    plan.since_dt_str,
+                    plan.until_dt_str,
+                    kind=kind,
+                    branch=branch,
+                    auth=auth,
+                    client=client,
+                    profile=profile,
+                )
+                for name in plan.repo_names
+            ]
+        else:
+            queries = [
+                GitHubGraphQlQuery(
+                    search_query,
+                    auth=auth,
+                    client=client,
+                    profile=profile,
+                    two_phase=two_phase,
+                )
+                for search_query in plan.search_queries
+            ]
+        # Estimate one query first, so that the others re-use its dry runs
+        page_costs = {}
+        total = await queries[0].aestimate(page_costs=page_costs)
+        workers = asyncio.Semaphore(max_workers)
+
+        async def estimate_query(qu):
+            async with workers:
+                return await qu.aestimate(page_costs=page_costs)
+
+        for ii_estimate in await asyncio.gather(
+            *(estimate_query(qu) for qu in queries[1:])
+        ):
+            total += ii_estimate
+        return total
+
+    return run_sync(estimate())
+
+
+def sync_activity(targets, since=None, auth=None, cache=True, client=None):
+    """Bring the cached issues/PRs of each target up to date.
+
+    Only the issues/PRs that were updated since the last sync of a target are
+    fetched, and they replace any older copy in the cache. The `updatedAt` of
+    the latest one is kept as the starting point of the next sync.
+
+    Parameters
+    ----------
+    targets : list of strings
+        The GitHub organizations or org/repos to sync, as for `get_activity`.
+    since : string | None
+        The date or git reference to start from for targets that haven't been
+        synced before. If None, their whole history is fetched.
+    auth : string | list of strings | None
+        An authentication token for GitHub, or several tokens (a list or a
+        comma-separated string) to spread requests over. If None, then the
+        environment variable `GITHUB_ACCESS_TOKEN` will be tried.
+    cache : bool | str
+        The cache to sync into. If True, the cache is located at
+        ~/data_github_activity. If a string it is treated as the path to a
+        cache folder.
+    client : GitHubClient | None
+        The HTTP client used for every request to GitHub. If None, a
+        process-wide client with a shared connection pool is used.
+
+    Returns
+    -------
+    updated : dict
+        The number of issues/PRs that were added or updated for each target.
+    """
+    client = client or get_default_client()
+    auth = _resolve_auth(auth, client)
+
+    async def sync_targets():
+        return await asyncio.gather(
+            *(_sync_target(target, since, auth, cache, client) for target in targets)
+        )
+
+    return dict(zip(targets, run_sync(sync_targets())))
+
+
+async def _sync_target(target, since, auth, cache, client):
+    """Fetch the issues/PRs of a target updated since its last sync."""
+    org, repo = _parse_target(target)
+    search_query = f"repo:{org}/{repo}" if repo else f"user:{org}"
+
+    watermark = _load_watermark(cache, org, repo)
+    if watermark is None and since is not None:
+        since_dt, _ = await _get_datetime_and_type(
+            org, repo, since, auth, client=client
+        )
+        watermark = f"{since_dt:%Y-%m-%dT%H:%M:%SZ}"
+    # Items updated at the watermark itself are fetched again, so that none
+    # that were updated in the same second are missed. The range is closed,
+    # so that a search with more results than GitHub returns can be split.
+    # An interrupted sync is resumed with the "now" it started with.
+    journal = CrawlJournal()
+    window_key = journal.key(dumps([target, watermark]), "until", as_auth(auth))
+    now = f"{datetime.datetime.now(datetime.timezone.utc):%Y-%m-%dT%H:%M:%SZ}"
+    frozen = journal.freeze(window_key, now)
+    if frozen != now:
+        print(
+            f"Resuming an interrupted sync of {target}, until {frozen} as when "
+            "it started",
+            file=sys.stderr,
+        )
+        now = frozen
+    search_query += f" updated:{watermark or GITHUB_EPOCH}..{now}"
+
+    print(f"Syncing {target} with search query:\n{search_query}\n", file=sys.stderr)
+    qu = GitHubGraphQlQuery(
+        search_query,
+        auth=auth,
+        client=client,
+        journal=journal,
+        two_phase=True,
+    )
+    await qu.arequest()
+    journal.remove(window_key)
+    if qu.data.empty:
+        return 0
+    _cache_data(qu.data, cache)
+    if qu.incomplete_searches:
+        # Keep the watermark, so that the next sync fetches what was missed
+        print(
+            f"Not every issue/PR of {target} could be fetched, so the next sync "
+            "will start from the same point.",
+            file=sys.stderr,
+        )
+    else:
+        _save_watermark(cache, org, repo, qu.data["updatedAt"].max())
+    return len(qu.data)
 
 
 def generate_all_activity_md(
@@ -252,6 +863,10 @@ def generate_all_activity_md(
     strip_brackets=False,
     branch=None,
     ignored_contributors: list[str] = None,
+    client=None,
+    exclude_authors=None,
+    backend="search",
+    checkpoints=False,
 ):
     """Generate a full markdown changelog of GitHub activity of a repo based on release tags.
 
@@ -267,9 +882,10 @@ def generate_all_activity_md(
         The expression used to match a release tag.
     kind : ["issue", "pr"] | None
         Return only issues or PRs. If None, both will be returned.
-    auth : string | None
-        An authentication token for GitHub. If None, then the environment
-        variable `GITHUB_ACCESS_TOKEN` will be tried.
+    auth : string | list of strings | None
+        An authentication token for GitHub, or several tokens (a list or a
+        comma-separated string) to spread requests over. If None, then the
+        environment variable `GITHUB_ACCESS_TOKEN` will be tried.
     tags : list of strings | None
         A list of the tags to use in generating subsets of PRs for the markdown report.
         Must be one of:
@@ -288,12 +904,25 @@ def generate_all_activity_md(
         The branch or reference name to filter pull requests by.
     ignored_contributors : list
         List of usernames not to include in the changelog.
+    client : GitHubClient | None
+        The HTTP client used for every request to GitHub. It is shared by the
+        changelog entries of every release tag. If None, a process-wide
+        client is used.
+    exclude_authors : list of strings | None
+        Leave out the issues/PRs opened by these users, e.g. `app/dependabot`.
+    backend : ["search", "repository", "auto"]
+        How to find the issues/PRs of each release. See `get_activity`.
+    checkpoints : bool | str
+        Whether to record the pages fetched so far, so that a run that fails
+        part-way can be resumed. See `get_activity`.
 
     Returns
     -------
     entry: str
         The markdown changelog entry for all of the release tags in the repo.
     """
+    client = client or get_default_client()
+
     # Get the sha and tag name for each tag in the target repo
     with TemporaryDirectory() as td:
         subprocess.run(
@@ -322,9 +951,8 @@ def generate_all_activity_md(
     data = [d.split(" | ") for (i, d) in enumerate(data)]
     data = [d for d in data if filter(d)]
 
-    # Generate a changelog entry for each version and sha range
-    output = ""
-
+    # Find the sha range of each version
+    windows = []
     for i in range(len(data) - 1):
         curr_data = data[i]
         prev_data = data[i + 1]
@@ -340,13 +968,54 @@ def generate_all_activity_md(
         tag = match.groups()[0]
 
         print(f"\n({i + 1}/{len(data)})", since, until, tag, file=sys.stderr)
-        md = generate_activity_md(
-            target,
+        windows.append((since, until, tag))
+
+    # Fetch the activity of every version concurrently
+    auth = _resolve_auth(auth, client)
+    org, repo = _parse_target(target)
+
+    async def fetch_windows():
+        if repo:
+            # Resolve the git references of every version in one request.
+            # If this fails, each version falls back to resolving its own.
+            refs = [ref for since, until, _ in windows for ref in (since, until)]
+            try:
+                await _get_repository_prelude(org, repo, refs, auth, client=client)
+            except Exception:
+                pass
+        return await asyncio.gather(
+            *(
+                get_activity_async(
+                    target,
+                    since=since,
+                    until=until,
+                    kind=kind,
+                    auth=auth,
+                    cache=False,
+                    client=client,
+                    profile=QueryProfile.for_changelog(),
+                    branch=branch,
+                    exclude_authors=exclude_authors,
+                    backend=backend,
+                    checkpoints=checkpoints,
+                    retain_raw=False,
+                )
+                for since, until, _ in windows
+            )
+        )
+
+    activity = run_sync(fetch_windows())
+
+    # Generate a changelog entry for each version and sha range
+    output = ""
+    for (since, until, tag), window_data in zip(windows, activity):
+        md = _activity_md_from_data(
+            window_data,
+            org,
+            repo,
             since=since,
-            heading_level=2,
             until=until,
-            auth=auth,
-            kind=kind,
+            heading_level=2,
             include_issues=include_issues,
             include_opened=include_opened,
             strip_brackets=strip_brackets,
@@ -400,6 +1069,13 @@ def generate_activity_md(
     heading_level=1,
     branch=None,
     ignored_contributors: list[str] = None,
+    client=None,
+    exclude_authors=None,
+    repositories=None,
+    max_workers=8,
+    backend="search",
+    dtype_backend=None,
+    checkpoints=False,
 ):
     """Generate a markdown changelog of GitHub activity within a date window.
 
@@ -421,9 +1097,10 @@ def generate_activity_md(
         date will be used.
     kind : ["issue", "pr"] | None
         Return only issues or PRs. If None, both will be returned.
-    auth : string | None
-        An authentication token for GitHub. If None, then the environment
-        variable `GITHUB_ACCESS_TOKEN` will be tried.
+    auth : string | list of strings | None
+        An authentication token for GitHub, or several tokens (a list or a
+        comma-separated string) to spread requests over. If None, then the
+        environment variable `GITHUB_ACCESS_TOKEN` will be tried.
     tags : list of strings | None
         A list of the tags to use in generating subsets of PRs for the markdown report.
         Must be one of:
@@ -444,6 +1121,26 @@ def generate_activity_md(
         With heading_level=2 those are increased to h2 and h3, respectively.
     branch : string | None
         The branch or reference name to filter pull requests by.
+    client : GitHubClient | None
+        The HTTP client used for every request to GitHub. If None, a
+        process-wide client with a shared connection pool is used.
+    exclude_authors : list of strings | None
+        Leave out the issues/PRs opened by these users. Apps, such as
+        Dependabot, are given as `app/<name>`, e.g. `app/dependabot`.
+    repositories : RepositoryFilter | bool | None
+        If given and the target is an organization, the activity of each of
+        its repositories that passes this filter is fetched separately and
+        merged. See `get_activity`.
+    max_workers : int
+        The maximum number of repositories whose activity is fetched at once.
+    backend : ["search", "repository", "auto"]
+        How to find the issues/PRs of a repository. See `get_activity`.
+    dtype_backend : "numpy_nullable" | "pyarrow" | None
+        Whether to use typed columns for the activity data. See
+        `get_activity`.
+    checkpoints : bool | str
+        Whether to record the pages fetched so far, so that a run that fails
+        part-way can be resumed. See `get_activity`.
 
     Returns
     -------
@@ -456,13 +1153,65 @@ def generate_activity_md(
     # release, and otherwise fallback to the latest _local_ git tag.
     # TODO: Check that local repo matches org/repo
     if since is None:
-        since = _get_latest_release_tag(org, repo)
+        auth = _resolve_auth(auth, client)
+        since = _get_default_since(org, repo, auth, until, client)
 
     # Grab the data according to our query
     data = get_activity(
-        target, since=since, until=until, kind=kind, auth=auth, cache=False
+        target,
+        since=since,
+        until=until,
+        kind=kind,
+        auth=auth,
+        cache=False,
+        client=client,
+        profile=QueryProfile.for_changelog(),
+        repositories=repositories,
+        max_workers=max_workers,
+        backend=backend,
+        branch=branch,
+        exclude_authors=exclude_authors,
+        retain_raw=False,
+        dtype_backend=dtype_backend,
+        checkpoints=checkpoints,
+    )
+    return _activity_md_from_data(
+        data,
+        org,
+        repo,
+        since=since,
+        until=until,
+        tags=tags,
+        include_issues=include_issues,
+        include_opened=include_opened,
+        strip_brackets=strip_brackets,
+        heading_level=heading_level,
+        branch=branch,
+        ignored_contributors=ignored_contributors,
     )
 
+
+def _activity_md_from_data(
+    data,
+    org,
+    repo,
+    since,
+    until,
+    tags=None,
+    include_issues=False,
+    include_opened=False,
+    strip_brackets=False,
+    heading_level=1,
+    branch=None,
+    ignored_contributors=None,
+):
+    """Render the activity returned by `get_activity` as a markdown changelog.
+
+    See `generate_activity_md` for a description of the parameters.
+    """
+    import numpy as np
+    import pandas as pd
+
     # Raise error if GitHub API returned no activity at all
     # This happens when the repository has no issues/PRs in the date range
     if data.empty:
@@ -496,8 +1245,8 @@ def generate_activity_md(
     bot_users = data.attrs["bot_users"]
 
     def ignored_user(username):
-        # Handle None, empty strings, and non-string types (like NaN)
-        if not username or not isinstance(username, str):
+        # Handle None, empty strings, and non-string types (like NaN or NA)
+        if not isinstance(username, str) or not username:
             return False
 
         # First check against GraphQL-detected bot users
@@ -541,37 +1290,36 @@ def generate_activity_md(
         # - merger
         # - reviewers
 
+        # Deleted users have no login, which is missing (NaN, or NA with typed
+        # columns) rather than a string
+        author = row.author if isinstance(row.author, str) else None
+
         # Only add author if they're not a bot
-        if not ignored_user(row.author):
-            item_contributors.author = row.author
+        if author and not ignored_user(author):
+            item_contributors.author = author
 
         if row.kind == "pr":
             for committer in filter_ignored(row.committers):
                 item_contributors.add(committer)
             # Only add merger if they're not a bot and not the author
             if (
-                pd.notna(row.mergedBy)
-                and row.mergedBy != row.author
+                isinstance(row.mergedBy, str)
+                and row.mergedBy != author
                 and not ignored_user(row.mergedBy)
             ):
                 item_contributors.add(row.mergedBy)
             for reviewer in filter_ignored(row.reviewers):
                 item_contributors.add(reviewer)
 
-        for icomment in row["comments"]["edges"]:
-            comment_author = icomment["node"]["author"]
-            if not comment_author:
-                # This happens if the GitHub user has been deleted
-                # ref: https://github.com/jupyterhub/oauthenticator/pull/224#issuecomment-453211986
-                continue
-
-            comment_author = comment_author["login"]
+        # Comments by deleted users have no author, and are left out
+        # ref: https://github.com/jupyterhub/oauthenticator/pull/224#issuecomment-453211986
+        for comment_author in row["commenters"]:
             if ignored_user(comment_author):
                 # ignore bots and user-specified contributors
                 continue
 
             # Add to list of commenters on items they didn't author
-            if comment_author != row["author"]:
+            if comment_author != author:
                 comment_helpers.append(comment_author)
 
             # Add to list of commenters for this item so we can see how many times they commented
@@ -600,13 +1348,16 @@ def generate_activity_md(
     ].index.tolist()
     all_contributors |= set(c for c in comment_contributors if isinstance(c, str))
 
-    # Extract datetime strings from data attributes for pandas query
-    since_dt_str = data.since_dt_str  # noqa: F841
-    until_dt_str = data.until_dt_str  # noqa: F841
+    # Parse the timestamps once, and sort them so that the items in the
+    # window can be found by bisection
+    closed_at = _SortedTimestamps.parse(data["closedAt"])
+    created_at = _SortedTimestamps.parse(data["createdAt"])
+    since_dt = pd.Timestamp(data.since_dt_str)
+    until_dt = pd.Timestamp(data.until_dt_str)
 
     # Separate into closed and opened
-    closed = data.query("closedAt >= @since_dt_str and closedAt <= @until_dt_str")
-    opened = data.query("createdAt >= @since_dt_str and createdAt <= @until_dt_str")
+    closed = data.iloc[closed_at.between(since_dt, until_dt)]
+    opened = data.iloc[created_at.between(since_dt, until_dt)]
 
     # Separate into PRs and issues
     closed_prs = closed.query("kind == 'pr'")
@@ -615,12 +1366,8 @@ def generate_activity_md(
     opened_issues = opened.query("kind == 'issue'")
 
     # Remove the PRs/Issues that from "opened" if they were also closed
-    mask_open_and_close_pr = opened_prs["id"].map(
-        lambda iid: iid in closed_prs["id"].values
-    )
-    mask_open_and_close_issue = opened_issues["id"].map(
-        lambda iid: iid in closed_issues["id"].values
-    )
+    mask_open_and_close_pr = opened_prs["id"].isin(closed_prs["id"])
+    mask_open_and_close_issue = opened_issues["id"].isin(closed_issues["id"])
     opened_prs = opened_prs.loc[~mask_open_and_close_pr]
     opened_issues = opened_issues.loc[~mask_open_and_close_issue]
 
@@ -746,13 +1493,12 @@ def generate_activity_md(
     # Get functional GitHub references: any git reference or {branch}@{YY-mm-dd}
     # Use the branch parameter if provided, otherwise default to "main"
     ref_branch = branch or "main"
+    if closed_prs.size > 0:
+        merged_at = closed_at.subset(data.index.get_indexer(closed_prs.index))
     if closed_prs.size > 0 and not data.since_is_git_ref:
         since = f"{ref_branch}@{{{data.since_dt:%Y-%m-%d}}}"
-        closest_date_start = closed_prs.loc[
-            abs(
-                pd.to_datetime(closed_prs["closedAt"], utc=True)
-                - pd.to_datetime(data.since_dt, utc=True)
-            ).idxmin()
+        closest_date_start = data.iloc[
+            merged_at.nearest(pd.to_datetime(data.since_dt, utc=True))
         ]
         since_ref = closest_date_start["mergeCommit"]["oid"]
     else:
@@ -760,11 +1506,8 @@ def generate_activity_md(
 
     if closed_prs.size > 0 and not data.until_is_git_ref:
         until = f"{ref_branch}@{{{data.until_dt:%Y-%m-%d}}}"
-        closest_date_stop = closed_prs.loc[
-            abs(
-                pd.to_datetime(closed_prs["closedAt"], utc=True)
-                - pd.to_datetime(data.until_dt, utc=True)
-            ).idxmin()
+        closest_date_stop = data.iloc[
+            merged_at.nearest(pd.to_datetime(data.until_dt, utc=True))
         ]
         until_ref = closest_date_stop["mergeCommit"]["oid"]
     else:
@@ -811,6 +1554,62 @@ def generate_activity_md(
     return md
 
 
+@dataclasses.dataclass(frozen=True)
+class _SortedTimestamps:
+    """A column of timestamps, parsed and sorted for bisection.
+
+    Look-ups return positions in the column rather than timestamps.
+    """
+
+    timestamps: "pd.DatetimeIndex"
+    # The position in the column of each timestamp
+    positions: "np.ndarray"
+
+    @classmethod
+    def parse(cls, column):
+        """Parse and sort a column of timestamps, leaving out missing ones."""
+        import numpy as np
+        import pandas as pd
+
+        timestamps = pd.DatetimeIndex(pd.to_datetime(column, utc=True))
+        positions = np.flatnonzero(timestamps.notna())
+        # A stable sort keeps equal timestamps in the order of the column
+        order = np.argsort(timestamps[positions].asi8, kind="stable")
+        positions = positions[order]
+        return cls(timestamps[positions], positions)
+
+    def subset(self, positions):
+        """Return the timestamps at the given positions of the column."""
+        import numpy as np
+
+        keep = np.isin(self.positions, positions)
+        return _SortedTimestamps(self.timestamps[keep], self.positions[keep])
+
+    def between(self, start, stop):
+        """Return the positions of the timestamps from `start` to `stop`, in order."""
+        import numpy as np
+
+        first = self.timestamps.searchsorted(start, side="left")
+        last = self.timestamps.searchsorted(stop, side="right")
+        return np.sort(self.positions[first:last])
+
+    def nearest(self, when):
+        """Return the position of the timestamp closest to `when`.
+
+        Of several equally close timestamps, the first one in the column wins.
+        """
+        after = self.timestamps.searchsorted(when)
+        # The first of each run of equal timestamps is first in the column
+        candidates = [after] if after < len(self.timestamps) else []
+        if after > 0:
+            candidates.append(self.timestamps.searchsorted(self.timestamps[after - 1]))
+        closest = min(
+            candidates,
+            key=lambda ii: (abs(self.timestamps[ii] - when), self.positions[ii]),
+        )
+        return self.positions[closest]
+
+
 def extract_comments(comments):
     """Extract the comments returned from GraphQL Issues or PullRequests.
 
@@ -831,6 +1630,9 @@ def extract_comments(comments):
     if not has_comments:
         return None
 
+    import numpy as np
+    import pandas as pd
+
     comments = [jj.get("node") for ii in list_of_comments for jj in ii]
     comments = pd.DataFrame(comments)
     comments["author"] = comments["author"].map(
@@ -882,7 +1684,69 @@ def _parse_target(target):
     return org, repo
 
 
-def _validate_repository_exists(org, repo, token):
+def _resolve_auth(auth, client=None):
+    """Return the GitHub token to use, looking it up if `auth` is None.
+
+    If `client` only replays cached responses, no token is needed.
+    """
+    # First try environment variables (GITHUB_TOKEN will exist in GitHub Actions)
+    if auth is None:
+        for authkey in ["GITHUB_ACCESS_TOKEN", "GITHUB_TOKEN"]:
+            if authkey in os.environ:
+                # Access token is stored in a local environment variable so just use this
+                print(
+                    f"Using GH access token stored in `{authkey}`.",
+                    file=sys.stderr,
+                )
+                auth = os.environ.get(authkey)
+                if auth == "":
+                    raise ValueError(f"{authkey} exists, but it is empty...")
+                break
+
+    # Then try the gh cli
+    if auth is None:
+        # Attempt to use the gh cli if installed
+        try:
+            p = run(["gh", "auth", "token"], text=True, capture_output=True)
+            auth = p.stdout.strip()
+        except CalledProcessError:
+            print(
+                ("gh cli has no token. Login with `gh auth login`"),
+                file=sys.stderr,
+            )
+        except FileNotFoundError:
+            print(
+                (
+                    "gh cli not found, so will not use it for auth. To download, "
+                    "see https://cli.github.com/"
+                ),
+                file=sys.stderr,
+            )
+
+    # Replayed responses are cached without their token, so any token will do
+    replay = client is not None and getattr(client.response_cache, "replay", False)
+    if auth is None and replay:
+        return ""
+
+    # If neither work, throw an error because we will hit rate limits immediately
+    if auth is None:
+        raise ValueError(
+            "Either the environment variable GITHUB_ACCESS_TOKEN (or GITHUB_TOKEN) or the "
+            "--auth flag must be used to pass a Personal Access Token "
+            "needed by the GitHub API. You can generate a token at "
+            "https://github.com/settings/tokens/new. Note that while "
+            "working with a public repository, you don't need to set any "
+            "scopes on the token you create. Alternatively, you may log-in "
+            "via the GitHub CLI (`gh auth login`)."
+        )
+    return auth
+
+
+class RepositoryNotFoundError(ValueError):
+    """A repository doesn't exist, or isn't accessible with the token."""
+
+
+async def _validate_repository_exists(org, repo, token, client=None):
     """Validate that a repository exists on GitHub.
 
     Parameters
@@ -893,33 +1757,51 @@ def _validate_repository_exists(org, repo, token):
         The repository name
     token : str
         GitHub authentication token
+    client : GitHubClient | None
+        The HTTP client to make the request with.
 
     Raises
     ------
-    ValueError
+    RepositoryNotFoundError
         If the repository does not exist or is not accessible
     """
-    auth = TokenAuth(token)
-    repo_url = f"https://api.github.com/repos/{org}/{repo}"
-    response = requests.head(repo_url, auth=auth)
+    auth = as_auth(token)
+    client = client or get_default_client()
+    repo_url = f"{GITHUB_API_URL}/repos/{org}/{repo}"
+    response = await client.ahead(repo_url, auth=auth)
     if response.status_code == 404:
-        raise ValueError(
+        raise RepositoryNotFoundError(
             f"Repository '{org}/{repo}' not found. Please check the repository name."
         )
 
 
-def _get_datetime_and_type(org, repo, datetime_or_git_ref, auth):
+async def _get_datetime_and_type(
+    org, repo, datetime_or_git_ref, auth, client=None, prelude=None
+):
     """Return a datetime object and bool indicating if it is a git reference or
-    not."""
+    not.
+
+    If a `prelude` from `_get_repository_prelude` is given, git references are
+    resolved from it rather than with a request.
+    """
 
     # Default a blank datetime_or_git_ref to current UTC time, which makes sense
     # to set the until flags default value.
     if datetime_or_git_ref is None:
-        dt = datetime.datetime.now().astimezone(pytz.utc)
+        dt = datetime.datetime.now(datetime.timezone.utc)
         return (dt, False)
+    if isinstance(datetime_or_git_ref, datetime.datetime):
+        return (datetime_or_git_ref, False)
 
     try:
-        dt = _get_datetime_from_git_ref(org, repo, datetime_or_git_ref, auth)
+        if prelude is not None:
+            dt = prelude["refs"][datetime_or_git_ref]
+            if dt is None:
+                raise ValueError(f"{datetime_or_git_ref} is not a git reference")
+        else:
+            dt = await _get_datetime_from_git_ref(
+                org, repo, datetime_or_git_ref, auth, client=client
+            )
         return (dt, True)
     except Exception:
         try:
@@ -933,13 +1815,14 @@ def _get_datetime_and_type(org, repo, datetime_or_git_ref, auth):
             )
 
 
-def _get_datetime_from_git_ref(org, repo, ref, token):
+async def _get_datetime_from_git_ref(org, repo, ref, token, client=None):
     """Return a datetime from a git reference."""
-    auth = TokenAuth(token)
-    url = f"https://api.github.com/repos/{org}/{repo}/commits/{ref}"
+    auth = as_auth(token)
+    client = client or get_default_client()
+    url = f"{GITHUB_API_URL}/repos/{org}/{repo}/commits/{ref}"
     # prevent requests from using netrc
     try:
-        response = requests.get(url, auth=auth)
+        response = await client.aget(url, auth=auth, immutable=_is_pinned_ref(ref))
         response.raise_for_status()
     except requests.exceptions.HTTPError:
         try:
@@ -951,9 +1834,154 @@ def _get_datetime_from_git_ref(org, repo, ref, token):
     return dateutil.parser.parse(response.json()["commit"]["committer"]["date"])
 
 
-def _get_latest_release_tag(org, repo):
+def _is_pinned_ref(ref):
+    """Return True if a git reference is a full commit SHA or a version tag.
+
+    These are assumed never to move, so what they resolve to can be stored
+    for good.
+    """
+    return bool(re.fullmatch(r"[0-9a-f]{40}|v?\d+(\.\d+)+\S*", ref))
+
+
+# Repository lookups made by `_get_repository_prelude`, by (org, repo, token
+# fingerprint)
+_PRELUDE_CACHE = {}
+
+_PRELUDE_QUERY = """\
+query {{
+  repository(owner: {owner}, name: {name}) {{
+    latestRelease {{
+      tagName
+      name
+      publishedAt
+      tagCommit {{
+        committedDate
+      }}
+    }}
+{refs}  }}
+}}
+
+fragment RefDate on GitObject {{
+  ... on Commit {{
+    committedDate
+  }}
+  ... on Tag {{
+    target {{
+      ... on Commit {{
+        committedDate
+      }}
+    }}
+  }}
+}}
+"""
+
+
+async def _get_repository_prelude(org, repo, refs, token, client=None):
+    """Look up a repository, its latest release and git references at once.
+
+    A single GraphQL query checks that the repository exists, finds its
+    latest release and resolves each of `refs` to the date of its commit.
+    Results are memoized for the lifetime of the process, so references that
+    were already resolved don't cost another request.
+
+    Returns
+    -------
+    prelude : dict
+        The `latestRelease` of the repository (or None), and `refs` mapping
+        each git reference to a datetime, or to None if it isn't one.
+
+    Raises
+    ------
+    RepositoryNotFoundError
+        If the repository does not exist or is not accessible
+    """
+    # Tokens may be given as a list, which can't be a key
+    key = (org, repo, _auth_fingerprint(as_auth(token)))
+    prelude = _PRELUDE_CACHE.get(key)
+    missing = [
+        ref
+        for ref in dict.fromkeys(refs)
+        if isinstance(ref, str) and (prelude is None or ref not in prelude["refs"])
+    ]
+    if prelude is not None and not missing:
+        return prelude
+
+    client = client or get_default_client()
+    query = _PRELUDE_QUERY.format(
+        owner=dumps(org),
+        name=dumps(repo),
+        refs="".join(
+            f"    ref{ii}: object(expression: {dumps(ref)}) {{\n      ...RefDate\n    }}\n"
+            for ii, ref in enumerate(missing)
+        ),
+    )
+    response = await client.agraphql(query, auth=as_auth(token))
+    response.raise_for_status()
+    result = response.json()
+    repository = (result.get("data") or {}).get("repository")
+    if repository is None:
+        errors = result.get("errors") or []
+        if any(error.get("type") == "NOT_FOUND" for error in errors):
+            raise RepositoryNotFoundError(
+                f"Repository '{org}/{repo}' not found. Please check the repository name."
+            )
+        raise Exception(f"Query failed to run with error {errors}")
+
+    if prelude is None:
+        prelude = {"latestRelease": repository["latestRelease"], "refs": {}}
+        release = repository["latestRelease"]
+        if release and release["tagCommit"]:
+            prelude["refs"][release["tagName"]] = dateutil.parser.parse(
+                release["tagCommit"]["committedDate"]
+            )
+    for ii, ref in enumerate(missing):
+        obj = repository[f"ref{ii}"] or {}
+        # Annotated tags point to the commit that they tag
+        date = obj.get("committedDate") or (obj.get("target") or {}).get(
+            "committedDate"
+        )
+        prelude["refs"][ref] = dateutil.parser.parse(date) if date else None
+    _PRELUDE_CACHE[key] = prelude
+    return prelude
+
+
+def _get_default_since(org, repo, auth, until=None, client=None):
+    """Return the start of a changelog when none is given: the latest release."""
+    if repo:
+        return _get_latest_release_tag(org, repo, auth=auth, until=until, client=client)
+    return _get_latest_release_tag(org, repo)
+
+
+def _get_latest_release_tag(org, repo, auth=None, until=None, client=None):
     """Return the latest GitHub Release associated tag for a given
-    repository."""
+    repository.
+
+    If a token is given, the release is looked up with GraphQL (along with
+    `until`, so that it's resolved in the same request). Otherwise, or if that
+    fails, the `gh` CLI is used, and then the latest local git tag.
+    """
+    print(f"Auto-detecting latest release tag for: {org}/{repo}")
+    if auth is not None:
+        try:
+            prelude = run_sync(
+                _get_repository_prelude(org, repo, [until], auth, client=client)
+            )
+        except RepositoryNotFoundError:
+            raise
+        except Exception as e:
+            print(f"Error getting latest release tag for {org}/{repo}: {e}")
+        else:
+            release = prelude["latestRelease"]
+            if release is None:
+                print(f"{org}/{repo} has no releases.")
+                print("Reverting to using latest local git tag...")
+                return _get_latest_local_tag()
+            print(
+                f"Using tag {release['tagName']} from release {release['name']} "
+                f"published at {release['publishedAt']}"
+            )
+            return release["tagName"]
+
     cmd = [
         "gh",
         "release",
@@ -963,7 +1991,6 @@ def _get_latest_release_tag(org, repo):
         "--json",
         "tagName,name,publishedAt",
     ]
-    print(f"Auto-detecting latest release tag for: {org}/{repo}")
     print(f"Running command: {' '.join(cmd)}")
     out = run(cmd, stdout=PIPE)
     try:
@@ -977,6 +2004,11 @@ def _get_latest_release_tag(org, repo):
     except Exception as e:
         print(f"Error getting latest release tag for {org}/{repo}: {e}")
         print("Reverting to using latest local git tag...")
-        out = run("git describe --tags".split(), stdout=PIPE)
-        tag = out.stdout.decode().rsplit("-", 2)[0]
-        return tag
+        return _get_latest_local_tag()
+
+
+def _get_latest_local_tag():
+    """Return the latest git tag of the repository we are in."""
+    out = run("git describe --tags".split(), stdout=PIPE)
+    tag = out.stdout.decode().rsplit("-", 2)[0]
+    return tag
@@ -1,15 +1,41 @@
+import asyncio
+import copy
+import dataclasses
+import datetime
+import math
 import os
+import re
 import sys
 
-import numpy as np
-import pandas as pd
 import requests
-from tqdm.auto import tqdm
 
-from .auth import TokenAuth
+from .auth import as_auth
+from .client import get_default_client
+from .client import run_sync
+from .normalize import normalize_nodes
 
-comments_query = """\
-        comments(last: 100) {
+# GitHub search returns at most this many results for any one search
+SEARCH_RESULT_CAP = 1000
+
+# Status codes GitHub returns when a query took too long to resolve
+TIMEOUT_STATUS_CODES = (502, 504)
+# Failures after which a page is requested again, from the same cursor
+TRANSIENT_STATUS_CODES = (500, 502, 503, 504)
+TRANSIENT_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+MAX_PAGE_RETRIES = 3
+PAGE_RETRY_WAIT = 2
+
+# The format of the timestamps used in date range qualifiers
+SEARCH_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+_SEARCH_WINDOW_PATTERN = re.compile(
+    r"\b(created|closed|merged|updated):(\S+T\S+Z)\.\.(\S+T\S+Z)"
+)
+
+comment_nodes = """\
           edges {
             node {
               authorAssociation
@@ -22,11 +48,9 @@ comments_query = """\
               }
             }
           }
-        }
 """
 
-reviews_query = """\
-        reviews(last: 100) {
+review_nodes = """\
           edges {
             node {
               authorAssociation
@@ -36,11 +60,21 @@ reviews_query = """\
               }
             }
           }
-        }
 """
 
-commits_query = """\
-        commits(first: 100) {
+# Comments with only the fields needed to credit their authors
+comment_author_nodes = """\
+          edges {
+            node {
+              author {
+                login
+                __typename
+              }
+            }
+          }
+"""
+
+commit_nodes = """\
           edges {
             node {
               commit {
@@ -63,9 +97,57 @@ commits_query = """\
               }
             }
           }
-        }
 """
 
+# The connections nested in each issue/PR that may have more than one page.
+# Each maps to (paging direction, cursor argument, node selection, the types
+# that have it). Comments and reviews are paged from the most recent.
+NESTED_CONNECTIONS = {
+    "comments": ("last", "before", comment_nodes, ["PullRequest", "Issue"]),
+    "reviews": ("last", "before", review_nodes, ["PullRequest"]),
+    "commits": ("first", "after", commit_nodes, ["PullRequest"]),
+}
+NESTED_PAGE_SIZE = 100
+# The number of nested connections completed by each follow-up request
+NESTED_BATCH_SIZE = 20
+
+
+def nested_connection_query(name, cursor=None, nodes=None):
+    """Return the query for a page of a connection nested in an issue/PR.
+
+    `nodes` is the selection of each item, which defaults to every field.
+    """
+    direction, cursor_argument, default_nodes, _ = NESTED_CONNECTIONS[name]
+    nodes = nodes or default_nodes
+    arguments = f"{direction}: {NESTED_PAGE_SIZE}"
+    if cursor:
+        arguments += f', {cursor_argument}: "{cursor}"'
+    if direction == "last":
+        page_info = "hasPreviousPage startCursor"
+    else:
+        page_info = "hasNextPage endCursor"
+    return f"""\
+        {name}({arguments}) {{
+          pageInfo {{ {page_info} }}
+{nodes}\
+        }}
+"""
+
+
+def _next_page_cursor(connection):
+    """Return the cursor of a nested connection's next page, or None."""
+    page_info = (connection or {}).get("pageInfo") or {}
+    if page_info.get("hasPreviousPage"):
+        return page_info["startCursor"]
+    if page_info.get("hasNextPage"):
+        return page_info["endCursor"]
+    return None
+
+
+comments_query = nested_connection_query("comments")
+reviews_query = nested_connection_query("reviews")
+commits_query = nested_connection_query("commits")
+
 base_elements = """\
         state
         id
@@ -74,6 +156,15 @@ base_elements = """\
         createdAt
         updatedAt
         closedAt
+        number
+        authorAssociation
+        author {
+          login
+          __typename
+        }
+"""
+
+labels_query = """\
         labels(first: 10) {
             edges {
                 node {
@@ -81,20 +172,139 @@ base_elements = """\
                 }
             }
         }
-        number
-        authorAssociation
-        author {
+"""
+
+reactions_query = """\
+        reactions(content: THUMBS_UP) {
+          totalCount
+        }
+"""
+
+merge_query = """\
+        mergedBy {
           login
           __typename
         }
-        reactions(content: THUMBS_UP) {
-          totalCount
+        mergeCommit {
+          oid
         }
+        baseRefName
 """
 
-gql_template = """\
-{{
-  search({query}) {{
+
+@dataclasses.dataclass(frozen=True)
+class QueryProfile:
+    """The fields to fetch for each issue/PR of a search.
+
+    Leaving out fields that nobody will read makes responses smaller and
+    queries cheaper. The defaults fetch everything.
+    """
+
+    labels: bool = True
+    reactions: bool = True
+    merge_info: bool = True
+    comments: bool = True
+    # Whether to fetch the url, dates and author association of each comment,
+    # rather than only its author
+    comment_details: bool = True
+    reviews: bool = True
+    commits: bool = True
+
+    @classmethod
+    def for_changelog(cls):
+        """Return the profile with the fields that `generate_activity_md` uses."""
+        return cls(reactions=False, comment_details=False)
+
+    def connection_query(self, name, cursor=None):
+        """Return the query for a page of a nested connection."""
+        nodes = None
+        if name == "comments" and not self.comment_details:
+            nodes = comment_author_nodes
+        return nested_connection_query(name, cursor, nodes=nodes)
+
+    def connections(self):
+        """Return the names of the nested connections this profile fetches."""
+        return [name for name in NESTED_CONNECTIONS if getattr(self, name)]
+
+    def fields(self, node_type):
+        """Return the fields to fetch for a "PullRequest" or "Issue" node."""
+        fields = [base_elements]
+        if self.labels:
+            fields.append(labels_query)
+        if self.reactions:
+            fields.append(reactions_query)
+        if node_type == "PullRequest" and self.merge_info:
+            fields.append(merge_query)
+        for name in self.connections():
+            if node_type in NESTED_CONNECTIONS[name][3]:
+                fields.append(self.connection_query(name))
+        return "".join(fields)
+
+
+DEFAULT_PROFILE = QueryProfile()
+
+
+@dataclasses.dataclass
+class CostEstimate:
+    """The requests and GraphQL rate limit points that fetching is expected to use.
+
+    Estimates of several queries can be added together.
+    """
+
+    searches: int = 0
+    # Items found by the searches. Items that are found by more than one
+    # search (e.g. opened and closed in the window) are counted once for each.
+    results: int = 0
+    search_pages: int = 0
+    # Pages of the details of items found by two-phase searches
+    detail_pages: int = 0
+    # An upper bound, as only the items with more comments, reviews or commits
+    # than fit in their first page need follow-ups
+    nested_pages: int = 0
+    points: int = 0
+    # The `rateLimit` of the token when the estimate was made
+    rate_limit: dict = None
+
+    @property
+    def requests(self):
+        return self.search_pages + self.detail_pages + self.nested_pages
+
+    def __add__(self, other):
+        return CostEstimate(
+            searches=self.searches + other.searches,
+            results=self.results + other.results,
+            search_pages=self.search_pages + other.search_pages,
+            detail_pages=self.detail_pages + other.detail_pages,
+            nested_pages=self.nested_pages + other.nested_pages,
+            points=self.points + other.points,
+            rate_limit=other.rate_limit or self.rate_limit,
+        )
+
+    def __str__(self):
+        lines = [
+            f"Searches: {self.searches}",
+            f"Results: {self.results}",
+            f"Pages of search results: {self.search_pages}",
+            f"Pages of item details: {self.detail_pages}",
+            f"Pages of nested comments, reviews and commits: up to {self.nested_pages}",
+            f"GraphQL points: about {self.points}",
+        ]
+        if self.rate_limit:
+            lines.append(
+                f"Remaining GraphQL points: {self.rate_limit['remaining']} of "
+                f"{self.rate_limit['limit']}, until {self.rate_limit['resetAt']}"
+            )
+            if self.points > self.rate_limit["remaining"]:
+                lines.append(
+                    "The run is expected to use up the remaining points, and "
+                    "will wait for the rate limit to reset."
+                )
+        return "\n".join(lines)
+
+
+# A single search, aliased so that several searches can share one request
+search_template = """\
+  {alias}: search({query}) {{
     issueCount
     pageInfo {{
         endCursor
@@ -102,51 +312,243 @@ gql_template = """\
     }}
     nodes {{
       ... on PullRequest {{
-        {base_elements}
-        mergedBy {{
-          login
-          __typename
-        }}
-        mergeCommit {{
-          oid
-        }}
-        baseRefName
-        {comments}
-        {commits}
-        {reviews}
+{pull_request_fields}\
       }}
       ... on Issue {{
-        {base_elements}
-        {comments}
+{issue_fields}\
       }}
     }}
   }}
+"""
+
+gql_template = """\
+{{
+  rateLimit {{
+    cost
+    remaining
+    resetAt
+  }}
+{searches}
 }}
 """
 
+# A query whose point cost is calculated by GitHub without running it
+dry_run_template = """\
+{{
+  rateLimit(dryRun: true) {{
+    cost
+    limit
+    remaining
+    resetAt
+  }}
+{searches}
+}}
+"""
+
+# The fields searches fetch in the first phase of a two-phase fetch
+stub_elements = """\
+        id
+        updatedAt
+"""
+
+# The details of many items, by ID
+nodes_template = """\
+  nodes(ids: [{ids}]) {{
+    ... on PullRequest {{
+{pull_request_fields}\
+    }}
+    ... on Issue {{
+{issue_fields}\
+    }}
+  }}
+"""
+
+# The number of results of a search, without the results themselves
+count_template = """\
+  {alias}: search(query: "{query}", type: ISSUE, first: 1) {{
+    issueCount
+  }}
+"""
+
+repository_template = """\
+  repository(owner: "{owner}", name: "{name}") {{
+{connections}\
+  }}
+"""
+
+# Most recently updated first, so that paging can stop at the start of a window
+repository_connection_template = """\
+    {alias}: {alias}({arguments}, orderBy: {{field: UPDATED_AT, direction: DESC}}) {{
+      pageInfo {{
+        endCursor
+        hasNextPage
+      }}
+      nodes {{
+{fields}\
+      }}
+    }}
+"""
+
+
+def split_search_window(query):
+    """Split the date range of a search query into two halves.
+
+    The range must be a qualifier such as `created:START..END` with full
+    timestamps, as built by `get_activity`. Both ends of a range are
+    inclusive, so the halves are `START..MIDDLE` and `MIDDLE+1s..END`.
+
+    Returns
+    -------
+    queries : list of strings | None
+        The two search queries, or None if the query has no date range
+        that can be split.
+    """
+    match = _SEARCH_WINDOW_PATTERN.search(query)
+    if match is None:
+        return None
+    qualifier, start, end = match.groups()
+    try:
+        start = datetime.datetime.strptime(start, SEARCH_DATETIME_FORMAT)
+        end = datetime.datetime.strptime(end, SEARCH_DATETIME_FORMAT)
+    except ValueError:
+        return None
+    if end - start < datetime.timedelta(seconds=2):
+        return None
+
+    middle = (start + (end - start) / 2).replace(microsecond=0)
+    windows = [(start, middle), (middle + datetime.timedelta(seconds=1), end)]
+    return [
+        query[: match.start()]
+        + f"{qualifier}:{istart:{SEARCH_DATETIME_FORMAT}}..{iend:{SEARCH_DATETIME_FORMAT}}"
+        + query[match.end() :]
+        for istart, iend in windows
+    ]
+
+
+class PageSizeController:
+    def __init__(
+        self, initial=50, minimum=5, maximum=100, target_seconds=10, max_cost=100
+    ):
+        """Adapt the number of items requested per page of a search.
+
+        Each issue/PR comes with its comments, commits and reviews, so large
+        pages of busy repositories can time out while small pages of quiet
+        ones waste round trips. Pages that come back quickly and cheaply grow
+        the page size, slow pages shrink it, and a page that timed out is
+        retried at half the size.
+
+        Parameters
+        ----------
+        initial : int
+          The number of items to request in the first page.
+        minimum, maximum : int
+          The range the page size is kept within. If they are both equal to
+          `initial`, the page size is fixed.
+        target_seconds : float
+          Pages that take longer than this shrink the page size. Pages that
+          take less than half of it may grow it.
+        max_cost : int
+          The page size is not grown if a page would then cost more than this
+          many GraphQL rate limit points.
+        """
+        self.minimum = min(minimum, initial)
+        self.maximum = max(maximum, initial)
+        self.target_seconds = target_seconds
+        self.max_cost = max_cost
+        self._size = initial
+
+    @property
+    def size(self):
+        return int(self._size)
+
+    def succeeded(self, seconds, cost=None):
+        """Adjust the page size after a page took `seconds` and cost `cost`."""
+        if seconds > self.target_seconds:
+            self._size = max(self.minimum, self._size * 0.7)
+        elif seconds < self.target_seconds / 2:
+            if cost is None or cost * 1.5 <= self.max_cost:
+                self._size = min(self.maximum, self._size * 1.5)
+
+    def timed_out(self):
+        """Halve the page size after a page timed out.
+
+        Returns False if the page size can't get any smaller.
+        """
+        if self.size <= self.minimum:
+            return False
+        self._size = max(self.minimum, self._size / 2)
+        return True
+
 
 # Define our query object that we'll re-use for github search
 class GitHubGraphQlQuery:
-    def __init__(self, query, display_progress=True, auth=None):
+    def __init__(
+        self,
+        query,
+        display_progress=True,
+        auth=None,
+        client=None,
+        complete_connections=True,
+        profile=None,
+        journal=None,
+        two_phase=False,
+        retain_raw=True,
+        child_tables=False,
+    ):
         """Run a GitHub GraphQL query and return the issue/PR data from it.
 
         Parameters
         ----------
-        query : string
+        query : string | list of strings
           The GitHub search query to run. This is similar to whatever you'd use
-          to search on GitHub.com.
+          to search on GitHub.com. If a list of queries is given, they are
+          issued together as aliased fields of a single GraphQL request and
+          paginated in lock-step, and their results are merged.
         display_progress : bool
           Whether to display a progress bar as data is fetched.
-        auth : string | None
-          An authentication token for GitHub. If None, then the environment
-          variable `GITHUB_ACCESS_TOKEN` will be tried.
+        auth : string | list of strings | None
+          An authentication token for GitHub, or several tokens (a list or a
+          comma-separated string) to spread requests over. If None, then the
+          environment variable `GITHUB_ACCESS_TOKEN` will be tried.
+        client : GitHubClient | None
+          The HTTP client used to make requests. If None, a process-wide
+          client with a shared connection pool is used.
+        complete_connections : bool
+          Whether to fetch every page of the comments, reviews and commits of
+          each issue/PR. If False, only the first 100 of each are returned.
+        profile : QueryProfile | None
+          The fields to fetch for each issue/PR. Fields that are left out
+          are empty in `self.data`. If None, every field is fetched.
+        journal : CrawlJournal | None
+          If given, each page of each search is recorded in this journal, and
+          a search that was interrupted is resumed from its last page.
+        two_phase : bool
+          If True, the searches only return the ID of each item, and the
+          details of each distinct item are then fetched once, in batches.
+          Items that more than one search returns aren't fetched twice, and
+          if the client has a `node_store`, items that haven't changed since
+          they were stored aren't fetched at all.
+        retain_raw : bool
+          If True, the raw nodes are kept in `issues_and_or_prs`, and the raw
+          comments, reviews and commits of each item are columns of `data`.
+          If False, they are released once the nodes are normalized, and
+          only the columns derived from them (e.g. `commenters`) are kept.
+        child_tables : bool
+          If True, the comments, reviews and commits of the items are also
+          kept as the `comments`, `reviews` and `commits` tables, whose
+          `item` column is the position of their item in `data`. Otherwise
+          these are None.
         """
         self.query = query
+        self.queries = [query] if isinstance(query, str) else list(query)
         self.bot_users = set()  # Store detected bot usernames
 
-        # Authentication
+        self.client = client or get_default_client()
+
+        # Authentication. Replaying cached responses needs no token.
         token = auth or os.environ.get("GITHUB_ACCESS_TOKEN")
-        if not token:
+        replay = getattr(self.client.response_cache, "replay", False)
+        if not token and not replay:
             raise ValueError(
                 "Either the environment variable GITHUB_ACCESS_TOKEN or the "
                 "--auth flag or must be used to pass a Personal Access Token "
@@ -155,225 +557,827 @@ class GitHubGraphQlQuery:
                 "working with a public repository, you don't need to set any "
                 "scopes on the token you create."
             )
-        self.auth = TokenAuth(token)
-
+        self.auth = as_auth(token or "")
         self.gql_template = gql_template
         self.display_progress = display_progress
+        self.complete_connections = complete_connections
+        self.profile = profile or DEFAULT_PROFILE
+        self.journal = journal
+        self.two_phase = two_phase
+        self.retain_raw = retain_raw
+        self.child_tables = child_tables
+        self.comments = self.reviews = self.commits = None
+        self._journal_keys = []
+        # The searches whose results were cut short, see `arequest`
+        self.incomplete_searches = []
 
-    def request(self, n_pages=100, n_per_page=50):
-        """Make a request to the GitHub GraphQL API.
+    @staticmethod
+    def _search_arguments(search, n_per_page):
+        """Return the arguments of a search field for its next page."""
+        github_search_query = [
+            f"first: {n_per_page}",
+            f'query: "{search["query"]}"',
+            "type: ISSUE",
+        ]
+        if search["cursor"]:
+            github_search_query.append(f'after: "{search["cursor"]}"')
+        return ", ".join(github_search_query)
 
-        This generates an attribute `self.data` with a pandas
-        DataFrame of the issue / PR activity corresponding to
-        the query you ran.
-        """
+    def _search_fields(self, node_type):
+        """Return the fields that searches fetch for each item of a type."""
+        if self.two_phase:
+            return stub_elements
+        return self.profile.fields(node_type)
+
+    def _search_page_query(self, searches, n_per_page, template=None):
+        """Return the query for the next page of each of `searches`."""
+        return (template or self.gql_template).format(
+            searches="".join(
+                search_template.format(
+                    alias=search["alias"],
+                    query=self._search_arguments(search, n_per_page),
+                    pull_request_fields=self._search_fields("PullRequest"),
+                    issue_fields=self._search_fields("Issue"),
+                )
+                for search in searches
+            )
+        )
+
+    def _nodes_query(self, node_ids, template=None):
+        """Return the query for the details of the items with `node_ids`."""
+        return (template or self.gql_template).format(
+            searches=nodes_template.format(
+                ids=", ".join(f'"{node_id}"' for node_id in node_ids),
+                pull_request_fields=self.profile.fields("PullRequest"),
+                issue_fields=self.profile.fields("Issue"),
+            )
+        )
 
+    def _start_search(self, alias, query):
+        """Return the state of a search, resumed from the journal if possible."""
+        search = {
+            "alias": alias,
+            "query": query,
+            "cursor": None,
+            "hasNextPage": True,
+            "pages": 0,
+            "nodes": [],
+        }
+        if self.journal is None:
+            return search
+
+        fields = self._search_fields("PullRequest") + self._search_fields("Issue")
+        search["key"] = self.journal.key(query, fields, self.auth)
+        self._journal_keys.append(search["key"])
+        progress = self.journal.load(search["key"])
+        if progress:
+            print(
+                f"Resuming search `{query}` after {progress['pages']} pages",
+                file=sys.stderr,
+            )
+            search.update(progress)
+        return search
+
+    async def _fetch(self, n_pages, report=True):
+        """Fetch every page of this query's searches and return the raw nodes.
+
+        A search with more results than GitHub will return is split into
+        smaller date windows (recursively, if needed), which are fetched
+        concurrently with the rest of the query.
+
+        Requests that fail with a transient error are retried from the last
+        cursor. If a journal is used, each page is recorded in it so that a
+        crawl that fails anyway can be resumed by running it again.
+        """
         # NOTE: This main search query has a type, but the query string also has a type.
         # ref ("search"): https://developer.github.com/v4/query/#connections
-        # Collect paginated issues
-        pageInfo = None
-        self.issues_and_or_prs = []
-        for ii in range(n_pages):
-            github_search_query = [
-                "first: %s" % n_per_page,
-                'query: "%s"' % self.query,
-                "type: ISSUE",
-            ]
-            if ii != 0:
-                github_search_query.append('after: "%s"' % pageInfo["endCursor"])
-
-            ii_gql_query = self.gql_template.format(
-                query=", ".join(github_search_query),
-                comments=comments_query,
-                base_elements=base_elements,
-                reviews=reviews_query,
-                commits=commits_query,
-            )
-            ii_request = requests.post(
-                "https://api.github.com/graphql",
-                json={"query": ii_gql_query},
-                auth=self.auth,
+        # Each search keeps its own cursor. Searches that still have pages are
+        # requested together, so the number of round trips is set by the
+        # largest search rather than by their sum.
+        searches = [
+            self._start_search(f"search{ii}", query)
+            for ii, query in enumerate(self.queries)
+        ]
+        active = [search for search in searches if search["hasNextPage"]]
+        prog = None
+        try:
+            while active:
+                data, n_per_page = await self._request_page(
+                    lambda n_per_page: self._search_page_query(active, n_per_page)
+                )
+                if prog is None:
+                    counts = [data[s["alias"]]["issueCount"] for s in active]
+                    issue_count = sum(counts)
+                    if issue_count == 0:
+                        if report:
+                            print("Found no entries for query.", file=sys.stderr)
+                        for search in active:
+                            search["hasNextPage"] = False
+                        break
+
+                    for search, count in zip(active, counts):
+                        if count > SEARCH_RESULT_CAP:
+                            self._shard(search, count, n_pages)
+
+                    # This is an estimate, as the page size may change
+                    n_pages_estimate = math.ceil(max(counts) / n_per_page)
+                    if report:
+                        print(
+                            "Found {} items, which will take {} pages".format(
+                                issue_count, n_pages_estimate
+                            ),
+                            file=sys.stderr,
+                        )
+                    from tqdm.auto import tqdm
+
+                    prog = tqdm(
+                        total=issue_count,
+                        desc="Downloading:",
+                        unit="issues",
+                        disable=n_pages_estimate == 1 or not self.display_progress,
+                    )
+                    prog.update(sum(len(search["nodes"]) for search in searches))
+
+                # Add the JSON to the raw data list of each search
+                n_nodes = 0
+                for search in active:
+                    if "shards" in search:
+                        # This search is being fetched in smaller windows
+                        continue
+                    json = data[search["alias"]]
+                    search["nodes"].extend(json["nodes"])
+                    search["cursor"] = json["pageInfo"]["endCursor"]
+                    search["hasNextPage"] = json["pageInfo"]["hasNextPage"]
+                    search["pages"] += 1
+                    n_nodes += len(json["nodes"])
+                    self._record_page(search, json["nodes"])
+
+                # Update progress and should we stop?
+                prog.update(n_nodes)
+                active = [
+                    search
+                    for search in active
+                    if search["hasNextPage"] and search["pages"] < n_pages
+                ]
+
+            # Searches that still have pages were stopped by `n_pages`
+            self.incomplete_searches.extend(
+                search["query"]
+                for search in searches
+                if search["hasNextPage"] and "shards" not in search
             )
-            if ii_request.status_code != 200:
-                # Check for common error cases and provide helpful messages
-                if ii_request.status_code == 403:
-                    try:
-                        error_data = ii_request.json()
-                        error_message = error_data.get("message", "")
-                        if "rate limit" in error_message.lower():
-                            raise Exception(
-                                f"GitHub API rate limit exceeded. {error_message}\n"
-                                "Please wait before making more requests, or use an authentication token with higher rate limits."
-                            )
-                        else:
-                            # Generic 403 - likely a permissions issue
-                            raise Exception(
-                                f"GitHub API access forbidden. {error_message}\n"
-                                "This usually means your authentication token doesn't have the required permissions.\n"
-                                "Please check that your token has the necessary scopes for this repository."
-                            )
-                    except (ValueError, KeyError):
-                        pass
-                raise Exception(
-                    "Query failed to run by returning code of {}. {}".format(
-                        ii_request.status_code, ii_gql_query
+
+            # Collect the searches that were split into smaller windows
+            for search in searches:
+                if "shards" in search:
+                    for shard_nodes in await search["shards"]:
+                        search["nodes"].extend(shard_nodes)
+                        prog.update(len(shard_nodes))
+        finally:
+            for search in searches:
+                if "shards" in search:
+                    search["shards"].cancel()
+
+        # Merge the searches in order, keeping the first copy of any item
+        # that more than one search (or window) returned
+        seen = set()
+        nodes = []
+        for search in searches:
+            for node in search["nodes"]:
+                if node["id"] not in seen:
+                    seen.add(node["id"])
+                    nodes.append(node)
+        return nodes
+
+    async def _request_page(self, make_query, missing_ok=False):
+        """Request one page of results and return its data and page size.
+
+        `make_query` returns the query for a given page size. If the page
+        times out, it is requested again with fewer items. Other transient
+        failures are retried with the same query, i.e. from the same cursor.
+        If `missing_ok` is True, items that no longer exist are null rather
+        than an error.
+        """
+        failures = 0
+        while True:
+            n_per_page = self.page_size.size
+            gql_query = make_query(n_per_page)
+            error = None
+            try:
+                response = await self.client.agraphql(gql_query, auth=self.auth)
+            except TRANSIENT_ERRORS as e:
+                response, error = None, e
+            status_code = getattr(response, "status_code", None)
+            if (
+                isinstance(error, requests.exceptions.Timeout)
+                or status_code in TIMEOUT_STATUS_CODES
+            ):
+                # Retry the same page with fewer items
+                if self.page_size.timed_out():
+                    print(
+                        f"Query timed out, retrying with {self.page_size.size} items per page",
+                        file=sys.stderr,
                     )
+                    continue
+            if error is not None or status_code in TRANSIENT_STATUS_CODES:
+                # Retry from the last cursor, as nothing was lost
+                failures += 1
+                if failures <= MAX_PAGE_RETRIES:
+                    delay = PAGE_RETRY_WAIT * 2 ** (failures - 1)
+                    print(
+                        f"Query failed ({error or status_code}), retrying in {delay} seconds",
+                        file=sys.stderr,
+                    )
+                    await asyncio.sleep(delay)
+                    continue
+                if error is not None:
+                    raise Exception(
+                        f"Query failed to run with error {error}. {gql_query}"
+                    ) from error
+            self._check_response(response, gql_query, missing_ok=missing_ok)
+            self.last_request = response
+            self.last_query = gql_query
+
+            # Parse the response for this pagination
+            data = response.json()["data"]
+            rate_limit = data.get("rateLimit")
+            self.client.record_graphql_rate_limit(self.auth, rate_limit)
+            self.page_size.succeeded(
+                response.elapsed.total_seconds(),
+                rate_limit["cost"] if rate_limit else None,
+            )
+            return data, n_per_page
+
+    async def _hydrate(self, stubs):
+        """Fetch the details of the items found by a two-phase search.
+
+        Returns the items in the order of `stubs`, and the IDs of the ones
+        that were fetched rather than taken from the node store.
+        """
+        store = self.client.node_store
+        fields = self.profile.fields("PullRequest") + self.profile.fields("Issue")
+        nodes = {}
+        if store is not None:
+            for stub in stubs:
+                node = store.get(stub["id"], fields, stub["updatedAt"])
+                if node is not None:
+                    nodes[stub["id"]] = node
+        missing = [stub["id"] for stub in stubs if stub["id"] not in nodes]
+        if store is not None and len(missing) < len(stubs):
+            print(
+                f"Re-using {len(stubs) - len(missing)} unchanged items, fetching {len(missing)}",
+                file=sys.stderr,
+            )
+
+        position = 0
+        while position < len(missing):
+            data, n_per_page = await self._request_page(
+                lambda n_per_page: self._nodes_query(
+                    missing[position : position + n_per_page]
+                ),
+                missing_ok=True,
+            )
+            # Items that were deleted since the search are null
+            nodes.update((node["id"], node) for node in data["nodes"] if node)
+            position += n_per_page
+        return [nodes[stub["id"]] for stub in stubs if stub["id"] in nodes], missing
+
+    def _record_page(self, search, nodes):
+        """Record a page of a search in the journal, if there is one."""
+        # A search that fits in one page has nothing to resume
+        if search["pages"] == 1 and not search["hasNextPage"]:
+            return
+        if self.journal is not None:
+            self.journal.append(
+                search["key"], nodes, search["cursor"], search["hasNextPage"]
+            )
+
+    def _shard(self, search, count, n_pages):
+        """Start fetching a search that is too large in two smaller windows."""
+        windows = split_search_window(search["query"])
+        if windows is None:
+            print(
+                f"Found {count} items for search `{search['query']}`, but GitHub "
+                f"only returns the first {SEARCH_RESULT_CAP}, so some will be missing.",
+                file=sys.stderr,
+            )
+            self.incomplete_searches.append(search["query"])
+            return
+
+        shards = []
+        for window in windows:
+            shard = copy.copy(self)
+            shard.queries = [window]
+            shard.display_progress = False
+            shards.append(shard._fetch(n_pages, report=False))
+        search["shards"] = asyncio.ensure_future(asyncio.gather(*shards))
+        search["hasNextPage"] = False
+
+    async def _complete_nested_connections(self, nodes):
+        """Fetch the remaining pages of the connections nested in each item.
+
+        The first page of comments, reviews and commits comes with the search.
+        Connections with more pages are completed here, many per request, and
+        the extra items are spliced into the raw nodes.
+        """
+        pending = [
+            (node, name) for node in nodes for name in self.profile.connections()
+        ]
+        pending = [
+            (node, name) for node, name in pending if _next_page_cursor(node.get(name))
+        ]
+        if pending:
+            print(
+                f"Fetching more comments, reviews or commits for {len(pending)} items",
+                file=sys.stderr,
+            )
+        while pending:
+            batches = [
+                pending[ii : ii + NESTED_BATCH_SIZE]
+                for ii in range(0, len(pending), NESTED_BATCH_SIZE)
+            ]
+            await asyncio.gather(
+                *(self._fetch_nested_pages(batch) for batch in batches)
+            )
+            pending = [
+                (node, name) for node, name in pending if _next_page_cursor(node[name])
+            ]
+
+    async def _fetch_nested_pages(self, batch):
+        """Fetch the next page of each (node, connection name) in `batch`.
+
+        The request is retried like a page of a search. If it times out, only
+        the first part of the batch is requested again, and the rest is left
+        for the next round.
+        """
+
+        def make_query(n_per_page):
+            # Every item needs its own cursor, so look each one up with an
+            # aliased `node` field rather than a single `nodes(ids: [...])` field
+            fields = []
+            for ii, (node, name) in enumerate(batch[:n_per_page]):
+                node_type = "PullRequest" if "/pull/" in node["url"] else "Issue"
+                connection = self.profile.connection_query(
+                    name, _next_page_cursor(node[name])
                 )
-            errors = ii_request.json().get("errors")
-            if errors:
-                # Check for rate limit errors in GraphQL response
-                for error in errors:
-                    if error.get("type") == "RATE_LIMITED":
-                        error_message = error.get("message", "Rate limit exceeded")
+                fields.append(
+                    f'  item{ii}: node(id: "{node["id"]}") {{\n'
+                    f"    ... on {node_type} {{\n{connection}    }}\n  }}\n"
+                )
+            return self.gql_template.format(searches="".join(fields))
+
+        data, n_per_page = await self._request_page(make_query, missing_ok=True)
+        for ii, (node, name) in enumerate(batch[:n_per_page]):
+            connection = node[name]
+            item = data[f"item{ii}"]
+            if item is None:
+                # The item was deleted or became inaccessible since the search
+                print(
+                    f"Could not fetch more {name} of {node['url']}, keeping "
+                    f"the first {len(connection['edges'])}",
+                    file=sys.stderr,
+                )
+                connection["pageInfo"] = {"hasNextPage": False}
+                continue
+            page = item[name]
+            if NESTED_CONNECTIONS[name][0] == "last":
+                # We're paging back in time, so earlier items go first
+                connection["edges"] = page["edges"] + connection["edges"]
+            else:
+                connection["edges"] = connection["edges"] + page["edges"]
+            connection["pageInfo"] = page["pageInfo"]
+
+    def _check_response(self, response, gql_query, missing_ok=False):
+        """Raise a helpful error if a GraphQL request did not succeed.
+
+        If `missing_ok` is True, items that no longer exist aren't an error.
+        """
+        if response.status_code != 200:
+            # Check for common error cases and provide helpful messages
+            if response.status_code == 403:
+                try:
+                    error_data = response.json()
+                    error_message = error_data.get("message", "")
+                    if "rate limit" in error_message.lower():
                         raise Exception(
                             f"GitHub API rate limit exceeded. {error_message}\n"
                             "Please wait before making more requests, or use an authentication token with higher rate limits."
                         )
-                raise Exception(
-                    "Query failed to run with error {}. {}".format(errors, ii_gql_query)
+                    else:
+                        # Generic 403 - likely a permissions issue
+                        raise Exception(
+                            f"GitHub API access forbidden. {error_message}\n"
+                            "This usually means your authentication token doesn't have the required permissions.\n"
+                            "Please check that your token has the necessary scopes for this repository."
+                        )
+                except (ValueError, KeyError):
+                    pass
+            raise Exception(
+                "Query failed to run by returning code of {}. {}".format(
+                    response.status_code, gql_query
                 )
-            self.last_request = ii_request
+            )
+        errors = response.json().get("errors")
+        if errors and missing_ok:
+            # Items that were deleted are null, and reported as not found
+            errors = [error for error in errors if error.get("type") != "NOT_FOUND"]
+        if errors:
+            # Check for rate limit errors in GraphQL response
+            for error in errors:
+                if error.get("type") == "RATE_LIMITED":
+                    error_message = error.get("message", "Rate limit exceeded")
+                    raise Exception(
+                        f"GitHub API rate limit exceeded. {error_message}\n"
+                        "Please wait before making more requests, or use an authentication token with higher rate limits."
+                    )
+            raise Exception(
+                "Query failed to run with error {}. {}".format(errors, gql_query)
+            )
 
-            # Parse the response for this pagination
-            json = ii_request.json()["data"]["search"]
-            if ii == 0:
-                if json["issueCount"] == 0:
-                    print("Found no entries for query.", file=sys.stderr)
-                    self.data = pd.DataFrame()
-                    return
-
-                n_pages = int(np.ceil(json["issueCount"] / n_per_page))
-                print(
-                    "Found {} items, which will take {} pages".format(
-                        json["issueCount"], n_pages
-                    ),
-                    file=sys.stderr,
-                )
-                prog = tqdm(
-                    total=json["issueCount"],
-                    desc="Downloading:",
-                    unit="issues",
-                    disable=n_pages == 1 or not self.display_progress,
+    async def aestimate(self, n_per_page=50, page_costs=None):
+        """Estimate what `arequest` would fetch, without fetching it.
+
+        Only the number of results of each search is fetched. The point cost
+        of a page is calculated by GitHub with a dry run of its query.
+
+        Parameters
+        ----------
+        n_per_page : int
+          The `n_per_page` that `arequest` would be called with. The page
+          size adapts as pages are fetched, so this is an approximation.
+        page_costs : dict | None
+          The point costs of pages, by query shape. Queries with the same
+          number of searches and fields cost the same, so a dictionary shared
+          between them saves dry runs.
+
+        Returns
+        -------
+        estimate : CostEstimate
+        """
+        page_costs = {} if page_costs is None else page_costs
+        counts = await count_search_results(self.queries, self.auth, self.client)
+        searches = [
+            {"alias": f"search{ii}", "query": query, "cursor": None}
+            for ii, query in enumerate(self.queries)
+        ]
+        search_size = PageSizeController().maximum if self.two_phase else n_per_page
+        estimate = CostEstimate(searches=len(searches), results=sum(counts))
+
+        # Searches are fetched together, so they take as many requests as the
+        # largest one. Searches over the cap are split into separate windows,
+        # each of which first checks its number of results.
+        pages = [max(1, math.ceil(count / search_size)) for count in counts]
+        estimate.search_pages = max(
+            [n for n, count in zip(pages, counts) if count <= SEARCH_RESULT_CAP],
+            default=0,
+        )
+        for n, count in zip(pages, counts):
+            if count > SEARCH_RESULT_CAP:
+                estimate.search_pages += n + 2 * math.ceil(count / SEARCH_RESULT_CAP)
+
+        if self.two_phase:
+            estimate.detail_pages = math.ceil(estimate.results / n_per_page)
+        if self.complete_connections:
+            estimate.nested_pages = math.ceil(
+                estimate.results * len(self.profile.connections()) / NESTED_BATCH_SIZE
+            )
+
+        # Pages of queries with the same shape cost the same
+        fields = dataclasses.astuple(self.profile) + (self.two_phase,)
+        search_shape = ("search", len(searches), search_size) + fields
+        nodes_shape = ("nodes", n_per_page) + fields
+        dry_runs = {
+            search_shape: lambda: self._search_page_query(
+                searches, search_size, template=dry_run_template
+            )
+        }
+        if self.two_phase:
+            dry_runs[nodes_shape] = lambda: self._nodes_query(
+                [f"id{ii}" for ii in range(n_per_page)], template=dry_run_template
+            )
+        for shape, make_query in dry_runs.items():
+            if shape in page_costs:
+                continue
+            gql_query = make_query()
+            response = await self.client.agraphql(gql_query, auth=self.auth)
+            self._check_response(response, gql_query)
+            estimate.rate_limit = response.json()["data"]["rateLimit"]
+            page_costs[shape] = estimate.rate_limit["cost"]
+
+        estimate.points = (
+            # The request that counted the results
+            1
+            + estimate.search_pages * page_costs[search_shape]
+            + estimate.detail_pages * page_costs.get(nodes_shape, 0)
+            # Nested pages are small, and cost a point each
+            + estimate.nested_pages
+        )
+        return estimate
+
+    def request(self, n_pages=100, n_per_page=50, adaptive=True):
+        """Make a request to the GitHub GraphQL API.
+
+        This generates an attribute `self.data` with a pandas
+        DataFrame of the issue / PR activity corresponding to
+        the query you ran.
+
+        Parameters
+        ----------
+        n_pages : int
+          The maximum number of pages to fetch for each search.
+        n_per_page : int
+          The number of items to fetch in the first page.
+        adaptive : bool
+          If True, the page size is adapted to how long pages take to fetch
+          and what they cost (see `PageSizeController`). If False, every page
+          has `n_per_page` items.
+        """
+        run_sync(
+            self.arequest(n_pages=n_pages, n_per_page=n_per_page, adaptive=adaptive)
+        )
+
+    async def arequest(self, n_pages=100, n_per_page=50, adaptive=True):
+        """Asynchronous version of `request`.
+
+        Pages of one query depend on each other's cursors and are fetched in
+        order, but several queries can be awaited concurrently.
+
+        Afterwards, `incomplete_searches` lists the searches whose results
+        were cut short, by `n_pages` or by GitHub's cap on the results of a
+        search that couldn't be split into smaller windows.
+        """
+
+        def page_size(initial):
+            if adaptive:
+                return PageSizeController(initial)
+            return PageSizeController(n_per_page, n_per_page, n_per_page)
+
+        # Searching for IDs alone is cheap, so start with the largest pages
+        self.page_size = page_size(
+            PageSizeController().maximum if self.two_phase else n_per_page
+        )
+        # Shared with the copies of this query that fetch parts of a search
+        self._journal_keys = []
+        self.incomplete_searches = []
+        self.issues_and_or_prs = await self._fetch(n_pages)
+        fetched = None
+        if self.two_phase:
+            self.page_size = page_size(n_per_page)
+            self.issues_and_or_prs, fetched = await self._hydrate(
+                self.issues_and_or_prs
+            )
+        if self.complete_connections:
+            await self._complete_nested_connections(self.issues_and_or_prs)
+        if fetched and self.client.node_store is not None:
+            fields = self.profile.fields("PullRequest") + self.profile.fields("Issue")
+            fetched = set(fetched)
+            for node in self.issues_and_or_prs:
+                if node["id"] in fetched:
+                    self.client.node_store.put(node, fields)
+        # The crawl is complete, so there is nothing left to resume
+        for key in self._journal_keys:
+            self.journal.remove(key)
+        if not self.issues_and_or_prs:
+            import pandas as pd
+
+            self.data = pd.DataFrame()
+            if self.child_tables:
+                self.comments = self.reviews = self.commits = pd.DataFrame()
+            return
+
+        self.data, children = normalize_nodes(
+            self.issues_and_or_prs,
+            retain_raw=self.retain_raw,
+            child_tables=self.child_tables,
+        )
+        if children is not None:
+            self.comments = children["comments"]
+            self.reviews = children["reviews"]
+            self.commits = children["commits"]
+        if not self.retain_raw:
+            self.issues_and_or_prs = None
+
+
+class GitHubRepositoryQuery(GitHubGraphQlQuery):
+    def __init__(self, org, repo, since, until, kind=None, branch=None, **kwargs):
+        """Fetch the issues/PRs of a repository without the search API.
+
+        The `pullRequests` and `issues` of the repository are paged through
+        from the most recently updated, stopping at the first item that was
+        last updated before `since`. The items created or closed within the
+        window are kept, which are the ones a search for the window returns.
+
+        Unlike a search, this isn't limited to 1000 results, isn't subject to
+        the stricter rate limits of the search API, and doesn't lag behind
+        while GitHub indexes recent changes. But every item updated since
+        `since` is fetched, so it costs more than a search for old windows.
+
+        Parameters
+        ----------
+        org : string
+          The organization or user that owns the repository.
+        repo : string
+          The name of the repository.
+        since : string
+          The start of the window, as a UTC timestamp in
+          `SEARCH_DATETIME_FORMAT`.
+        until : string
+          The end of the window, in the same format.
+        kind : ["issue", "pr"] | None
+          Return only issues or PRs. If None, both will be returned.
+        branch : string | None
+          Only return the PRs that target this branch.
+        **kwargs
+          Passed to `GitHubGraphQlQuery`.
+        """
+        super().__init__(f"repo:{org}/{repo}", **kwargs)
+        # Each item is only listed once, so there is nothing to deduplicate
+        self.two_phase = False
+        self.org = org
+        self.repo = repo
+        self.since = since
+        self.until = until
+        self.branch = branch
+        self.connection_names = [
+            name
+            for name_kind, name in [("pr", "pullRequests"), ("issue", "issues")]
+            if kind in (None, name_kind)
+        ]
+
+    def _repository_query(self, connections, n_per_page, template=None):
+        """Return the query for the next page of each connection."""
+        fields = []
+        for connection in connections:
+            arguments = f"first: {n_per_page}"
+            if connection["cursor"]:
+                arguments += f', after: "{connection["cursor"]}"'
+            if self.branch and connection["alias"] == "pullRequests":
+                arguments += f', baseRefName: "{self.branch}"'
+            node_type = (
+                "PullRequest" if connection["alias"] == "pullRequests" else "Issue"
+            )
+            fields.append(
+                repository_connection_template.format(
+                    alias=connection["alias"],
+                    arguments=arguments,
+                    fields=self.profile.fields(node_type),
                 )
+            )
+        return (template or self.gql_template).format(
+            searches=repository_template.format(
+                owner=self.org, name=self.repo, connections="".join(fields)
+            )
+        )
+
+    async def _fetch(self, n_pages, report=True):
+        """Fetch the pages of each connection and return the raw nodes."""
+        # The journal tells connections apart by this description
+        connections = [
+            self._start_search(
+                name, f"{self.query} {name} base:{self.branch} updated:>={self.since}"
+            )
+            for name in self.connection_names
+        ]
+        active = [connection for connection in connections if connection["hasNextPage"]]
+        from tqdm.auto import tqdm
 
-            # Add the JSON to the raw data list
-            self.issues_and_or_prs.extend(json["nodes"])
-            pageInfo = json["pageInfo"]
-            self.last_query = ii_gql_query
-
-            # Update progress and should we stop?
-            prog.update(len(json["nodes"]))
-            if not pageInfo["hasNextPage"]:
-                break
-
-        # Extract bot users from raw data before DataFrame conversion
-        def is_bot(user_dict):
-            """Check if a GraphQL user object represents a bot account."""
-            return user_dict and user_dict.get("__typename") == "Bot"
-
-        bot_users = set()
-        for item in self.issues_and_or_prs:
-            # Check author
-            author = item.get("author")
-            if is_bot(author):
-                bot_users.add(author["login"])
-
-            # Check mergedBy
-            merged_by = item.get("mergedBy")
-            if is_bot(merged_by):
-                bot_users.add(merged_by["login"])
-
-            # Check reviewers
-            reviews = item.get("reviews")
-            if reviews:
-                for review in reviews.get("edges", []):
-                    review_author = review["node"].get("author")
-                    if is_bot(review_author):
-                        bot_users.add(review_author["login"])
-
-            # Check commenters
-            comments = item.get("comments")
-            if comments:
-                for comment in comments.get("edges", []):
-                    comment_author = comment["node"].get("author")
-                    if is_bot(comment_author):
-                        bot_users.add(comment_author["login"])
-
-            # Check commit authors and committers
-            commits = item.get("commits")
-            if commits:
-                for commit_edge in commits.get("edges", []):
-                    commit = commit_edge["node"]["commit"]
-                    # Check committer
-                    committer = commit.get("committer")
-                    if committer and committer.get("user"):
-                        if is_bot(committer["user"]):
-                            bot_users.add(committer["user"]["login"])
-                    # Check authors
-                    authors = commit.get("authors")
-                    if authors:
-                        for author_edge in authors.get("edges", []):
-                            author_user = author_edge["node"].get("user")
-                            if author_user and is_bot(author_user):
-                                bot_users.add(author_user["login"])
-
-        # Create a dataframe of the issues and/or PRs
-        self.data = pd.DataFrame(self.issues_and_or_prs)
-        self.data.attrs["bot_users"] = bot_users
-
-        # Add some extra fields
-        def get_login(user):
-            return user["login"] if pd.notna(user) else user
-
-        self.data["author"] = self.data["author"].map(get_login)
-        self.data["mergedBy"] = self.data["mergedBy"].map(get_login)
-
-        self.data["org"] = self.data["url"].map(lambda a: a.split("/")[3])
-        self.data["repo"] = self.data["url"].map(lambda a: a.split("/")[4])
-        self.data["labels"] = self.data["labels"].map(
-            lambda a: [edge["node"]["name"] for edge in a["edges"]]
+        prog = tqdm(
+            desc="Downloading:", unit="issues", disable=not self.display_progress
         )
-        self.data["kind"] = self.data["url"].map(
-            lambda a: "issue" if "issues/" in a else "pr"
+        prog.update(sum(len(connection["nodes"]) for connection in connections))
+        while active:
+            data, _ = await self._request_page(
+                lambda n_per_page: self._repository_query(active, n_per_page)
+            )
+            for connection in active:
+                page = data["repository"][connection["alias"]]
+                nodes = [
+                    node for node in page["nodes"] if node["updatedAt"] >= self.since
+                ]
+                connection["nodes"].extend(nodes)
+                connection["cursor"] = page["pageInfo"]["endCursor"]
+                # Items are sorted by when they were last updated, so once one
+                # is older than the window, so are all of the rest
+                connection["hasNextPage"] = page["pageInfo"]["hasNextPage"] and len(
+                    nodes
+                ) == len(page["nodes"])
+                connection["pages"] += 1
+                self._record_page(connection, nodes)
+                prog.update(len(nodes))
+            active = [
+                connection
+                for connection in active
+                if connection["hasNextPage"] and connection["pages"] < n_pages
+            ]
+
+        nodes = [
+            node
+            for connection in connections
+            for node in connection["nodes"]
+            if self._in_window(node)
+        ]
+        if report:
+            print(f"Found {len(nodes)} items in {self.query}", file=sys.stderr)
+        return nodes
+
+    async def aestimate(self, n_per_page=50, page_costs=None):
+        """Estimate what `arequest` would fetch, without fetching it.
+
+        Every item updated since the start of the window is listed, so their
+        number is counted with a search. The point cost of a page is
+        calculated by GitHub with a dry run of its query. The parameters are
+        those of `GitHubGraphQlQuery.aestimate`.
+
+        Returns
+        -------
+        estimate : CostEstimate
+        """
+        page_costs = {} if page_costs is None else page_costs
+        qualifiers = {
+            "pullRequests": f"is:pr base:{self.branch}" if self.branch else "is:pr",
+            "issues": "is:issue",
+        }
+        counts = await count_search_results(
+            [
+                f"{self.query} {qualifiers[name]} updated:>={self.since}"
+                for name in self.connection_names
+            ],
+            self.auth,
+            self.client,
+        )
+        # There are no searches, but the items that are listed and then left
+        # out for being outside of the window still count as results
+        estimate = CostEstimate(results=sum(counts))
+        # The connections are paged through together
+        estimate.search_pages = max(
+            max(1, math.ceil(count / n_per_page)) for count in counts
         )
+        if self.complete_connections:
+            estimate.nested_pages = math.ceil(
+                estimate.results * len(self.profile.connections()) / NESTED_BATCH_SIZE
+            )
 
-        self.data["thumbsup"] = self.data["reactions"].map(lambda a: a["totalCount"])
-        self.data.drop(columns="reactions", inplace=True)
-
-        def get_reviewers(reviews):
-            """map review graph to unique list of reviewers"""
-            if pd.isna(reviews) or not reviews:
-                return []
-            reviewers = {
-                review["node"]["author"]["login"]
-                for review in reviews["edges"]
-                if review.get("node", {}).get("author")
-                and review["node"]["author"].get("login")
-            }
-            return sorted(reviewers)
-
-        self.data["reviewers"] = self.data["reviews"].map(get_reviewers)
-
-        def get_committers(commits):
-            """map commit graph to non-unique ordered list of commit authors"""
-            if pd.isna(commits) or not commits:
-                return []
-            committers = []
-            for commit in commits["edges"]:
-                commit = commit["node"]["commit"]
-                commit_authors = []
-                for author in commit["authors"]["edges"]:
-                    author = author["node"]
-                    if author and author["user"]:
-                        commit_authors.append(author["user"]["login"])
-                    committer = commit["committer"]
-                    if (
-                        committer
-                        and committer["user"]
-                        and committer["user"]["login"] not in commit_authors
-                    ):
-                        commit_authors.append(committer["user"]["login"])
-                committers.extend(commit_authors)
-            return committers
-
-        self.data["committers"] = self.data["commits"].map(get_committers)
+        shape = (
+            "repository",
+            tuple(self.connection_names),
+            n_per_page,
+            bool(self.branch),
+        ) + dataclasses.astuple(self.profile)
+        if shape not in page_costs:
+            connections = [
+                {"alias": name, "cursor": None} for name in self.connection_names
+            ]
+            gql_query = self._repository_query(
+                connections, n_per_page, template=dry_run_template
+            )
+            response = await self.client.agraphql(gql_query, auth=self.auth)
+            self._check_response(response, gql_query)
+            estimate.rate_limit = response.json()["data"]["rateLimit"]
+            page_costs[shape] = estimate.rate_limit["cost"]
+
+        estimate.points = (
+            # The request that counted the results
+            1
+            + estimate.search_pages * page_costs[shape]
+            # Nested pages are small, and cost a point each
+            + estimate.nested_pages
+        )
+        return estimate
+
+    def _in_window(self, node):
+        """Return True if an item was created or closed within the window."""
+        return any(
+            node[field] and self.since <= node[field] <= self.until
+            for field in ("createdAt", "closedAt")
+        )
+
+
+async def count_search_results(queries, auth, client=None):
+    """Return the number of results of each search query, with one request.
+
+    Parameters
+    ----------
+    queries : list of strings
+      The GitHub search queries.
+    auth : string
+      An authentication token for GitHub.
+    client : GitHubClient | None
+      The HTTP client to make the request with. If None, a process-wide
+      client is used.
+    """
+    client = client or get_default_client()
+    auth = as_auth(auth)
+    gql_query = gql_template.format(
+        searches="".join(
+            count_template.format(alias=f"search{ii}", query=query)
+            for ii, query in enumerate(queries)
+        )
+    )
+    response = await client.agraphql(gql_query, auth=auth)
+    response.raise_for_status()
+    result = response.json()
+    if result.get("errors"):
+        raise Exception(f"Query failed to run with error {result['errors']}")
+    data = result["data"]
+    client.record_graphql_rate_limit(auth, data.get("rateLimit"))
+    return [data[f"search{ii}"]["issueCount"] for ii in range(len(queries))]
@@ -0,0 +1,334 @@
+"""On-disk stores of responses from the GitHub API."""
+
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+DEFAULT_PATH_HTTP_CACHE = Path("~/.cache/github_activity").expanduser()
+
+# The response headers that are stored with a response
+STORED_HEADERS = ["content-type", "etag", "last-modified"]
+
+
+def _auth_fingerprint(auth):
+    """Return a short, non-reversible identifier of the token used for a request."""
+    # The tokens of a pool are interchangeable, so they share a fingerprint
+    tokens = getattr(auth, "tokens", None)
+    token = "\n".join(sorted(tokens)) if tokens else getattr(auth, "token", None)
+    if token is None:
+        return ""
+    return hashlib.sha256(token.encode()).hexdigest()[:16]
+
+
+def _stored_response(url, entry):
+    """Rebuild a `requests.Response` from a stored entry."""
+    response = requests.Response()
+    response.url = url
+    response.status_code = entry["status"]
+    response.headers = CaseInsensitiveDict(entry["headers"])
+    response._content = entry["body"].encode()
+    response.encoding = "utf-8"
+    # Replay how long the request took, as the page size of searches adapts to it
+    response.elapsed = datetime.timedelta(seconds=entry.get("elapsed", 0))
+    return response
+
+
+class ValidatorStore:
+    def __init__(self, path=None):
+        """Store REST responses with their `ETag` / `Last-Modified` validators.
+
+        Stored responses are revalidated with `If-None-Match` and
+        `If-Modified-Since`. GitHub answers with a `304 Not Modified` if they
+        haven't changed, which doesn't count against the REST rate limit.
+        Responses stored as immutable are served without a request.
+
+        Parameters
+        ----------
+        path : str | Path | None
+          The folder to store responses in. If None, a `validators` folder in
+          `~/.cache/github_activity` is used.
+        """
+        if path is None:
+            path = DEFAULT_PATH_HTTP_CACHE.joinpath("validators")
+        self.path = Path(path)
+
+    @staticmethod
+    def key(method, url, auth):
+        # Responses may differ between tokens, e.g. for private repositories
+        key = f"{method} {url} {_auth_fingerprint(auth)}"
+        return hashlib.sha256(key.encode()).hexdigest()
+
+    def get(self, key):
+        """Return the entry stored for `key`, or None."""
+        try:
+            with self.path.joinpath(f"{key}.json").open() as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, key, response, immutable=False):
+        """Store a response, if it can be revalidated or is immutable."""
+        headers = {
+            name: response.headers[name]
+            for name in STORED_HEADERS
+            if name in response.headers
+        }
+        if not (immutable or "etag" in headers or "last-modified" in headers):
+            return
+        entry = {
+            "status": response.status_code,
+            "headers": headers,
+            "body": response.text,
+            "immutable": immutable,
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        path = self.path.joinpath(f"{key}.json")
+        # Write to a temporary file first so that readers never see half an entry
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.path, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(entry, f)
+        os.replace(f.name, path)
+
+    def request(self, send, method, url, immutable=False, **kwargs):
+        """Make a GET or HEAD request with `send`, revalidating stored responses.
+
+        If `immutable` is True, a successful response is stored for good and
+        served from then on without making a request.
+        """
+        key = self.key(method, url, kwargs.get("auth"))
+        entry = self.get(key)
+        if entry and entry["immutable"]:
+            return _stored_response(url, entry)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if entry:
+            if "etag" in entry["headers"]:
+                headers["If-None-Match"] = entry["headers"]["etag"]
+            if "last-modified" in entry["headers"]:
+                headers["If-Modified-Since"] = entry["headers"]["last-modified"]
+        response = send(method, url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and entry:
+            return _stored_response(url, entry)
+        if response.status_code == 200:
+            self.put(key, response, immutable=immutable)
+        return response
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path=None,
+        ttl=3600,
+        max_size=500 * 2**20,
+        replay=False,
+        per_token=False,
+    ):
+        """A content-addressed, compressed on-disk cache of API responses.
+
+        Responses are keyed by a hash of the request: its method, URL and
+        body (for GraphQL, the query text including any cursor). This covers
+        the GraphQL POSTs of searches as well as REST requests.
+
+        Parameters
+        ----------
+        path : str | Path | None
+          The folder to store responses in. If None, a `responses` folder in
+          `~/.cache/github_activity` is used.
+        ttl : float | None
+          The number of seconds a response is served from the cache. If
+          None, responses never expire.
+        max_size : int
+          The maximum total size of the cache in bytes. The least recently
+          used responses are removed to stay below it.
+        replay : bool
+          If True, responses are only ever served from the cache, whatever
+          their age, and a request that isn't in the cache raises an error
+          rather than touching the network. This needs no token, so that a
+          cache can be replayed on another machine, e.g. in CI.
+        per_token : bool
+          If True, the token of a request is part of its key, so that the
+          responses to one token are never served to another. Use this if
+          the cache is shared by tokens that can see different private
+          repositories.
+        """
+        if path is None:
+            path = DEFAULT_PATH_HTTP_CACHE.joinpath("responses")
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.replay = replay
+        self.per_token = per_token
+        self._size = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(method, url, auth, body=None):
+        key = hashlib.sha256(f"{method} {url} {_auth_fingerprint(auth)}\n".encode())
+        if body is not None:
+            key.update(json.dumps(body, sort_keys=True).encode())
+        return key.hexdigest()
+
+    def _entry_path(self, key):
+        return self.path.joinpath(key[:2], f"{key}.json.gz")
+
+    def get(self, key):
+        """Return the entry stored for `key`, or None if there is none.
+
+        Expired entries are only returned in replay mode.
+        """
+        path = self._entry_path(key)
+        try:
+            with path.open("rb") as f:
+                entry = json.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, ValueError, zlib.error):
+            return None
+        if not self.replay and entry["expires"] and entry["expires"] < time.time():
+            return None
+        # Mark the entry as recently used, for eviction
+        os.utime(path)
+        return entry
+
+    def put(self, key, response, ttl=None):
+        """Store a response for `ttl` seconds (or this cache's default)."""
+        ttl = self.ttl if ttl is None else ttl
+        entry = {
+            "status": response.status_code,
+            "headers": {
+                name: response.headers[name]
+                for name in STORED_HEADERS
+                if name in response.headers
+            },
+            "body": response.text,
+            "elapsed": response.elapsed.total_seconds(),
+            "expires": time.time() + ttl if ttl else None,
+        }
+        self._write(key, entry)
+
+    def pin(self, name, value):
+        """Return the value pinned for `name`, pinning `value` if there is none.
+
+        Values are pinned for as long as responses are cached, e.g. the "now"
+        that ends the window of a search, so that running the same search
+        again makes the same requests and finds them in the cache.
+        """
+        key = hashlib.sha256(f"pin {name}".encode()).hexdigest()
+        entry = self.get(key)
+        if entry is not None:
+            return json.loads(entry["body"])
+        if not self.replay:
+            expires = time.time() + self.ttl if self.ttl else None
+            self._write(key, {"body": json.dumps(value), "expires": expires})
+        return value
+
+    def _write(self, key, entry):
+        data = zlib.compress(json.dumps(entry).encode())
+
+        path = self._entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(data)
+        os.replace(f.name, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(ii.stat().st_size for ii in self._entries())
+            else:
+                self._size += len(data)
+            if self._size > self.max_size:
+                self._evict()
+
+    def _entries(self):
+        return self.path.glob("*/*.json.gz")
+
+    def _evict(self):
+        """Remove the least recently used entries until the cache fits."""
+        entries = []
+        for path in self._entries():
+            stat = path.stat()
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self._size = sum(size for _, size, _ in entries)
+        # Leave some headroom so that we don't evict on every write
+        target = self.max_size * 0.9
+        for _, size, path in entries:
+            if self._size <= target:
+                break
+            path.unlink(missing_ok=True)
+            self._size -= size
+
+    def request(self, send, method, url, immutable=False, **kwargs):
+        """Make a request with `send`, unless its response is in the cache.
+
+        Responses to requests marked `immutable` never expire.
+        """
+        auth = kwargs.get("auth") if self.per_token else None
+        key = self.key(method, url, auth, kwargs.get("json"))
+        entry = self.get(key)
+        if entry is not None:
+            return _stored_response(url, entry)
+        if self.replay:
+            raise ValueError(
+                f"No cached response for {method} {url}, and the cache at "
+                f"{self.path} is replay-only."
+            )
+
+        response = send(method, url, immutable=immutable, **kwargs)
+        # Don't store failures, including GraphQL errors (which have a 200 status)
+        if response.status_code == 200 and b'"errors":' not in response.content:
+            # A TTL of 0 means the response never expires
+            self.put(key, response, ttl=0 if immutable else None)
+        return response
+
+
+class NodeStore:
+    def __init__(self, path=None):
+        """Store the full details of issues/PRs, to re-use while unchanged.
+
+        Items are stored with the fields they were fetched with. A stored copy
+        of an item is only used while its `updatedAt` matches the one that a
+        search returns for it.
+
+        Parameters
+        ----------
+        path : str | Path | None
+          The folder to store items in. If None, a `nodes` folder in
+          `~/.cache/github_activity` is used.
+        """
+        if path is None:
+            path = DEFAULT_PATH_HTTP_CACHE.joinpath("nodes")
+        self.path = Path(path)
+
+    def _path(self, node_id, fields):
+        # Items fetched with other fields are stored separately
+        fields = hashlib.sha256(fields.encode()).hexdigest()[:16]
+        return self.path.joinpath(fields, f"{node_id}.json.gz")
+
+    def get(self, node_id, fields, updated_at):
+        """Return the stored copy of an item, if it was last updated at `updated_at`."""
+        try:
+            with self._path(node_id, fields).open("rb") as f:
+                node = json.loads(zlib.decompress(f.read()))
+        except (FileNotFoundError, ValueError, zlib.error):
+            return None
+        if node.get("updatedAt") != updated_at:
+            return None
+        return node
+
+    def put(self, node, fields):
+        """Store an item fetched with `fields`, replacing any older copy."""
+        path = self._path(node["id"], fields)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile(dir=path.parent, delete=False) as f:
+            f.write(zlib.compress(json.dumps(node).encode()))
+        os.replace(f.name, path)
@@ -0,0 +1,271 @@
+"""Turn the raw issue/PR nodes returned by GraphQL into a DataFrame."""
+
+import math
+import sys
+
+# The connections nested in each item, which become child tables
+CHILD_TABLES = ["comments", "reviews", "commits"]
+# Fields that a query profile may leave out, which are then empty columns
+OPTIONAL_COLUMNS = [
+    "labels",
+    "reactions",
+    "mergedBy",
+    "mergeCommit",
+    "baseRefName",
+    "comments",
+    "reviews",
+    "commits",
+]
+
+
+def _is_bot(user):
+    """Return True if a GraphQL user object represents a bot account."""
+    return bool(user) and user.get("__typename") == "Bot"
+
+
+def _login(user):
+    # The same users turn up again and again, so share one copy of each login
+    return sys.intern(user["login"]) if user else None
+
+
+def _child_row(item, node):
+    """Return a row of a child table, with the author replaced by its login."""
+    row = {"item": item, **node}
+    if "author" in node:
+        row["author"] = _login(node["author"])
+    return row
+
+
+def _edges(connection):
+    if not isinstance(connection, dict):
+        return []
+    return connection.get("edges") or []
+
+
+def normalize_nodes(nodes, retain_raw=True, child_tables=False):
+    """Return a DataFrame of raw issue/PR nodes, in a single pass over them.
+
+    Each field of the nodes becomes a column, and the columns that are
+    derived from them (`org`, `repo`, `kind`, `thumbsup`, `reviewers`,
+    `committers` and `commenters`) are filled in along the way. `author`,
+    `mergedBy` and `labels` are replaced by logins and label names, and
+    `reactions` is dropped. The logins of the bots found anywhere in the
+    nodes are in the `bot_users` attribute of the DataFrame.
+
+    If `child_tables` is True, the comments, reviews and commits of the
+    items are also returned as child tables, with an `item` column holding
+    the position of their item in the DataFrame.
+
+    Parameters
+    ----------
+    nodes : list of dicts
+      The raw nodes.
+    retain_raw : bool
+      Whether to keep the raw `comments`, `reviews` and `commits` of each
+      item as columns of the DataFrame. Without them, the DataFrame holds
+      no references to the raw nodes, which can be freed.
+    child_tables : bool
+      Whether to build the child tables.
+
+    Returns
+    -------
+    data : DataFrame
+    children : dict of DataFrames | None
+      The "comments", "reviews" and "commits" child tables, or None if
+      `child_tables` is False.
+    """
+    import pandas as pd
+
+    columns = {}
+    derived = {
+        name: []
+        for name in [
+            "org",
+            "repo",
+            "kind",
+            "thumbsup",
+            "reviewers",
+            "committers",
+            "commenters",
+        ]
+    }
+    children = {name: [] for name in CHILD_TABLES}
+    bot_users = set()
+
+    for ii, node in enumerate(nodes):
+        for name, value in node.items():
+            if not retain_raw and name in CHILD_TABLES:
+                continue
+            if name not in columns:
+                # Nodes before this one didn't have this field
+                columns[name] = [math.nan] * ii
+            columns[name].append(value)
+        for column in columns.values():
+            if len(column) == ii:
+                column.append(math.nan)
+
+        author = node.get("author")
+        merged_by = node.get("mergedBy")
+        for user in (author, merged_by):
+            if _is_bot(user):
+                bot_users.add(user["login"])
+        if "author" in node:
+            columns["author"][ii] = _login(author)
+        if "mergedBy" in node:
+            columns["mergedBy"][ii] = _login(merged_by)
+
+        labels = node.get("labels")
+        if "labels" in node:
+            columns["labels"][ii] = [edge["node"]["name"] for edge in _edges(labels)]
+
+        url = node["url"].split("/")
+        derived["org"].append(url[3])
+        derived["repo"].append(url[4])
+        derived["kind"].append("issue" if "issues/" in node["url"] else "pr")
+
+        reactions = node.get("reactions")
+        derived["thumbsup"].append(
+            reactions["totalCount"] if isinstance(reactions, dict) else None
+        )
+
+        reviewers = set()
+        for review in _edges(node.get("reviews")):
+            review_author = review["node"].get("author")
+            if _is_bot(review_author):
+                bot_users.add(review_author["login"])
+            if review_author and review_author.get("login"):
+                reviewers.add(_login(review_author))
+            if child_tables:
+                children["reviews"].append(_child_row(ii, review["node"]))
+        derived["reviewers"].append(sorted(reviewers))
+
+        commenters = []
+        for comment in _edges(node.get("comments")):
+            comment_author = comment["node"].get("author")
+            if _is_bot(comment_author):
+                bot_users.add(comment_author["login"])
+            # Deleted users are left out
+            if comment_author:
+                commenters.append(_login(comment_author))
+            if child_tables:
+                children["comments"].append(_child_row(ii, comment["node"]))
+        derived["commenters"].append(commenters)
+
+        committers = []
+        for commit in _edges(node.get("commits")):
+            commit = commit["node"]["commit"]
+            committer = commit.get("committer")
+            if committer and committer.get("user") and _is_bot(committer["user"]):
+                bot_users.add(committer["user"]["login"])
+            commit_authors = []
+            for commit_author in _edges(commit.get("authors")):
+                commit_author = commit_author["node"]
+                if commit_author and commit_author["user"]:
+                    if _is_bot(commit_author["user"]):
+                        bot_users.add(commit_author["user"]["login"])
+                    commit_authors.append(_login(commit_author["user"]))
+                # The committer is credited along with each author
+                if (
+                    committer
+                    and committer["user"]
+                    and committer["user"]["login"] not in commit_authors
+                ):
+                    commit_authors.append(_login(committer["user"]))
+            committers.extend(commit_authors)
+            if child_tables:
+                children["commits"].append(
+                    {
+                        "item": ii,
+                        "committer": _login((committer or {}).get("user")),
+                        "authors": [
+                            _login(commit_author["node"]["user"])
+                            for commit_author in _edges(commit.get("authors"))
+                            if commit_author["node"] and commit_author["node"]["user"]
+                        ],
+                    }
+                )
+        derived["committers"].append(committers)
+
+    for name in OPTIONAL_COLUMNS:
+        if retain_raw or name not in CHILD_TABLES:
+            columns.setdefault(name, [None] * len(nodes))
+    # Items without labels have an empty list of them
+    columns["labels"] = [
+        labels if isinstance(labels, list) else [] for labels in columns["labels"]
+    ]
+    del columns["reactions"]
+    columns.update(derived)
+
+    data = pd.DataFrame(columns)
+    data.attrs["bot_users"] = bot_users
+    if not child_tables:
+        return data, None
+    children = {
+        name: pd.DataFrame(rows, columns=None if rows else ["item"])
+        for name, rows in children.items()
+    }
+    return data, children
+
+
+# The ways `apply_dtype_backend` can store columns, named as in pandas
+DTYPE_BACKENDS = ["numpy_nullable", "pyarrow"]
+# Columns with few distinct values, which are stored as categoricals
+CATEGORICAL_COLUMNS = [
+    "org",
+    "repo",
+    "kind",
+    "state",
+    "authorAssociation",
+    "baseRefName",
+]
+TIMESTAMP_COLUMNS = ["createdAt", "updatedAt", "closedAt"]
+STRING_COLUMNS = ["id", "title", "url", "author", "mergedBy"]
+INTEGER_COLUMNS = ["number", "thumbsup"]
+LIST_COLUMNS = ["labels", "reviewers", "committers", "commenters"]
+
+
+def apply_dtype_backend(data, dtype_backend):
+    """Return `data` with typed columns rather than Python objects.
+
+    Low-cardinality columns become categoricals and timestamps become
+    timezone-aware datetimes. With "numpy_nullable", strings and integers
+    use the nullable pandas dtypes. With "pyarrow", they and the lists of
+    logins and labels are stored in Arrow arrays.
+    """
+    import pandas as pd
+
+    if dtype_backend not in DTYPE_BACKENDS:
+        raise ValueError(
+            f"dtype_backend must be one of {DTYPE_BACKENDS}, got {dtype_backend}"
+        )
+    if dtype_backend == "pyarrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError(
+                "The pyarrow dtype backend needs pyarrow, which you can install "
+                "with `pip install github-activity[arrow]`."
+            ) from None
+        string = pd.ArrowDtype(pa.string())
+        integer = pd.ArrowDtype(pa.int64())
+        string_list = pd.ArrowDtype(pa.list_(pa.string()))
+    else:
+        string = pd.StringDtype()
+        integer = pd.Int64Dtype()
+        string_list = None
+
+    dtypes = {}
+    for name in data.columns:
+        if name in CATEGORICAL_COLUMNS:
+            dtypes[name] = "category"
+        elif name in STRING_COLUMNS:
+            dtypes[name] = string
+        elif name in INTEGER_COLUMNS:
+            dtypes[name] = integer
+        elif name in LIST_COLUMNS and string_list is not None:
+            dtypes[name] = string_list
+    data = data.astype(dtypes)
+    for name in TIMESTAMP_COLUMNS:
+        if name in data:
+            data[name] = pd.to_datetime(data[name], utc=True)
+    return data
@@ -0,0 +1,167 @@
+"""Pace requests to stay within GitHub's rate limits, and wait them out."""
+
+import datetime
+import math
+import sys
+import threading
+import time
+
+# Seconds to wait after a secondary rate limit if GitHub doesn't say how long
+SECONDARY_RATE_LIMIT_WAIT = 60
+MAX_BACKOFF = 15 * 60
+# Once less than this fraction of a budget is left, spread the rest of it
+# evenly over the time until it resets
+PACING_THRESHOLD = 0.1
+
+
+class RateLimitScheduler:
+    def __init__(self, max_retries=5):
+        """Track the rate limit budgets seen in responses from GitHub.
+
+        Budgets are tracked separately for each token and each API resource
+        (e.g. "graphql" and "core" for REST). Before each request,
+        `wait` sleeps if the budget is nearly used up. After a request was
+        rate limited, `retry_delay` says how long to wait before retrying.
+
+        Parameters
+        ----------
+        max_retries : int
+          The number of times a rate-limited request is retried before the
+          response is returned to the caller as-is.
+        """
+        self.max_retries = max_retries
+        self._budgets = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(auth, resource):
+        return (getattr(auth, "token", None), resource)
+
+    def wait(self, key):
+        """Sleep until a request may be made with the budget of `key`."""
+        with self._lock:
+            budget = self._budgets.get(key)
+            if not budget or budget.get("remaining") is None:
+                return
+            remaining = budget["remaining"]
+            limit = budget.get("limit")
+            cost = budget.get("cost", 1)
+            time_to_reset = budget.get("reset", 0) - time.time()
+
+        if time_to_reset <= 0:
+            return
+        if remaining < cost:
+            _sleep(time_to_reset + 1, "GitHub API rate limit used up")
+        elif limit and remaining < limit * PACING_THRESHOLD:
+            # Spread what is left of the budget until it resets
+            time.sleep(time_to_reset * cost / remaining)
+
+    def headroom(self, key):
+        """Return how much of the budget of `key` can be used right now.
+
+        A budget that is unknown or has reset is unlimited. A budget that is
+        used up is negative, and the more so the later it resets.
+        """
+        with self._lock:
+            budget = self._budgets.get(key)
+            if not budget or budget.get("remaining") is None:
+                return math.inf
+            if budget.get("reset", 0) <= time.time():
+                return math.inf
+            if budget["remaining"] < budget.get("cost", 1):
+                return -budget["reset"]
+            return budget["remaining"]
+
+    def update(self, key, remaining=None, limit=None, reset=None, cost=None):
+        """Record the latest known state of a rate limit budget."""
+        with self._lock:
+            budget = self._budgets.setdefault(key, {})
+            for name, value in [
+                ("remaining", remaining),
+                ("limit", limit),
+                ("reset", reset),
+                ("cost", cost),
+            ]:
+                if value is not None:
+                    budget[name] = value
+
+    def update_from_response(self, key, response):
+        """Record the budget reported in the `x-ratelimit-*` headers."""
+        headers = response.headers
+        if "x-ratelimit-remaining" not in headers:
+            return
+        self.update(
+            key,
+            remaining=int(headers["x-ratelimit-remaining"]),
+            limit=int(headers.get("x-ratelimit-limit", 0)) or None,
+            reset=int(headers.get("x-ratelimit-reset", 0)) or None,
+        )
+
+    def update_from_graphql(self, key, rate_limit):
+        """Record the budget reported by a GraphQL `rateLimit` object."""
+        if not rate_limit:
+            return
+        reset = datetime.datetime.fromisoformat(
+            rate_limit["resetAt"].replace("Z", "+00:00")
+        )
+        self.update(
+            key,
+            remaining=rate_limit["remaining"],
+            reset=reset.timestamp(),
+            cost=rate_limit["cost"],
+        )
+
+    def retry_delay(self, key, response, attempt):
+        """Return how many seconds to wait before retrying a request.
+
+        Returns None if the response was not rate limited, or if the request
+        has already been retried `max_retries` times.
+        """
+        if attempt >= self.max_retries or not _is_rate_limited(response):
+            return None
+
+        # GitHub tells us how long to wait for most secondary rate limits
+        retry_after = response.headers.get("retry-after")
+        if retry_after is not None:
+            return int(retry_after)
+
+        # The primary rate limit was used up, so wait until it resets
+        with self._lock:
+            budget = self._budgets.get(key, {})
+        if budget.get("remaining") == 0 and budget.get("reset"):
+            return max(budget["reset"] - time.time(), 0) + 1
+
+        # Otherwise back off exponentially
+        return min(SECONDARY_RATE_LIMIT_WAIT * 2**attempt, MAX_BACKOFF)
+
+
+def _is_rate_limited(response):
+    """Return True if a response shows that a request was rate limited."""
+    if response.status_code == 429:
+        return True
+    if response.status_code == 403:
+        if response.headers.get("x-ratelimit-remaining") == "0":
+            return True
+        return b"rate limit" in response.content.lower()
+    # GraphQL reports rate limits as errors with a 200 status. Most responses
+    # are large pages of results, so only those that mention it are parsed.
+    if response.status_code != 200 or b'"RATE_LIMITED"' not in response.content:
+        return False
+    try:
+        body = response.json()
+    except ValueError:
+        return False
+    errors = body.get("errors") if isinstance(body, dict) else None
+    return any(
+        isinstance(error, dict) and error.get("type") == "RATE_LIMITED"
+        for error in errors or []
+    )
+
+
+def _sleep(seconds, reason):
+    until = datetime.datetime.now() + datetime.timedelta(seconds=seconds)
+    print(
+        f"{reason}, waiting until {until:%H:%M:%S} before continuing...",
+        file=sys.stderr,
+    )
+    time.sleep(seconds)
@@ -0,0 +1,103 @@
+"""List the repositories of an organization, to fetch their activity one by one."""
+
+import dataclasses
+import fnmatch
+import json
+
+import dateutil.parser
+
+from .auth import as_auth
+from .client import get_default_client
+
+repositories_query = """\
+query {{
+  repositoryOwner(login: {login}) {{
+    repositories(first: 100, ownerAffiliations: OWNER{after}) {{
+      nodes {{
+        name
+        isArchived
+        pushedAt
+      }}
+      pageInfo {{
+        endCursor
+        hasNextPage
+      }}
+    }}
+  }}
+}}
+"""
+
+
+@dataclasses.dataclass(frozen=True)
+class RepositoryFilter:
+    """The repositories of an organization to fetch activity for.
+
+    By default, every repository that isn't archived is included.
+    """
+
+    # A glob pattern that repository names must match, e.g. "jupyter*"
+    pattern: str = None
+    include_archived: bool = False
+    # Only include repositories pushed to since this date
+    pushed_since: str = None
+
+    def matches(self, repository):
+        """Return True if a repository from `list_repositories` passes the filter."""
+        if self.pattern and not fnmatch.fnmatch(repository["name"], self.pattern):
+            return False
+        if repository["isArchived"] and not self.include_archived:
+            return False
+        if self.pushed_since:
+            if not repository["pushedAt"]:
+                return False
+            pushed_at = dateutil.parser.parse(repository["pushedAt"])
+            pushed_since = dateutil.parser.parse(self.pushed_since)
+            if pushed_since.tzinfo is None:
+                pushed_at = pushed_at.replace(tzinfo=None)
+            if pushed_at < pushed_since:
+                return False
+        return True
+
+
+async def list_repositories(owner, auth, client=None, repository_filter=None):
+    """Return the names of the repositories of a user or organization.
+
+    Parameters
+    ----------
+    owner : string
+        The GitHub user or organization.
+    auth : string
+        An authentication token for GitHub.
+    client : GitHubClient | None
+        The HTTP client to make requests with. If None, a process-wide client
+        is used.
+    repository_filter : RepositoryFilter | None
+        Which repositories to return. If None, every repository that isn't
+        archived is returned.
+    """
+    client = client or get_default_client()
+    repository_filter = repository_filter or RepositoryFilter()
+    names = []
+    cursor = None
+    while True:
+        after = f", after: {json.dumps(cursor)}" if cursor else ""
+        query = repositories_query.format(login=json.dumps(owner), after=after)
+        response = await client.agraphql(query, auth=as_auth(auth))
+        response.raise_for_status()
+        result = response.json()
+        owner_data = (result.get("data") or {}).get("repositoryOwner")
+        if owner_data is None:
+            errors = result.get("errors")
+            if errors:
+                raise Exception(f"Query failed to run with error {errors}")
+            raise ValueError(f"No GitHub user or organization named '{owner}'.")
+
+        repositories = owner_data["repositories"]
+        names.extend(
+            repository["name"]
+            for repository in repositories["nodes"]
+            if repository_filter.matches(repository)
+        )
+        if not repositories["pageInfo"]["hasNextPage"]:
+            return names
+        cursor = repositories["pageInfo"]["endCursor"]
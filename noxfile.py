@@ -41,3 +41,10 @@ def test(session):
     # Run github activity and re-use the posargs
     cmd = ["pytest"] + session.posargs
     session.run(*cmd)
+
+
+@nox.session
+def benchmark(session):
+    """Measure how long the CLI takes to make its first request."""
+    session.install("-e", ".")
+    session.run("python", "benchmarks/startup.py", *session.posargs)
@@ -1,9 +1,14 @@
 import shutil
+import subprocess
+import sys
 from pathlib import Path
 from subprocess import run
 
 from pytest import mark
 
+from github_activity.git import _git_remotes
+from github_activity.git import _git_toplevel_path
+
 
 @mark.parametrize(
     "cmd,basename",
@@ -155,3 +160,82 @@ def test_invalid_repository_error():
     assert "invalid-org/nonexistent-repo-12345" in error_message, (
         f"Error should include the repo name, got: {error_message}"
     )
+
+
+@mark.parametrize(
+    "flag", ["--per-repo", "--repo-pattern=jupyter*", "--include-archived"]
+)
+def test_all_rejects_per_repo_flags(flag):
+    """Options that --all can't honour are rejected rather than ignored."""
+    cmd = [sys.executable, "-m", "github_activity.cli", "org/repo", "--all", flag]
+    out = run(cmd, capture_output=True, text=True)
+    assert out.returncode == 2
+    assert f"{flag.split('=')[0]} can't be combined with --all" in out.stderr
+
+
+def test_git_remotes_are_read_from_config(tmp_path, monkeypatch):
+    """The remotes and top-level of a repository are found without running git."""
+    git_dir = tmp_path.joinpath("repo", ".git")
+    git_dir.joinpath("worktrees", "wt").mkdir(parents=True)
+    git_dir.joinpath("config").write_text(
+        "[core]\n"
+        "\tbare = false\n"
+        '[remote "origin"]\n'
+        "\turl = git@github.com:someone/github-activity.git\n"
+        "\tfetch = +refs/heads/*:refs/remotes/origin/*\n"
+        '[remote "upstream"]\n'
+        "\turl = https://github.com/executablebooks/github-activity\n"
+    )
+    # A worktree shares the configuration of its repository
+    git_dir.joinpath("worktrees", "wt", "commondir").write_text("../..\n")
+    tmp_path.joinpath("wt", "docs").mkdir(parents=True)
+    tmp_path.joinpath("wt", ".git").write_text(f"gitdir: {git_dir}/worktrees/wt\n")
+
+    def no_git(*args, **kwargs):
+        raise AssertionError(f"git was run: {args}")
+
+    monkeypatch.setattr(subprocess, "run", no_git)
+    monkeypatch.setattr(subprocess, "check_output", no_git)
+    for name in [
+        "GIT_DIR",
+        "GIT_WORK_TREE",
+        "GIT_CONFIG_PARAMETERS",
+        "GIT_CONFIG_COUNT",
+    ]:
+        monkeypatch.delenv(name, raising=False)
+    # Leave out the configuration of this machine
+    global_config = tmp_path.joinpath("gitconfig")
+    monkeypatch.setenv("GIT_CONFIG_GLOBAL", str(global_config))
+    monkeypatch.setenv("GIT_CONFIG_NOSYSTEM", "1")
+    for folder in ["repo", "wt/docs"]:
+        monkeypatch.chdir(tmp_path.joinpath(folder))
+        assert _git_remotes() == {
+            "origin": "git@github.com:someone/github-activity.git",
+            "upstream": "https://github.com/executablebooks/github-activity",
+        }
+    assert _git_toplevel_path() == str(tmp_path.joinpath("wt"))
+
+    # Global rules that rewrite URLs are left to git
+    global_config.write_text(
+        '[url "https://github.com/executablebooks/"]\n\tinsteadOf = eb:\n'
+    )
+    git_dir.joinpath("config").write_text(
+        '[remote "upstream"]\n\turl = eb:github-activity\n'
+    )
+
+    def git_remote(*args, **kwargs):
+        assert args[0] == ["git", "remote", "-v"]
+        out = b"upstream\thttps://github.com/executablebooks/github-activity (fetch)\n"
+        return subprocess.CompletedProcess(args[0], 0, stdout=out)
+
+    monkeypatch.setattr(subprocess, "run", git_remote)
+    assert _git_remotes() == {
+        "upstream": "https://github.com/executablebooks/github-activity"
+    }
+
+
+def test_cli_imports_are_deferred():
+    """Importing the CLI doesn't import the libraries used to process results."""
+    code = "import sys, github_activity.cli; print(sorted({'numpy', 'pandas', 'tqdm'} & set(sys.modules)))"
+    out = run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "[]"
@@ -0,0 +1,1067 @@
+"""Offline tests of fetching activity from GitHub, using canned API responses."""
+
+import asyncio
+import datetime
+import json
+import os
+import re
+import time
+
+import pandas as pd
+import pytest
+import requests
+
+from github_activity.auth import TokenAuth
+from github_activity.auth import as_auth
+from github_activity.cache import _load_watermark
+from github_activity.cache import load_from_cache
+from github_activity.checkpoint import CrawlJournal
+from github_activity.client import GitHubClient
+from github_activity.client import run_sync
+from github_activity.github_activity import _get_datetime_and_type
+from github_activity.github_activity import _get_repository_prelude
+from github_activity.github_activity import RepositoryNotFoundError
+from github_activity.github_activity import _SortedTimestamps
+from github_activity.github_activity import estimate_activity
+from github_activity.github_activity import get_activity
+from github_activity.github_activity import sync_activity
+from github_activity.graphql import GitHubGraphQlQuery
+from github_activity.graphql import GitHubRepositoryQuery
+from github_activity.graphql import MAX_PAGE_RETRIES
+from github_activity.graphql import QueryProfile
+from github_activity.graphql import SEARCH_RESULT_CAP
+from github_activity.graphql import split_search_window
+from github_activity.httpcache import NodeStore
+from github_activity.httpcache import ResponseCache
+from github_activity.httpcache import ValidatorStore
+from github_activity.normalize import apply_dtype_backend
+from github_activity.normalize import normalize_nodes
+from github_activity.ratelimit import RateLimitScheduler
+from github_activity.repositories import RepositoryFilter
+
+
+def make_node(number, kind="pr", author="someone"):
+    """Return a minimal raw search node, as returned by the GraphQL API."""
+    path = "pull" if kind == "pr" else "issues"
+    node = {
+        "state": "MERGED" if kind == "pr" else "CLOSED",
+        "id": f"ID_{number}",
+        "title": f"Item {number}",
+        "url": f"https://github.com/org/repo/{path}/{number}",
+        "createdAt": "2021-01-02T00:00:00Z",
+        "updatedAt": "2021-01-03T00:00:00Z",
+        "closedAt": "2021-01-03T00:00:00Z",
+        "labels": {"edges": []},
+        "number": number,
+        "authorAssociation": "MEMBER",
+        "author": {"login": author, "__typename": "User"},
+        "reactions": {"totalCount": 0},
+        "comments": {"edges": []},
+    }
+    if kind == "pr":
+        node.update(
+            {
+                "mergedBy": {"login": author, "__typename": "User"},
+                "mergeCommit": {"oid": f"sha{number}"},
+                "baseRefName": "main",
+                "commits": {"edges": []},
+                "reviews": {"edges": []},
+            }
+        )
+    else:
+        node["mergedBy"] = None
+    return node
+
+
+class FakeResponse:
+    def __init__(self, data, status_code=200, headers=None, seconds=1):
+        self._data = data
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.elapsed = datetime.timedelta(seconds=seconds)
+        self.content = json.dumps(data).encode()
+        self.text = self.content.decode()
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(self.status_code)
+
+
+class FakeSession:
+    """Stand in for `requests.Session`, answering each request with `handler`."""
+
+    def __init__(self, handler):
+        self.handler = handler
+
+    def request(self, method, url, **kwargs):
+        return self.handler(method, url, **kwargs)
+
+    def close(self):
+        pass
+
+
+class FakeSearchClient(GitHubClient):
+    """A client that serves paginated search results.
+
+    `results` maps the search query string to the list of nodes it matches,
+    or is a function of the search query string that returns them. `pages`
+    maps (node id, connection name, cursor) to a page of a nested connection.
+    The REST API reports that the repository exists, and that the dates
+    aren't git references.
+    """
+
+    def __init__(self, results, pages=None, **kwargs):
+        super().__init__(**kwargs)
+        self.results = results
+        self.pages = pages or {}
+        self.queries = []
+        self.nodes_by_id = {}
+        self.session = FakeSession(self.serve)
+
+    def serve(self, method, url, **kwargs):
+        if method != "POST":
+            return FakeResponse({}, status_code=200 if method == "HEAD" else 404)
+        query = kwargs["json"]["query"]
+        self.queries.append(query)
+        data = {}
+        pattern = r'(\w+): search\(first: (\d+), query: "([^"]*)", type: ISSUE(?:, after: "(\d+)")?\)'
+        for alias, first, search, after in re.findall(pattern, query):
+            if callable(self.results):
+                nodes = self.results(search)
+            else:
+                nodes = self.results[search]
+            # Like GitHub, report every match but only return the first ones
+            count = len(nodes)
+            nodes = nodes[:SEARCH_RESULT_CAP]
+            self.nodes_by_id.update((node["id"], node) for node in nodes)
+            start = int(after) if after else 0
+            end = start + int(first)
+            data[alias] = {
+                "issueCount": count,
+                "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(nodes)},
+                "nodes": nodes[start:end],
+            }
+        pattern = r'(\w+): node\(id: "([^"]+)"\) \{\s*\.\.\. on \w+ \{\s*(\w+)\(\w+: \d+, \w+: "([^"]+)"\)'
+        errors = []
+        for alias, node_id, name, cursor in re.findall(pattern, query):
+            page = self.pages[node_id, name, cursor]
+            if page is None:
+                # Like GitHub, deleted items are null and reported as not found
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias]})
+            else:
+                data[alias] = {name: page}
+        for ids in re.findall(r"nodes\(ids: \[([^\]]*)\]\)", query):
+            data["nodes"] = [
+                self.nodes_by_id.get(ii) for ii in re.findall(r'"(\w+)"', ids)
+            ]
+        pattern = r'(\w+): search\(query: "([^"]*)", type: ISSUE, first: 1\)'
+        for alias, search in re.findall(pattern, query):
+            if callable(self.results):
+                data[alias] = {"issueCount": len(self.results(search))}
+            else:
+                data[alias] = {"issueCount": len(self.results[search])}
+        if "rateLimit(dryRun: true)" in query:
+            data["rateLimit"] = {
+                "cost": 3 if "nodes(ids:" in query else 2,
+                "limit": 5000,
+                "remaining": 4000,
+                "resetAt": "2020-01-01T01:00:00Z",
+            }
+        if errors:
+            return FakeResponse({"data": data, "errors": errors})
+        return FakeResponse({"data": data})
+
+
+@pytest.fixture
+def checkpoint_dir(tmp_path, monkeypatch):
+    """Keep the journals of crawls that use the default folder out of ~/.cache."""
+    path = tmp_path.joinpath("checkpoints")
+    monkeypatch.setattr("github_activity.checkpoint.DEFAULT_PATH_HTTP_CACHE", path)
+    return path
+
+
+def test_combined_searches_share_requests():
+    created = [make_node(ii) for ii in range(5)]
+    closed = [make_node(ii) for ii in range(3, 12)]
+    client = FakeSearchClient({"created": created, "closed": closed})
+
+    qu = GitHubGraphQlQuery(
+        ["created", "closed"], auth="token", client=client, display_progress=False
+    )
+    qu.request(n_per_page=3, adaptive=False)
+
+    # The larger search sets the number of round trips
+    assert len(client.queries) == 3
+    # The smaller search drops out of the request once it is exhausted
+    assert "search0" not in client.queries[-1]
+    # Items returned by both searches are kept once, in search order
+    assert qu.data["number"].tolist() == list(range(12))
+
+
+def test_estimates_use_counts_and_dry_runs():
+    created = [make_node(ii) for ii in range(5)]
+    closed = [make_node(ii) for ii in range(3, 1503)]
+    client = FakeSearchClient({"created": created, "closed": closed})
+    qu = GitHubGraphQlQuery(
+        ["created", "closed"], auth="token", client=client, two_phase=True
+    )
+
+    page_costs = {}
+    estimate = run_sync(qu.aestimate(page_costs=page_costs))
+    assert estimate.results == 1505
+    # One page of the small search, and the large one is split into windows
+    assert estimate.search_pages == 1 + 15 + 2 * 2
+    assert estimate.detail_pages == 31
+    assert estimate.points == (
+        1
+        + estimate.search_pages * 2
+        + estimate.detail_pages * 3
+        + estimate.nested_pages
+    )
+    assert estimate.rate_limit["remaining"] == 4000
+    assert "Remaining GraphQL points: 4000 of 5000" in str(estimate)
+    # Nothing but the counts and the dry runs was requested
+    assert len(client.queries) == 3
+
+    # Queries of the same shape re-use the dry runs
+    client.queries.clear()
+    total = estimate + run_sync(qu.aestimate(page_costs=page_costs))
+    assert len(client.queries) == 1
+    assert total.results == 2 * estimate.results
+
+
+def test_estimates_use_the_backend():
+    prs = [make_node(ii) for ii in range(120)]
+    issues = [make_node(ii, kind="issue") for ii in range(120, 150)]
+    client = FakeSearchClient(lambda search: prs if "is:pr" in search else issues)
+    estimate = estimate_activity(
+        "org/repo",
+        "2021-01-01",
+        "2021-02-01",
+        auth="token",
+        client=client,
+        backend="repository",
+    )
+    # Every item updated since the start of the window is listed, and both
+    # connections are paged through together
+    assert estimate.results == 150
+    assert estimate.search_pages == 3
+    assert estimate.points == 1 + 3 * 2 + estimate.nested_pages
+    dry_runs = [query for query in client.queries if "dryRun" in query]
+    assert len(dry_runs) == 1
+    assert "pullRequests: pullRequests(" in dry_runs[0]
+    assert not any("search(first:" in query for query in client.queries)
+
+
+def test_nodes_are_normalized_in_one_pass():
+    pr = make_node(1)
+    pr["labels"] = {"edges": [{"node": {"name": "bug"}}]}
+    pr["reviews"] = {
+        "edges": [
+            {"node": {"author": {"login": "bob", "__typename": "User"}}},
+            {"node": {"author": {"login": "ci", "__typename": "Bot"}}},
+            {"node": {"author": None}},
+        ]
+    }
+    pr["commits"] = {
+        "edges": [
+            {
+                "node": {
+                    "commit": {
+                        "committer": {
+                            "user": {"login": "web-flow", "__typename": "Bot"}
+                        },
+                        "authors": {"edges": [{"node": {"user": {"login": "ann"}}}]},
+                    }
+                }
+            }
+        ]
+    }
+    issue = make_node(2, kind="issue")
+    del issue["reactions"]
+
+    data, children = normalize_nodes([pr, issue], child_tables=True)
+    assert data["author"].tolist() == ["someone", "someone"]
+    assert data["labels"].tolist() == [["bug"], []]
+    assert data["kind"].tolist() == ["pr", "issue"]
+    assert data["reviewers"].tolist() == [["bob", "ci"], []]
+    assert data["committers"].tolist() == [["ann", "web-flow"], []]
+    assert data["thumbsup"].isna().tolist() == [False, True]
+    assert "reactions" not in data
+    assert data.attrs["bot_users"] == {"ci", "web-flow"}
+    assert children["reviews"]["item"].tolist() == [0, 0, 0]
+    assert children["commits"].to_dict("records") == [
+        {"item": 0, "committer": "web-flow", "authors": ["ann"]}
+    ]
+
+    # Without the raw connections, only what was derived from them is kept
+    compact, _ = normalize_nodes([pr, issue], retain_raw=False)
+    assert not {"comments", "reviews", "commits"} & set(compact.columns)
+    assert compact["committers"].equals(data["committers"])
+    # The child tables are only built if they are asked for
+    assert normalize_nodes([pr, issue])[1] is None
+
+
+@pytest.mark.parametrize("dtype_backend", ["numpy_nullable", "pyarrow"])
+def test_dtype_backends(dtype_backend):
+    if dtype_backend == "pyarrow":
+        pytest.importorskip("pyarrow")
+    nodes = [make_node(1), make_node(2, kind="issue")]
+    nodes[1]["author"] = None
+    data, _ = normalize_nodes(nodes, retain_raw=False)
+
+    typed = apply_dtype_backend(data, dtype_backend)
+    assert typed["kind"].dtype == "category"
+    assert str(typed["closedAt"].dtype) == "datetime64[us, UTC]"
+    assert typed["author"].isna().tolist() == [False, True]
+    # Queries on the typed columns select the same rows
+    since = "2021-01-02T12:00:00Z"  # noqa: F841
+    query = "kind == 'pr' and closedAt >= @since"
+    assert typed.query(query)["number"].tolist() == [1]
+    assert data.query(query)["number"].tolist() == [1]
+
+
+def test_sorted_timestamps():
+    column = pd.Series(
+        [
+            "2021-01-05T00:00:00Z",
+            None,
+            "2021-01-01T00:00:00Z",
+            "2021-01-03T00:00:00Z",
+            "2021-01-01T00:00:00Z",
+        ],
+        index=[10, 11, 12, 13, 14],
+    )
+    timestamps = _SortedTimestamps.parse(column)
+    # Positions in the window come back in the order of the column
+    since, until = pd.Timestamp("2021-01-01T00:00Z"), pd.Timestamp("2021-01-03T00:00Z")
+    assert timestamps.between(since, until).tolist() == [2, 3, 4]
+    # Equally close timestamps go to the first of them in the column
+    assert timestamps.nearest(pd.Timestamp("2021-01-02T00:00Z")) == 2
+    assert timestamps.nearest(pd.Timestamp("2021-01-04T01:00Z")) == 0
+    assert timestamps.subset([3, 4]).nearest(pd.Timestamp("2020-12-01T00:00Z")) == 4
+
+
+def test_interrupted_crawls_resume(tmp_path, monkeypatch):
+    monkeypatch.setattr("github_activity.graphql.PAGE_RETRY_WAIT", 0)
+    nodes = [make_node(ii) for ii in range(10)]
+    client = FakeSearchClient({"query": nodes})
+    serve = client.serve
+    failures = []
+
+    def flaky(method, url, **kwargs):
+        # Every request after the second fails
+        if len(client.queries) >= 2:
+            failures.append(kwargs)
+            raise requests.exceptions.ConnectionError("Connection reset")
+        return serve(method, url, **kwargs)
+
+    client.session = FakeSession(flaky)
+    journal = CrawlJournal(tmp_path)
+    qu = GitHubGraphQlQuery(
+        "query", auth="token", client=client, display_progress=False, journal=journal
+    )
+    with pytest.raises(Exception, match="Connection reset"):
+        qu.request(n_per_page=3, adaptive=False)
+    # The page was retried from the same cursor before giving up
+    assert len(failures) == MAX_PAGE_RETRIES + 1
+
+    # Running the query again only fetches the pages that are missing
+    client = FakeSearchClient({"query": nodes})
+    qu = GitHubGraphQlQuery(
+        "query", auth="token", client=client, display_progress=False, journal=journal
+    )
+    qu.request(n_per_page=3, adaptive=False)
+    assert len(client.queries) == 2
+    assert 'after: "6"' in client.queries[0]
+    assert qu.data["number"].tolist() == list(range(10))
+    # Complete crawls leave nothing to resume
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_runs_until_now_resume(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr("github_activity.graphql.PAGE_RETRY_WAIT", 0)
+    nodes = [make_node(ii) for ii in range(250)]
+    client = FakeSearchClient(lambda search: nodes)
+    serve = client.serve
+
+    def flaky(method, url, **kwargs):
+        if len(client.queries) >= 1:
+            raise requests.exceptions.ConnectionError("Connection reset")
+        return serve(method, url, **kwargs)
+
+    # A journal of a crawl that was never resumed
+    stale = tmp_path.joinpath("stale.jsonl")
+    stale.write_text("{}\n")
+    os.utime(stale, (0, 0))
+
+    client.session = FakeSession(flaky)
+    kwargs = dict(since="2021-01-01", auth="token", checkpoints=str(tmp_path))
+    with pytest.raises(Exception, match="Connection reset"):
+        get_activity("org", client=client, **kwargs)
+    assert not stale.exists()
+    first_query = client.queries[0]
+    until = re.search(r"\.\.(\S+Z)", first_query).group(1)
+
+    # A run with other options doesn't pick up the window of the failed one
+    time.sleep(1)
+    capsys.readouterr()
+    client = FakeSearchClient(lambda search: nodes)
+    get_activity("org", client=client, kind="issue", **kwargs)
+    assert until not in client.queries[0]
+    assert "Resuming" not in capsys.readouterr().err
+
+    # The run is resumed with the window it started with, although "now" moved on
+    client = FakeSearchClient(lambda search: nodes)
+    data = get_activity("org", client=client, **kwargs)
+    assert len(data) == len(nodes)
+    assert 'after: "50"' in client.queries[0]
+    assert client.queries[0].count(until) == first_query.count(until)
+    assert "Resuming an interrupted run of org" in capsys.readouterr().err
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_single_page_of_activity_takes_one_request(tmp_path):
+    client = FakeSearchClient(lambda search: [make_node(1), make_node(2)])
+    data = get_activity(
+        "org", since="2021-01-01", until="2021-02-01", auth="token", client=client
+    )
+    assert data["number"].tolist() == [1, 2]
+    assert len(client.queries) == 1
+
+    # With a node store, the details are fetched in a second phase to re-use them
+    client = FakeSearchClient(
+        lambda search: [make_node(1), make_node(2)],
+        node_store=NodeStore(tmp_path),
+    )
+    get_activity(
+        "org", since="2021-01-01", until="2021-02-01", auth="token", client=client
+    )
+    assert len(client.queries) == 2
+    assert "nodes(ids:" in client.queries[1]
+
+
+def test_two_phase_fetch(tmp_path):
+    created = [make_node(ii) for ii in range(5)]
+    closed = [make_node(ii) for ii in range(3, 8)]
+    client = FakeSearchClient(
+        {"created": created, "closed": closed}, node_store=NodeStore(tmp_path)
+    )
+
+    def hydrated_ids():
+        ids = []
+        for query in client.queries:
+            for batch in re.findall(r"nodes\(ids: \[([^\]]*)\]\)", query):
+                ids.extend(re.findall(r'"(\w+)"', batch))
+        return ids
+
+    qu = GitHubGraphQlQuery(
+        ["created", "closed"],
+        auth="token",
+        client=client,
+        display_progress=False,
+        two_phase=True,
+    )
+    qu.request()
+    # Items returned by both searches are only fetched once
+    assert sorted(hydrated_ids()) == [f"ID_{ii}" for ii in range(8)]
+    assert qu.data["number"].tolist() == list(range(8))
+
+    # Only the items that were updated since are fetched again
+    created[0] = dict(created[0], updatedAt="2021-02-01T00:00:00Z")
+    client.queries.clear()
+    qu.request()
+    assert hydrated_ids() == ["ID_0"]
+    assert qu.data["number"].tolist() == list(range(8))
+
+
+def test_split_search_window():
+    query = "repo:org/repo created:2021-01-01T00:00:00Z..2021-01-01T00:00:10Z"
+    assert split_search_window(query) == [
+        "repo:org/repo created:2021-01-01T00:00:00Z..2021-01-01T00:00:05Z",
+        "repo:org/repo created:2021-01-01T00:00:06Z..2021-01-01T00:00:10Z",
+    ]
+    # Windows of a single second, or without a range, can't be split
+    assert (
+        split_search_window(
+            "repo:org/repo created:2021-01-01T00:00:00Z..2021-01-01T00:00:01Z"
+        )
+        is None
+    )
+    assert split_search_window("repo:org/repo") is None
+
+
+def test_large_searches_are_sharded():
+    start = datetime.datetime(2021, 1, 1)
+    nodes = []
+    for ii in range(2 * SEARCH_RESULT_CAP + 500):
+        node = make_node(ii)
+        node["createdAt"] = (
+            f"{start + datetime.timedelta(minutes=ii):%Y-%m-%dT%H:%M:%SZ}"
+        )
+        nodes.append(node)
+
+    def search(query):
+        """Return the nodes created in the window of the query, capped like GitHub."""
+        window = re.search(r"created:(\S+)\.\.(\S+)", query).groups()
+        return [node for node in nodes if window[0] <= node["createdAt"] <= window[1]]
+
+    client = FakeSearchClient(search)
+    query = "repo:org/repo created:2021-01-01T00:00:00Z..2021-01-31T00:00:00Z"
+    qu = GitHubGraphQlQuery(query, auth="token", client=client, display_progress=False)
+    qu.request(n_per_page=100)
+
+    # Every item is fetched exactly once, even though no search returned them all
+    assert sorted(qu.data["number"]) == list(range(len(nodes)))
+
+
+def test_rate_limited_requests_are_retried():
+    responses = [
+        FakeResponse(
+            {"message": "You have exceeded a secondary rate limit."},
+            status_code=403,
+            headers={"retry-after": "0"},
+        ),
+        FakeResponse({"errors": [{"type": "RATE_LIMITED"}]}),
+        FakeResponse({"data": {}}),
+    ]
+    client = GitHubClient(rate_limit=RateLimitScheduler(max_retries=2))
+    client.rate_limit.update(("token", "graphql"), remaining=0, reset=time.time())
+    client.session = FakeSession(lambda method, url, **kwargs: responses.pop(0))
+
+    response = client.graphql("{}", auth=TokenAuth("token"))
+    assert response.json() == {"data": {}}
+    assert not responses
+
+    # Results that merely mention rate limits aren't rate limited
+    issue = make_node(1)
+    issue["labels"] = {"edges": [{"node": {"name": "RATE_LIMITED"}}]}
+    sent = []
+
+    def serve(method, url, **kwargs):
+        sent.append(url)
+        return FakeResponse({"data": {"node": issue}})
+
+    client.session = FakeSession(serve)
+    response = client.graphql("{}", auth=TokenAuth("token"))
+    assert response.json() == {"data": {"node": issue}}
+    assert len(sent) == 1
+
+
+def test_identical_requests_in_flight_are_coalesced():
+    calls = []
+
+    def handler(method, url, **kwargs):
+        calls.append(kwargs["json"]["query"])
+        # Stay in flight long enough for the other requests to arrive
+        time.sleep(0.2)
+        return FakeResponse({"data": {"query": kwargs["json"]["query"]}})
+
+    client = GitHubClient()
+    client.session = FakeSession(handler)
+
+    async def fetch():
+        return await asyncio.gather(
+            client.agraphql("q1", auth=TokenAuth("token")),
+            client.agraphql("q1", auth=TokenAuth("token")),
+            client.agraphql("q2", auth=TokenAuth("token")),
+        )
+
+    first, second, other = run_sync(fetch())
+    assert sorted(calls) == ["q1", "q2"]
+    assert first is second
+    assert other.json() == {"data": {"query": "q2"}}
+    # Once the request is complete, the next identical one is made again
+    client.graphql("q1", auth=TokenAuth("token"))
+    assert calls.count("q1") == 2
+
+
+def test_token_pool_skips_exhausted_tokens():
+    used = []
+
+    def handler(method, url, **kwargs):
+        token = kwargs["auth"].token
+        used.append(token)
+        if token == "b" and used.count("b") == 2:
+            # A secondary rate limit for an hour
+            return FakeResponse(
+                {"message": "You have exceeded a secondary rate limit."},
+                status_code=403,
+                headers={"retry-after": "3600"},
+            )
+        return FakeResponse({"data": {}}, headers={"x-ratelimit-remaining": "100"})
+
+    client = GitHubClient()
+    client.session = FakeSession(handler)
+    pool = as_auth("a, b,c")
+    assert pool.tokens == ["a", "b", "c"]
+    # The budget of "a" is used up until the next hour
+    client.rate_limit.update(("a", "graphql"), remaining=0, reset=time.time() + 3600)
+
+    for _ in range(4):
+        assert client.graphql("{}", auth=pool).json() == {"data": {}}
+    # Requests go to "b" and "c" until "b" is rate limited. It is then set
+    # aside, and the request is retried with "c" rather than waiting an hour
+    assert used == ["b", "b", "c", "c", "c"]
+
+
+def test_nested_connections_are_completed():
+    def comment(login):
+        return {"node": {"author": {"login": login, "__typename": "User"}}}
+
+    def page(logins, cursor=None):
+        return {
+            "pageInfo": {"hasPreviousPage": cursor is not None, "startCursor": cursor},
+            "edges": [comment(login) for login in logins],
+        }
+
+    node = make_node(1)
+    node["comments"] = page(["carol"], cursor="c2")
+    pages = {
+        ("ID_1", "comments", "c2"): page(["bob"], cursor="c1"),
+        ("ID_1", "comments", "c1"): page(["alice"]),
+    }
+    client = FakeSearchClient({"query": [node]}, pages=pages)
+    qu = GitHubGraphQlQuery("query", auth="token", client=client)
+    qu.request()
+
+    comments = qu.data["comments"][0]
+    logins = [edge["node"]["author"]["login"] for edge in comments["edges"]]
+    assert logins == ["alice", "bob", "carol"]
+    assert len(client.queries) == 3
+
+
+def test_nested_pages_skip_deleted_items(monkeypatch, capsys):
+    monkeypatch.setattr("github_activity.graphql.PAGE_RETRY_WAIT", 0)
+
+    def comment(login):
+        return {"node": {"author": {"login": login, "__typename": "User"}}}
+
+    def page(logins, cursor=None):
+        return {
+            "pageInfo": {"hasPreviousPage": cursor is not None, "startCursor": cursor},
+            "edges": [comment(login) for login in logins],
+        }
+
+    nodes = [make_node(1), make_node(2)]
+    nodes[0]["comments"] = page(["bob"], cursor="c1")
+    nodes[1]["comments"] = page(["dave"], cursor="c1")
+    pages = {
+        ("ID_1", "comments", "c1"): page(["alice"]),
+        # The second item was deleted after the search
+        ("ID_2", "comments", "c1"): None,
+    }
+    client = FakeSearchClient({"query": nodes}, pages=pages)
+    serve = client.serve
+    failures = []
+
+    def serve_with_timeout(method, url, **kwargs):
+        # The first request for more comments times out
+        if "node(id:" in kwargs["json"]["query"] and not failures:
+            failures.append(kwargs["json"]["query"])
+            return FakeResponse({}, status_code=502)
+        return serve(method, url, **kwargs)
+
+    client.session = FakeSession(serve_with_timeout)
+    qu = GitHubGraphQlQuery("query", auth="token", client=client)
+    qu.request()
+
+    logins = [
+        [edge["node"]["author"]["login"] for edge in comments["edges"]]
+        for comments in qu.data["comments"]
+    ]
+    # The deleted item keeps the comments it was found with
+    assert logins == [["alice", "bob"], ["dave"]]
+    assert failures
+    assert "Could not fetch more comments" in capsys.readouterr().err
+
+
+def test_page_size_adapts_to_timeouts():
+    nodes = [make_node(ii) for ii in range(60)]
+    client = FakeSearchClient({"query": nodes})
+    serve = client.serve
+
+    def serve_small_pages(method, url, **kwargs):
+        # Pages of more than 20 items time out
+        if int(re.search(r"first: (\d+)", kwargs["json"]["query"]).group(1)) > 20:
+            return FakeResponse({}, status_code=502)
+        return serve(method, url, **kwargs)
+
+    client.session = FakeSession(serve_small_pages)
+    qu = GitHubGraphQlQuery("query", auth="token", client=client)
+    qu.request(n_per_page=50)
+
+    assert qu.data["number"].tolist() == list(range(60))
+    assert qu.page_size.size < 50
+
+
+def test_query_profile_skips_fields():
+    profile = QueryProfile.for_changelog()
+    assert "reactions" not in profile.fields("PullRequest")
+    assert "commits" not in profile.fields("Issue")
+
+    node = make_node(1)
+    del node["reactions"]
+    client = FakeSearchClient({"query": [node]})
+    qu = GitHubGraphQlQuery("query", auth="token", client=client, profile=profile)
+    qu.request()
+    assert "reactions" not in client.queries[0]
+    assert qu.data["thumbsup"].isna().all()
+
+
+def test_rest_responses_are_revalidated(tmp_path):
+    sent = []
+
+    def send(method, url, headers=None, **kwargs):
+        sent.append(headers)
+        if headers.get("If-None-Match") == '"v1"':
+            return FakeResponse({}, status_code=304)
+        return FakeResponse({"sha": "abc"}, headers={"etag": '"v1"'})
+
+    store = ValidatorStore(tmp_path)
+    url = "https://api.github.com/repos/org/repo/commits/main"
+    for _ in range(2):
+        response = store.request(send, "GET", url, auth=TokenAuth("token"))
+        assert response.json() == {"sha": "abc"}
+    assert sent == [{}, {"If-None-Match": '"v1"'}]
+
+    # Immutable responses are only ever fetched once
+    url = "https://api.github.com/repos/org/repo/commits/v1.0.0"
+    for _ in range(2):
+        store.request(send, "GET", url, immutable=True, auth=TokenAuth("token"))
+    assert len(sent) == 3
+
+
+def test_response_cache(tmp_path):
+    sent = []
+
+    def send(method, url, **kwargs):
+        sent.append(kwargs["json"])
+        return FakeResponse({"data": {"page": len(sent)}})
+
+    cache = ResponseCache(tmp_path, ttl=None)
+    auth = TokenAuth("token")
+    for _ in range(2):
+        response = cache.request(send, "POST", "url", json={"query": "q1"}, auth=auth)
+        assert response.json() == {"data": {"page": 1}}
+    cache.request(send, "POST", "url", json={"query": "q2"}, auth=auth)
+    assert len(sent) == 2
+
+    # Replay-only caches never send requests, and serve any token
+    replay = ResponseCache(tmp_path, replay=True)
+    other = TokenAuth("other")
+    assert replay.request(send, "POST", "url", json={"query": "q2"}, auth=other)
+    with pytest.raises(ValueError, match="replay-only"):
+        replay.request(send, "POST", "url", json={"query": "q3"}, auth=auth)
+
+    # Unless responses are kept apart by token
+    per_token = ResponseCache(tmp_path, ttl=None, per_token=True)
+    per_token.request(send, "POST", "url", json={"query": "q1"}, auth=other)
+    assert len(sent) == 3
+
+    # The least recently used responses are evicted to keep the cache small
+    small = ResponseCache(tmp_path, max_size=1)
+    small.request(send, "POST", "url", json={"query": "q4"}, auth=auth)
+    assert len(list(tmp_path.glob("*/*.json.gz"))) == 0
+
+
+def test_offline_replay_needs_no_token(tmp_path, monkeypatch):
+    nodes = [make_node(ii) for ii in range(3)]
+    client = FakeSearchClient(
+        lambda search: nodes, response_cache=ResponseCache(tmp_path)
+    )
+    recorded = get_activity("org", since="2021-01-01", auth="token", client=client)
+
+    # No token can be found, and "now" has moved on since the recording
+    for name in ["GITHUB_ACCESS_TOKEN", "GITHUB_TOKEN"]:
+        monkeypatch.delenv(name, raising=False)
+
+    def no_gh(*args, **kwargs):
+        raise FileNotFoundError("gh")
+
+    monkeypatch.setattr("github_activity.github_activity.run", no_gh)
+    time.sleep(1)
+    client = FakeSearchClient(
+        lambda search: [], response_cache=ResponseCache(tmp_path, replay=True)
+    )
+    replayed = get_activity("org", since="2021-01-01", client=client)
+    assert client.queries == []
+    pd.testing.assert_frame_equal(replayed, recorded)
+
+
+def test_repository_prelude(monkeypatch):
+    monkeypatch.setattr("github_activity.github_activity._PRELUDE_CACHE", {})
+    queries = []
+
+    def serve(method, url, **kwargs):
+        query = kwargs["json"]["query"]
+        queries.append(query)
+        if 'name: "missing"' in query:
+            return FakeResponse(
+                {"data": {"repository": None}, "errors": [{"type": "NOT_FOUND"}]}
+            )
+        objects = {
+            "v1.0": {"target": {"committedDate": "2021-01-01T00:00:00Z"}},
+            "main": {"committedDate": "2021-02-01T00:00:00Z"},
+        }
+        repository = {
+            "latestRelease": {
+                "tagName": "v1.1",
+                "name": "1.1",
+                "publishedAt": "2021-01-15T00:00:00Z",
+                "tagCommit": {"committedDate": "2021-01-15T00:00:00Z"},
+            }
+        }
+        for alias, ref in re.findall(r'(\w+): object\(expression: "([^"]+)"\)', query):
+            repository[alias] = objects.get(ref)
+        return FakeResponse({"data": {"repository": repository}})
+
+    client = GitHubClient()
+    client.session = FakeSession(serve)
+
+    prelude = run_sync(
+        _get_repository_prelude(
+            "org", "repo", ["v1.0", "main", "2021-03-01"], "token", client=client
+        )
+    )
+    assert len(queries) == 1
+    assert prelude["latestRelease"]["tagName"] == "v1.1"
+    assert prelude["refs"]["v1.0"].month == 1
+    assert prelude["refs"]["main"].month == 2
+    assert prelude["refs"]["2021-03-01"] is None
+
+    # References that were already resolved, including the latest release,
+    # don't cost another request
+    run_sync(_get_repository_prelude("org", "repo", ["v1.1", "main"], "token", client))
+    assert len(queries) == 1
+    dt, is_ref = run_sync(
+        _get_datetime_and_type(
+            "org", "repo", "2021-03-01", "token", client=client, prelude=prelude
+        )
+    )
+    assert (dt.month, is_ref) == (3, False)
+
+    with pytest.raises(RepositoryNotFoundError, match="not found"):
+        run_sync(_get_repository_prelude("org", "missing", ["main"], "token", client))
+
+
+def test_repository_prelude_with_token_pool(monkeypatch):
+    monkeypatch.setattr("github_activity.github_activity._PRELUDE_CACHE", {})
+    client = FakeSearchClient(lambda search: [make_node(1)])
+    serve = client.serve
+
+    def serve_prelude(method, url, **kwargs):
+        assert method == "POST", "fell back to the REST API"
+        query = kwargs["json"]["query"]
+        if "repository(owner:" not in query:
+            return serve(method, url, **kwargs)
+        repository = {"latestRelease": None}
+        for alias in re.findall(r"(\w+): object\(expression:", query):
+            repository[alias] = {"committedDate": "2021-01-01T00:00:00Z"}
+        return FakeResponse({"data": {"repository": repository}})
+
+    client.session = FakeSession(serve_prelude)
+    data = get_activity(
+        "org/repo", since="main", auth=["token1", "token2"], client=client
+    )
+    assert data["number"].tolist() == [1]
+    assert data.since_is_git_ref
+
+
+def test_repository_prelude_falls_back_on_bad_responses(monkeypatch):
+    monkeypatch.setattr("github_activity.github_activity._PRELUDE_CACHE", {})
+    client = FakeSearchClient(lambda search: [make_node(1)])
+    serve = client.serve
+    fallbacks = []
+
+    class ProxyErrorPage(FakeResponse):
+        def json(self):
+            raise requests.exceptions.JSONDecodeError("Expecting value", "<html>", 0)
+
+    def serve_proxy_error(method, url, **kwargs):
+        if method != "POST":
+            fallbacks.append(method)
+        elif "repository(owner:" in kwargs["json"]["query"]:
+            return ProxyErrorPage({})
+        return serve(method, url, **kwargs)
+
+    client.session = FakeSession(serve_proxy_error)
+    data = get_activity(
+        "org/repo", "2021-01-01", "2021-02-01", auth="token", client=client
+    )
+    assert data["number"].tolist() == [1]
+    assert "HEAD" in fallbacks
+
+
+def updated_between(nodes):
+    """Return a search function that serves the nodes updated in its window."""
+
+    def search(query):
+        window = re.search(r"updated:(\S+)\.\.(\S+)", query).groups()
+        return [node for node in nodes if window[0] <= node["updatedAt"] <= window[1]]
+
+    return search
+
+
+def test_sync_fetches_only_updates(tmp_path, checkpoint_dir):
+    nodes = [make_node(ii) for ii in range(3)]
+    client = FakeSearchClient(updated_between(nodes))
+    path_cache = tmp_path.joinpath("data")
+
+    assert sync_activity(["org/repo"], auth="token", cache=path_cache, client=client)
+    nodes[1].update(title="Item 1, renamed", updatedAt="2021-02-01T00:00:00Z")
+    assert sync_activity(["org/repo"], auth="token", cache=path_cache, client=client)
+    # The second sync only asks for what changed since the first
+    assert "updated:2021-01-03T00:00:00Z.." in client.queries[-2]
+
+    prs = load_from_cache("org/repo", "prs", path_cache)
+    assert sorted(prs["title"]) == ["Item 0", "Item 1, renamed", "Item 2"]
+    assert _load_watermark(path_cache, "org", "repo") == "2021-02-01T00:00:00Z"
+
+
+def test_large_syncs_are_complete(tmp_path, checkpoint_dir):
+    start = datetime.datetime(2021, 1, 1)
+    nodes = []
+    for ii in range(SEARCH_RESULT_CAP + 500):
+        node = make_node(ii)
+        node["updatedAt"] = f"{start + datetime.timedelta(hours=ii):%Y-%m-%dT%H:%M:%SZ}"
+        nodes.append(node)
+    client = FakeSearchClient(updated_between(nodes))
+    path_cache = tmp_path.joinpath("data")
+
+    # The sync is split into windows that each return fewer results than the cap
+    sync_activity(["org/repo"], auth="token", cache=path_cache, client=client)
+    prs = load_from_cache("org/repo", "prs", path_cache)
+    assert sorted(prs["number"]) == list(range(len(nodes)))
+    watermark = _load_watermark(path_cache, "org", "repo")
+    assert watermark == nodes[-1]["updatedAt"]
+
+    # If some items can't be fetched, the watermark stays where it was
+    nodes.extend(make_node(len(nodes) + ii) for ii in range(SEARCH_RESULT_CAP + 1))
+    for node in nodes[-SEARCH_RESULT_CAP - 1 :]:
+        node["updatedAt"] = "2021-06-01T00:00:00Z"
+    sync_activity(["org/repo"], auth="token", cache=path_cache, client=client)
+    assert _load_watermark(path_cache, "org", "repo") == watermark
+
+
+def test_organizations_are_fetched_per_repository():
+    repositories = [
+        {"name": "lib1", "isArchived": False, "pushedAt": "2021-01-05T00:00:00Z"},
+        {"name": "lib2", "isArchived": False, "pushedAt": "2021-01-05T00:00:00Z"},
+        {"name": "lib3", "isArchived": True, "pushedAt": "2021-01-05T00:00:00Z"},
+        {"name": "docs", "isArchived": False, "pushedAt": "2021-01-05T00:00:00Z"},
+    ]
+
+    def results(search):
+        repo = re.search(r"repo:org/(\w+)", search).group(1)
+        if "closed:" in search:
+            return []
+        nodes = [make_node(ii) for ii in range(2)]
+        for node in nodes:
+            node["id"] += repo
+            node["url"] = node["url"].replace("/repo/", f"/{repo}/")
+        return nodes
+
+    client = FakeSearchClient(results)
+    serve = client.serve
+
+    def serve_org(method, url, **kwargs):
+        if method == "POST" and "repositoryOwner" in kwargs["json"]["query"]:
+            page = {"nodes": repositories, "pageInfo": {"hasNextPage": False}}
+            return FakeResponse({"data": {"repositoryOwner": {"repositories": page}}})
+        return serve(method, url, **kwargs)
+
+    client.session = FakeSession(serve_org)
+    data = get_activity(
+        "org",
+        "2021-01-01",
+        "2021-02-01",
+        auth="token",
+        client=client,
+        repositories=RepositoryFilter(pattern="lib*"),
+        max_workers=1,
+    )
+    assert sorted(set(data["repo"])) == ["lib1", "lib2"]
+    assert len(data) == 4
+
+
+def test_repository_backend_matches_search():
+    # Items 0-5 were updated in the window, most recently first, and were
+    # created in it except for item 2. Items 6-9 are older.
+    nodes = []
+    for ii in range(10):
+        node = make_node(ii)
+        node["updatedAt"] = f"2021-01-{20 - ii:02}T00:00:00Z"
+        node["createdAt"] = node["closedAt"] = f"2021-01-{20 - ii:02}T00:00:00Z"
+        nodes.append(node)
+    nodes[2]["createdAt"] = "2020-12-01T00:00:00Z"
+    nodes[2]["closedAt"] = None
+    requested = []
+
+    def serve(method, url, **kwargs):
+        query = kwargs["json"]["query"]
+        data = {}
+        pattern = r'(pullRequests|issues): \1\(first: (\d+)(?:, after: "(\d+)")?'
+        for name, first, after in re.findall(pattern, query):
+            items = nodes if name == "pullRequests" else []
+            start = int(after) if after else 0
+            end = start + int(first)
+            requested.append((name, start))
+            data[name] = {
+                "pageInfo": {"endCursor": str(end), "hasNextPage": end < len(items)},
+                "nodes": items[start:end],
+            }
+        return FakeResponse({"data": {"repository": data}})
+
+    client = GitHubClient()
+    client.session = FakeSession(serve)
+    qu = GitHubRepositoryQuery(
+        "org",
+        "repo",
+        "2021-01-15T00:00:00Z",
+        "2021-01-31T00:00:00Z",
+        auth="token",
+        client=client,
+        display_progress=False,
+    )
+    qu.request(n_per_page=4, adaptive=False)
+    # Paging stops at the first item updated before the window
+    assert requested == [("pullRequests", 0), ("issues", 0), ("pullRequests", 4)]
+
+    window = [node for ii, node in enumerate(nodes) if ii in (0, 1, 3, 4, 5)]
+    search = GitHubGraphQlQuery(
+        "query",
+        auth="token",
+        client=FakeSearchClient({"query": window}),
+        display_progress=False,
+    )
+    search.request()
+    pd.testing.assert_frame_equal(qu.data, search.data)
+
+
+def test_filters_are_pushed_into_searches():
+    backport = make_node(1)
+    backport["baseRefName"] = "1.x"
+    bot = make_node(2, author="dependabot")
+    issue = make_node(3, kind="issue")
+    client = FakeSearchClient(lambda search: [make_node(0), backport, bot, issue])
+    data = get_activity(
+        "org/repo",
+        "2021-01-01",
+        "2021-02-01",
+        auth="token",
+        client=client,
+        branch="main",
+        exclude_authors=["app/dependabot"],
+    )
+    searches = re.findall(r'query: "([^"]*)"', client.queries[-1])
+    assert [search.split(" created:")[0] for search in searches[::2]] == [
+        "repo:org/repo type:pr base:main -author:app/dependabot",
+        "repo:org/repo type:issue -author:app/dependabot",
+    ]
+    # What the searches should have left out is dropped anyway
+    assert data["number"].tolist() == [0, 3]